@@ -0,0 +1,141 @@
+"""Benchmark: fanning one new post out to many category subscribers.
+
+    python bench_fanout.py --subscribers 50000 --out bench-fanout.json
+    python bench_fanout.py --latency-ms 30 --restart-after 2
+
+The bot (test.py) is loaded as loadtest.py loads it, on a throwaway
+database. --subscribers users are subscribed to one category, and one post
+is created there. The bot's NotificationFanout then delivers it through a
+fake Bot API that takes --latency-ms per send and answers Forbidden for
+every --blocked-every-th chat. Pacing is off by default (--rate 0), so the
+run measures the fan-out itself rather than the FANOUT_RATE budget; the
+time the configured rate would take is reported next to it. With
+--restart-after, the fan-out is stopped after that many seconds and a fresh
+one resumes from the outbox. Any message a user gets twice is counted.
+
+Reported: wall time and sends per second, sent/failed/unsubscribed,
+duplicates, and the event loop's worst lag while the fan-out ran. The lag
+shows what screen handlers on the same loop would have felt. Results are
+written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from loadtest import load_bot
+
+CATEGORY = "massage"
+CREATOR = 1
+
+
+class FakeBot:
+    rate_limiter = None
+
+    def __init__(self, latency: float, blocked_every: int, forbidden):
+        self.latency = latency
+        self.blocked_every = blocked_every
+        self.forbidden = forbidden
+        self.received = {}
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.blocked_every and chat_id % self.blocked_every == 0:
+            raise self.forbidden("Forbidden: bot was blocked by the user")
+        self.received[chat_id] = self.received.get(chat_id, 0) + 1
+
+
+async def loop_lag(samples: list, interval: float = 0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def bench(bot, args):
+    from telegram.error import Forbidden
+
+    start = time.perf_counter()
+    for uid in range(1, args.subscribers + 1):
+        bot.storage.set_subscription(uid, CATEGORY, "ru" if uid % 2 else "en", True)
+    seed_s = time.perf_counter() - start
+
+    fake = FakeBot(args.latency_ms / 1000, args.blocked_every, Forbidden)
+    fanout = bot.NotificationFanout(rate=args.rate)
+    bot.notification_fanout = fanout
+    await fanout.start(fake)
+    lag = []
+    lag_task = asyncio.create_task(loop_lag(lag))
+
+    start = time.perf_counter()
+    await bot.create_post(CATEGORY, "Relaxing massage near the park", CREATOR, "bench")
+    restarts = 0
+    if args.restart_after:
+        await asyncio.sleep(args.restart_after)
+        await fanout.stop()
+        sent, failed, unsubscribed = fanout.sent, fanout.failed, fanout.unsubscribed
+        fanout = bot.NotificationFanout(rate=args.rate)
+        fanout.sent, fanout.failed, fanout.unsubscribed = sent, failed, unsubscribed
+        bot.notification_fanout = fanout
+        await fanout.start(fake)
+        restarts = 1
+    while await bot.pending_notifications():
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    lag_task.cancel()
+    await fanout.stop()
+
+    blocked = args.subscribers // args.blocked_every if args.blocked_every else 0
+    return {
+        "seed_s": round(seed_s, 1),
+        "elapsed_s": round(elapsed, 2),
+        "sends_per_s": round((fanout.sent + fanout.unsubscribed) / elapsed, 1),
+        "at_fanout_rate_s": round((args.subscribers - 1) / bot.FANOUT_RATE, 1) if bot.FANOUT_RATE > 0 else None,
+        "sent": fanout.sent,
+        "failed": fanout.failed,
+        "unsubscribed": fanout.unsubscribed,
+        "expected": {"sent": args.subscribers - 1 - blocked, "unsubscribed": blocked},
+        "duplicates": sum(n - 1 for n in fake.received.values()),
+        "creator_notified": CREATOR in fake.received,
+        "restarts": restarts,
+        "loop_lag_ms": {"max": round(max(lag, default=0) * 1000, 1), "mean": round(sum(lag) / len(lag) * 1000, 2) if lag else None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--bot", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py"))
+    parser.add_argument("--subscribers", type=int, default=50000, help="users subscribed to the category")
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated Bot API time per send")
+    parser.add_argument("--blocked-every", type=int, default=1000, help="every n-th chat has blocked the bot (0: none)")
+    parser.add_argument("--rate", type=float, default=0, help="fan-out sends per second (0: unpaced)")
+    parser.add_argument("--restart-after", type=float, default=0, help="seconds before the fan-out is stopped and resumed")
+    parser.add_argument("--storage", choices=["sqlite", "memory", "postgres"], default="sqlite")
+    parser.add_argument("--out", default="bench-fanout.json")
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-fanout-"), "posts.db")
+    os.environ["STORAGE"] = args.storage
+    bot = load_bot(args.bot)
+    bot.init_db()
+    result = asyncio.run(bench(bot, args))
+    bot.storage.close()
+    result = {
+        "config": {
+            "subscribers": args.subscribers, "latency_ms": args.latency_ms, "blocked_every": args.blocked_every, "rate": args.rate,
+            "batch_size": bot.FANOUT_BATCH_SIZE, "concurrency": bot.FANOUT_CONCURRENCY, "storage": args.storage,
+        },
+        **result,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
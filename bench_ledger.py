@@ -0,0 +1,114 @@
+"""Benchmark: wallet ledger writes per second.
+
+    python bench_ledger.py --writes 20000 --users 1000 --out bench-ledger.json
+    POSTGRES_DSN=postgresql://... python bench_ledger.py --storage postgres
+
+The bot (test.py) is loaded as loadtest.py loads it, on a throwaway database.
+Every write is one wallet transaction: the balance snapshot update and the
+ledger row in one commit. Writes are timed four ways:
+
+- engine: wallet_transaction called directly, with no db thread
+- sequential: the bot's topup_user awaited one at a time
+- concurrent: keyed charges and top-ups through the db thread (the bot's
+  wallet_transaction task), --concurrency in flight
+- paid_posts: publish_paid_post, which adds a post to the same transaction
+
+Each snapshot is then checked against its last ledger row. Finally the
+whole ledger is folded into checkpoints with compact_ledger. Results are
+written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from loadtest import load_bot
+
+
+async def bench(bot, args):
+    users = args.users
+    for uid in range(1, users + 1):
+        await bot.ensure_user(uid)
+    results = {}
+
+    n = args.writes
+    start = time.perf_counter()
+    for i in range(n):
+        bot.storage.wallet_transaction(1 + i % users, 1, "topup")
+    results["engine"] = round(n / (time.perf_counter() - start), 1)
+
+    start = time.perf_counter()
+    for i in range(n):
+        await bot.topup_user(1 + i % users, 1)
+    results["sequential"] = round(n / (time.perf_counter() - start), 1)
+
+    def write(i):
+        if i % 2:
+            return bot._wallet_transaction(1 + i % users, -1, "charge", f"charge:{i}")
+        return bot.topup_user(1 + i % users, 1, f"topup:{i}")
+
+    start = time.perf_counter()
+    for lo in range(0, n, args.concurrency):
+        await asyncio.gather(*(write(i) for i in range(lo, min(n, lo + args.concurrency))))
+    results["concurrent"] = round(n / (time.perf_counter() - start), 1)
+
+    posts = n // 10
+    start = time.perf_counter()
+    for lo in range(0, posts, args.concurrency):
+        await asyncio.gather(*(
+            bot.publish_paid_post("nails", f"paid post {i}", 1 + i % users, None, 1, 3600, f"post:{i}")
+            for i in range(lo, min(posts, lo + args.concurrency))
+        ))
+    results["paid_posts"] = round(posts / (time.perf_counter() - start), 1)
+
+    # every snapshot must equal the balance_after of the user's latest entry
+    mismatches = 0
+    for uid in range(1, users + 1):
+        if await bot.get_balance(uid) != (await bot.get_ledger(uid, 1))[0][4]:
+            mismatches += 1
+
+    # in LEDGER_COMPACT_BATCH users per transaction, as the bot's compactor does
+    cutoff = int(time.time()) + 1
+    compacted = 0
+    start = time.perf_counter()
+    while True:
+        n = await bot.compact_ledger(cutoff)
+        if not n:
+            break
+        compacted += n
+    compact_s = time.perf_counter() - start
+    return {
+        "writes_per_s": results,
+        "snapshot_mismatches": mismatches,
+        "compact": {"rows": compacted, "rows_per_s": round(compacted / compact_s, 1) if compact_s else None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--bot", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py"))
+    parser.add_argument("--writes", type=int, default=20000, help="ledger writes per run")
+    parser.add_argument("--users", type=int, default=1000, help="wallets the writes are spread over")
+    parser.add_argument("--concurrency", type=int, default=100, help="writes in flight in the concurrent runs")
+    parser.add_argument("--storage", choices=["sqlite", "memory", "postgres"], default="sqlite")
+    parser.add_argument("--out", default="bench-ledger.json")
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-ledger-"), "posts.db")
+    os.environ["STORAGE"] = args.storage
+    bot = load_bot(args.bot)
+    bot.init_db()
+    result = asyncio.run(bench(bot, args))
+    bot.storage.close()
+    result = {"config": {"writes": args.writes, "users": args.users, "concurrency": args.concurrency, "storage": args.storage}, **result}
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
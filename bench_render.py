@@ -0,0 +1,117 @@
+"""Microbenchmarks for the bot's render functions.
+
+    python bench_render.py --posts 2000 --out bench-render.json
+
+The bot (test.py) is loaded as loadtest.py loads it. --posts posts are seeded
+into a throwaway SQLite file and the post cache is loaded from them, as at
+startup. Each render function is then timed on its own, the best of --repeat
+rounds, and reported in microseconds per call. Where a function has a cache
+(static keyboards, the categories keyboard, rendered listing pages), the cached
+call and a build from scratch are both timed, so the saving is visible.
+Results are written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import timeit
+
+from loadtest import load_bot
+
+
+def best_us(fn, repeat: int) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return round(min(timer.repeat(repeat, number)) / number * 1e6, 3)
+
+
+def best_us_async(loop, fn, repeat: int, number: int = 2000) -> float:
+    async def rounds():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                await fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    return round(loop.run_until_complete(rounds()) / number * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--bot", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py"))
+    parser.add_argument("--posts", type=int, default=2000, help="posts seeded before timing")
+    parser.add_argument("--lang", default="ru", help="locale to render (ru exercises the English fallback)")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per function; the best is reported")
+    parser.add_argument("--out", default="bench-render.json")
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-render-"), "posts.db")
+    os.environ["STORAGE"] = "sqlite"
+    bot = load_bot(args.bot)
+    import storage
+
+    bot.init_db()
+    rnd = random.Random(1)
+    for i in range(args.posts):
+        category = rnd.choice(bot.CATEGORIES)
+        photo = (f"file-{i}", f"image-{i}") if i % 4 == 0 else None
+        bot.storage.insert_post(category, f"post {i} " + "lorem ipsum " * rnd.randint(1, 40), rnd.randint(1, 500), "user", 7200, photo)
+    bot.post_cache.load(reversed(bot.storage.get_all_posts()))
+    bot.compile_keyboards()
+
+    lang = args.lang
+    category = max(bot.CATEGORIES, key=lambda c: len(bot.storage.get_posts(c)))
+    loop = asyncio.new_event_loop()
+    counts = dict(loop.run_until_complete(bot.get_category_counts(int(time.time()))))
+    all_rows, _, _ = loop.run_until_complete(bot.get_posts_page(None))
+    cat_rows, _, _ = loop.run_until_complete(bot.get_posts_page(category))
+    long_text = "lorem ipsum " * 200
+    markup = bot.list_all_posts_markup(all_rows, lang)
+    subscribed = set(bot.CATEGORIES[::2])
+
+    def render_listing_miss():
+        bot._listing_cache.clear()
+        return bot.render_listing(category, ("n", None), lang)
+
+    loop.run_until_complete(bot.render_listing(category, ("n", None), lang))
+    loop.run_until_complete(bot.build_categories_markup(lang))
+    r = args.repeat
+    results = {
+        "texts": best_us(lambda: bot.texts(lang), r),
+        "category_label": best_us(lambda: bot.category_label(lang, category), r),
+        "make_preview": best_us(lambda: storage.make_preview(long_text), r),
+        "static_keyboard:create_duration": best_us(lambda: bot.static_keyboard("create_duration", lang, category), r),
+        "build:create_duration": best_us(lambda: bot._create_duration_markup(lang, category), r),
+        "static_keyboard:language": best_us(lambda: bot.static_keyboard("language", lang), r),
+        "build:language": best_us(lambda: bot._language_markup(lang), r),
+        "static_keyboard:profile": best_us(lambda: bot.static_keyboard("profile", lang), r),
+        "build:profile": best_us(lambda: bot._profile_markup(lang), r),
+        "build_categories_markup:cached": best_us_async(loop, lambda: bot.build_categories_markup(lang), r),
+        "build:categories": best_us(lambda: bot._categories_markup(lang, counts), r),
+        "list_all_posts_markup": best_us(lambda: bot.list_all_posts_markup(all_rows, lang, "p:1:1", "n:1:1"), r),
+        "list_posts_markup": best_us(lambda: bot.list_posts_markup(category, cat_rows, lang, "p:1:1", "n:1:1", 3), r),
+        "render_listing:hit": best_us_async(loop, lambda: bot.render_listing(category, ("n", None), lang), r),
+        "render_listing:miss": best_us_async(loop, render_listing_miss, r),
+        "subscriptions_markup": best_us(lambda: bot.subscriptions_markup(lang, subscribed), r),
+        "screen_digest": best_us(lambda: bot._screen_digest("posts", markup), r),
+    }
+    loop.close()
+    storage.close_db()
+    result = {
+        "config": {"posts": args.posts, "lang": lang, "category": category, "page_size": bot.POSTS_PAGE_SIZE, "repeat": r},
+        "us_per_call": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark: search_posts latency with a large posts table.
+
+    python bench_search.py --posts 100000 --out bench-search.json
+    POSTGRES_DSN=postgresql://... python bench_search.py --storage postgres
+
+--posts posts are seeded with texts drawn from a Zipf-like vocabulary, so
+some words are in most posts and some in a handful. Then search_posts runs
+--queries times for each kind of query: a common word, a rare word, two
+words, a short prefix that expands to many words, a word that matches
+nothing, and the common word five pages deep. Reported per kind: latency
+p50/p95/p99/max in ms and the rows of the first result page. The storage
+engine is called directly, without the bot or the db thread. Results are
+written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from loadtest import percentiles
+
+VOCABULARY = 5000
+
+
+def word(i: int) -> str:
+    # distinct, pronounceable words: w0 -> "ba", w1 -> "be", ...
+    syllables = "ba be bi bo bu da de di do du ka ke ki ko ku la le li lo lu ma me mi mo mu".split()
+    out = []
+    while True:
+        out.append(syllables[i % len(syllables)])
+        i //= len(syllables)
+        if not i:
+            return "".join(out)
+
+
+def seed(engine, storage, n: int, rnd: random.Random):
+    weights = [1 / (rank + 1) for rank in range(VOCABULARY)]
+    words = [word(i) for i in range(VOCABULARY)]
+    categories = ["nails", "makeup", "massage", "hair", "brows", "spa"]
+
+    def text():
+        return " ".join(rnd.choices(words, weights, k=rnd.randint(5, 40)))
+
+    if isinstance(engine, storage.SqliteStorage):
+        # the engine's own insert, but one commit per 10k rows
+        conn = storage.get_db()
+        cur = conn.cursor()
+        for i in range(n):
+            storage._insert_post_row(cur, rnd.choice(categories), text(), rnd.randint(1, 5000), None, 86400, None)
+            if i % 10000 == 9999:
+                conn.commit()
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+    else:
+        for _ in range(n):
+            engine.insert_post(rnd.choice(categories), text(), rnd.randint(1, 5000), None, 86400)
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--posts", type=int, default=100000, help="posts seeded before timing")
+    parser.add_argument("--queries", type=int, default=200, help="searches per kind of query")
+    parser.add_argument("--storage", choices=["sqlite", "memory", "postgres"], default="sqlite")
+    parser.add_argument("--out", default="bench-search.json")
+    args = parser.parse_args()
+
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-search-"), "posts.db")
+    os.environ["STORAGE"] = args.storage
+    import storage
+
+    engine = storage.make_storage()
+    engine.migrate()
+    rnd = random.Random(1)
+    start = time.perf_counter()
+    words = seed(engine, storage, args.posts, rnd)
+    seed_s = time.perf_counter() - start
+
+    kinds = {
+        "common_word": lambda: (words[rnd.randint(0, 4)], 0),
+        "rare_word": lambda: (words[rnd.randint(VOCABULARY // 2, VOCABULARY - 1)], 0),
+        "two_words": lambda: (f"{words[rnd.randint(0, 50)]} {words[rnd.randint(50, 500)]}", 0),
+        "short_prefix": lambda: (words[rnd.randint(0, 25)][:2], 0),
+        "no_match": lambda: ("zzzz", 0),
+        "common_word_page_5": lambda: (words[rnd.randint(0, 4)], 5),
+    }
+    results = {}
+    for kind, query in kinds.items():
+        latencies, rows = [], []
+        for _ in range(args.queries):
+            terms, page = query()
+            t = time.perf_counter()
+            found = engine.search_posts(terms, page)
+            latencies.append((time.perf_counter() - t) * 1000)
+            rows.append(len(found))
+        results[kind] = {"latency_ms": percentiles(latencies), "rows_p50": sorted(rows)[len(rows) // 2]}
+    engine.close()
+
+    result = {
+        "config": {"posts": args.posts, "queries": args.queries, "storage": args.storage, "page_size": storage.POSTS_PAGE_SIZE},
+        "seed_s": round(seed_s, 1),
+        "search": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,499 @@
+"""Load test: the bot's real Application against a local fake Bot API server.
+
+    python loadtest.py --users 2000 --duration 60 --out loadtest-results.json
+    python loadtest.py --mode webhook --users 2000 --duration 60 --out loadtest-webhook.json
+
+The fake server (getUpdates, sendMessage, editMessageText, deleteMessage(s),
+answerCallbackQuery, ...) and the virtual users run on their own event loop
+in a background thread; the bot runs on the main loop exactly as in main(),
+talking to the fake server over HTTP. With --mode webhook the bot listens
+for updates instead (Updater.start_webhook, as run_webhook does) and the fake
+server POSTs each update to it over up to --webhook-connections keep-alive
+connections, like Telegram's max_connections. Each virtual user does /start once and
+then loops lang -> cat -> view -> profile -> create -> create2 -> post text,
+picking buttons from the last screen the bot showed it and waiting for each
+update to finish before the next click.
+
+Reported: handler latency (update handed out by getUpdates or POSTed to the
+webhook -> all handlers done, so including time queued behind the user's
+previous update)
+p50/p95/p99 overall and per step, the bot's own per-handler timings,
+updates per second, Bot API calls per update and SQLite statements per
+update. Results are written as JSON to --out and stdout; the bot's own
+diagnostics (slow handlers, failures) are logged to stderr, so stdout can be
+piped straight into jq.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import importlib.util
+from urllib.parse import parse_qsl, urlsplit
+
+TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+# requests that are bookkeeping rather than work caused by an update
+CONTROL_METHODS = {"getMe", "getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo", "setMyCommands", "close", "logOut"}
+WEBHOOK_SECRET = "loadtest-secret"
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1], 3)}
+
+
+class FakeBotApi:
+    """Just enough of the Bot API over HTTP/1.1 keep-alive for the bot to run."""
+
+    def __init__(self):
+        self.loop = None
+        self.port = None
+        self.server = None
+        self.calls = {}
+        self.screens = {}  # chat_id -> (message_id, reply_markup dict)
+        self.sent_at = {}  # update_id -> perf_counter when handed to getUpdates or POSTed
+        self.webhook_errors = 0
+        self._queue = []
+        self._webhook = None  # asyncio.Queue of updates to POST once setWebhook was called
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._have_updates = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._have_updates = asyncio.Event()
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def push(self, update: dict) -> int:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        update["update_id"] = update_id
+        if self._webhook is not None:
+            self._webhook.put_nowait(update)
+            return update_id
+        self._queue.append(update)
+        self._have_updates.set()
+        return update_id
+
+    def new_message_id(self) -> int:
+        self._next_message_id += 1
+        return self._next_message_id
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                _, path, _ = line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode().partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                params = self._params(headers.get("content-type", ""), body)
+                result = await self._call(path.rsplit("/", 1)[-1], params)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError: stop() at the end of a run
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _params(content_type: str, body: bytes) -> dict:
+        if not body:
+            return {}
+        if "json" in content_type:
+            return json.loads(body)
+        params = {}
+        for k, v in parse_qsl(body.decode(), keep_blank_values=True):
+            # PTB sends non-string values JSON-encoded
+            try:
+                params[k] = json.loads(v)
+            except ValueError:
+                params[k] = v
+        return params
+
+    async def _call(self, method: str, params: dict):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "setWebhook":
+            self._set_webhook(params)
+            return True
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params["chat_id"])
+            message_id = int(params.get("message_id") or self.new_message_id())
+            markup = params.get("reply_markup")
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            self.screens[chat_id] = (message_id, markup)
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
+
+    def _set_webhook(self, params: dict):
+        self._webhook = asyncio.Queue()
+        for _ in range(int(params.get("max_connections") or 40)):
+            asyncio.ensure_future(self._deliver(params["url"], params.get("secret_token")))
+
+    async def _deliver(self, url: str, secret: str):
+        # one of the webhook connections: POST queued updates one at a time
+        parts = urlsplit(url)
+        reader = writer = None
+        while True:
+            update = await self._webhook.get()
+            body = json.dumps(update).encode()
+            request = (
+                f"POST {parts.path} HTTP/1.1\r\nHost: {parts.netloc}\r\nContent-Type: application/json\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n"
+            ).encode() + body
+            for attempt in range(2):
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+                    self.sent_at.setdefault(update["update_id"], time.perf_counter())
+                    writer.write(request)
+                    await writer.drain()
+                    status = await reader.readline()
+                    length = 0
+                    while True:
+                        h = await reader.readline()
+                        if h in (b"\r\n", b"\n", b""):
+                            break
+                        k, _, v = h.decode().partition(":")
+                        if k.strip().lower() == "content-length":
+                            length = int(v)
+                    await reader.readexactly(length)
+                    if b" 200 " not in status:
+                        self.webhook_errors += 1
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # the server closed a kept-alive connection; reconnect once
+                    writer = None
+                    if attempt:
+                        self.webhook_errors += 1
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        self._queue = [u for u in self._queue if u["update_id"] >= offset]
+        if not self._queue:
+            self._have_updates.clear()
+            try:
+                await asyncio.wait_for(self._have_updates.wait(), float(params.get("timeout") or 0) or 0.1)
+            except asyncio.TimeoutError:
+                return []
+        batch = self._queue[: int(params.get("limit") or 100)]
+        now = time.perf_counter()
+        for u in batch:
+            self.sent_at.setdefault(u["update_id"], now)
+        return batch
+
+
+class LoadGenerator:
+    def __init__(self, api: FakeBotApi, bot, args):
+        self.api = api
+        self.bot = bot
+        self.args = args
+        self.latencies = []
+        self.by_step = {}
+        self.timeouts = 0
+        self.updates = 0
+        self.waiting = {}  # update_id -> (future, step)
+        self.stop_at = None
+
+    def done(self, update_id: int):
+        # called from the bot's loop once every handler group has run
+        now = time.perf_counter()
+        self.api.loop.call_soon_threadsafe(self._finish, update_id, now)
+
+    def _finish(self, update_id: int, now: float):
+        entry = self.waiting.pop(update_id, None)
+        if entry is None:
+            return
+        future, step = entry
+        elapsed = (now - self.api.sent_at.pop(update_id, now)) * 1000
+        self.latencies.append(elapsed)
+        self.by_step.setdefault(step, []).append(elapsed)
+        if not future.done():
+            future.set_result(None)
+
+    async def send(self, step: str, update: dict):
+        future = self.api.loop.create_future()
+        update_id = self.api.push(update)
+        self.waiting[update_id] = (future, step)
+        self.updates += 1
+        try:
+            await asyncio.wait_for(future, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.waiting.pop(update_id, None)
+            self.timeouts += 1
+
+    def _user(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"vu{uid}", "username": f"vu{uid}", "language_code": "en"}
+
+    async def message(self, uid: int, step: str, text: str):
+        msg = {
+            "message_id": self.api.new_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self.send(step, {"message": msg})
+
+    async def click(self, uid: int, step: str, data: str):
+        message_id, _ = self.api.screens.get(uid, (self.api.new_message_id(), None))
+        query = {
+            "id": f"{uid}-{self.updates}",
+            "from": self._user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": BOT_USER,
+                "text": "screen",
+            },
+        }
+        if random.random() < self.args.double_tap:
+            # an impatient second tap right behind the first; nobody waits for it
+            self.api.loop.call_soon(self.api.push, {"callback_query": dict(query, id=f"{query['id']}-again")})
+        await self.send(step, {"callback_query": query})
+
+    def buttons(self, uid: int, prefix: str):
+        _, markup = self.api.screens.get(uid, (None, None))
+        rows = (markup or {}).get("inline_keyboard", [])
+        return [b["callback_data"] for row in rows for b in row if b.get("callback_data", "").startswith(prefix)]
+
+    async def think(self):
+        if self.args.think_ms:
+            await asyncio.sleep(random.uniform(0, 2 * self.args.think_ms) / 1000)
+
+    async def virtual_user(self, uid: int):
+        rnd = random.Random(uid)
+        await asyncio.sleep(rnd.uniform(0, self.args.ramp_up))
+        await self.message(uid, "start", "/start")
+        n = 0
+        while time.perf_counter() < self.stop_at:
+            n += 1
+            code = self.bot.cat_code(rnd.choice(self.bot.CATEGORIES))
+            await self.click(uid, "lang", f"lang:{rnd.choice(['en', 'ru'])}")
+            await self.think()
+            await self.click(uid, "cat", f"cat:{code}")
+            await self.think()
+            views = self.buttons(uid, "view:")
+            if views:
+                await self.click(uid, "view", rnd.choice(views))
+                await self.think()
+            await self.click(uid, "profile", "profile")
+            await self.think()
+            if rnd.random() < self.args.create_ratio:
+                await self.click(uid, "create", f"create:{code}")
+                await self.click(uid, "create2", f"create2:{code}")
+                await self.think()
+                await self.message(uid, "post_text", f"load test post {uid}-{n}")
+                await self.think()
+
+    async def run(self):
+        self.stop_at = time.perf_counter() + self.args.ramp_up + self.args.duration
+        await asyncio.gather(*(self.virtual_user(1_000_000 + i) for i in range(self.args.users)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def load_bot(path: str):
+    # the bot imports storage.py from its own directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    spec = importlib.util.spec_from_file_location("bot", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def run(args):
+    api = FakeBotApi()
+    ready = threading.Event()
+    api_loop = asyncio.new_event_loop()
+
+    def serve():
+        asyncio.set_event_loop(api_loop)
+        api_loop.run_until_complete(api.start())
+        ready.set()
+        api_loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["DB_PATH"] = os.path.join(workdir, "posts.db")
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{api.port}/bot"
+    os.environ["STORAGE"] = args.storage
+    if not args.rate_limit:
+        os.environ["RATE_LIMIT"] = "0"
+    bot = load_bot(args.bot)
+
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import storage
+
+    bot.init_db()
+    # seed posts so listings and view: have something to show
+    for i in range(args.posts):
+        bot._db_insert_post.sync(random.choice(bot.CATEGORIES), f"seed post {i} " + "x" * random.randint(10, 200), 1, "seed", 7 * 86400)
+
+    # SQL statements are counted for SQLite only; other engines report null
+    statements = [0]
+    if args.storage == "sqlite":
+        await bot.db_task(lambda: storage.get_db().set_trace_callback(lambda _: statements.__setitem__(0, statements[0] + 1)))()
+
+    gen = LoadGenerator(api, bot, args)
+    app = bot.build_application(TOKEN)
+
+    async def finished(update, context):
+        gen.done(update.update_id)
+
+    app.add_handler(TypeHandler(Update, finished), group=1)
+    await app.initialize()
+    await bot._post_init(app)
+    await app.start()
+    if args.mode == "webhook":
+        port = free_port()
+        await app.updater.start_webhook(
+            listen="127.0.0.1",
+            port=port,
+            url_path="telegram",
+            webhook_url=f"http://127.0.0.1:{port}/telegram",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=args.webhook_connections,
+        )
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=5)
+
+    api.calls.clear()
+    statements[0] = 0
+    started = time.perf_counter()
+    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(gen.run(), api_loop))
+    elapsed = time.perf_counter() - started
+
+    work_calls = {m: n for m, n in api.calls.items() if m not in CONTROL_METHODS}
+    db_statements = statements[0]
+    # same order as run_polling: shutdown() flushes persistence through the db
+    # thread, which _post_shutdown then closes
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    await bot._post_shutdown(app)
+    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(api.stop(), api_loop))
+    api_loop.call_soon_threadsafe(api_loop.stop)
+
+    updates = len(gen.latencies)
+    return {
+        "timestamp": int(time.time()),
+        "config": {
+            "mode": args.mode,
+            "users": args.users,
+            "duration_s": args.duration,
+            "ramp_up_s": args.ramp_up,
+            "think_ms": args.think_ms,
+            "posts": args.posts,
+            "create_ratio": args.create_ratio,
+            "double_tap": args.double_tap,
+            "rate_limit": args.rate_limit,
+            "storage": args.storage,
+            "nav_mode": bot.NAV_MODE,
+            "max_concurrent_updates": bot.MAX_CONCURRENT_UPDATES,
+        },
+        "updates": updates,
+        "timeouts": gen.timeouts,
+        "webhook_errors": api.webhook_errors,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(updates / elapsed, 1) if elapsed else None,
+        "latency_ms": percentiles(gen.latencies),
+        "latency_ms_by_step": {step: dict(count=len(v), **percentiles(v)) for step, v in sorted(gen.by_step.items())},
+        "handler_ms": {
+            name: {"count": n, "avg": round(total / n * 1000, 3), "max": round(worst * 1000, 3)}
+            for name, (n, total, worst) in sorted(bot.HANDLER_TIMINGS.items())
+        },
+        "api_calls_per_update": round(sum(work_calls.values()) / updates, 3) if updates else None,
+        "api_calls": dict(sorted(work_calls.items())),
+        "db_statements_per_update": round(db_statements / updates, 3) if updates and args.storage == "sqlite" else None,
+        "saved": {
+            name: sum(v for (metric, _), v in bot.METRICS.items() if metric == name)
+            for name in ("bot_callbacks_debounced_total", "bot_single_flight_calls_total", "bot_single_flight_shared_total")
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--bot", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.py"))
+    parser.add_argument("--users", type=int, default=1000, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between clicks")
+    parser.add_argument("--posts", type=int, default=2000, help="posts seeded before the run")
+    parser.add_argument("--create-ratio", type=float, default=0.1, help="share of loops that publish a post")
+    parser.add_argument("--double-tap", type=float, default=0, help="share of clicks sent twice in a row")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before an update counts as lost")
+    parser.add_argument("--storage", choices=["sqlite", "memory", "postgres"], default="sqlite")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling", help="how the bot receives updates")
+    parser.add_argument("--webhook-connections", type=int, default=40, help="parallel webhook deliveries (max_connections)")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the outbound rate limiter on")
+    parser.add_argument("--out", default="loadtest-results.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, format="%(levelname)s %(name)s: %(message)s", level=logging.WARNING)
+    result = asyncio.run(run(args))
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
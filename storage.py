@@ -0,0 +1,1704 @@
+"""Storage for the bot: the SQLite connection, schema migrations and the
+engines behind the Storage interface (SQLite, in-memory and Postgres).
+
+Engine methods block; the bot calls them only from its single db thread.
+"""
+import os
+import json
+import heapq
+import bisect
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+try:
+    import psycopg
+except ImportError:  # only needed for STORAGE=postgres
+    psycopg = None
+
+log = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get("DB_PATH", "posts.db")
+# storage engine: "sqlite" (DB_PATH), "memory" (nothing persisted; tests and
+# load benchmarks) or "postgres" (POSTGRES_DSN, needs psycopg)
+STORAGE_BACKEND = os.environ.get("STORAGE", "sqlite")
+POSTGRES_DSN = os.environ.get("POSTGRES_DSN", "postgresql://localhost/tgpp")
+# files created before auto_vacuum=INCREMENTAL need one full VACUUM to switch;
+# it rewrites the whole file, so it only runs at startup when this is set to 1
+DB_CONVERT_AUTO_VACUUM = os.environ.get("DB_CONVERT_AUTO_VACUUM", "0") == "1"
+# applied once to the long-lived connection
+DB_PRAGMAS = (
+    # takes effect for new files; older ones are converted with DB_CONVERT_AUTO_VACUUM=1
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA busy_timeout=5000",
+)
+# listing buttons show at most this many characters of a post
+PREVIEW_LEN = 30
+# rows per listing screen; keyset pagination keeps the cost per page flat
+POSTS_PAGE_SIZE = int(os.environ.get("POSTS_PAGE_SIZE", "10"))
+# expired posts are deleted (and old archive rows pruned) in transactions of at
+# most this many rows
+EXPIRY_BATCH_SIZE = int(os.environ.get("EXPIRY_BATCH_SIZE", "500"))
+# free pages returned to the filesystem per incremental vacuum step
+VACUUM_PAGES = int(os.environ.get("VACUUM_PAGES", "256"))
+# wallet balance for new users; ledger compaction handles this many users per
+# transaction
+WALLET_START_BALANCE = 100
+LEDGER_COMPACT_BATCH = 500
+# users per /listusers page
+USERS_PAGE_SIZE = int(os.environ.get("USERS_PAGE_SIZE", "50"))
+# subscribers read per notification outbox step
+FANOUT_BATCH_SIZE = 500
+
+
+def make_preview(text: str) -> str:
+    return text if len(text) <= PREVIEW_LEN else text[:PREVIEW_LEN - 3] + "..."
+
+
+# A single long-lived connection, only ever used from the bot's db thread.
+_db_conn = None
+
+
+def get_db() -> sqlite3.Connection:
+    global _db_conn
+    if _db_conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        _db_conn = conn
+    return _db_conn
+
+
+def close_db():
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.execute("PRAGMA optimize")
+        except Exception:
+            pass
+        _db_conn.close()
+        _db_conn = None
+
+
+def _migration_base_schema(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            text TEXT NOT NULL,
+            creator_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            creator_username TEXT
+        )
+        """
+    )
+    # databases created before creator_username existed
+    cur.execute("PRAGMA table_info(posts)")
+    cols = [r[1] for r in cur.fetchall()]
+    if "creator_username" not in cols:
+        cur.execute("ALTER TABLE posts ADD COLUMN creator_username TEXT")
+
+    # create users table for virtual wallet
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 100
+        )
+        """
+    )
+
+
+def _migration_post_indexes(cur):
+    # category listing: WHERE category = ? AND expires_at > ? ORDER BY created_at
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_category_expires ON posts (category, expires_at, created_at)")
+    # profile screen: WHERE creator_id = ? AND expires_at > ?
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_creator_expires ON posts (creator_id, expires_at)")
+    # all posts listing and expiry cleanup
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_expires ON posts (expires_at)")
+    cur.execute("ANALYZE posts")
+
+
+def _migration_keyset_indexes(cur):
+    # paginated listings walk (created_at, id) in order and stop after one page
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_category_created ON posts (category, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at)")
+    cur.execute("ANALYZE posts")
+
+
+def _migration_post_preview(cur):
+    # listing label stored at creation instead of truncating on every render
+    cur.execute("ALTER TABLE posts ADD COLUMN preview TEXT")
+    cur.execute(
+        "UPDATE posts SET preview = CASE WHEN length(text) <= ? THEN text ELSE substr(text, 1, ?) || '...' END",
+        (PREVIEW_LEN, PREVIEW_LEN - 3),
+    )
+
+
+def _migration_user_state(cur):
+    # one JSON blob of context.user_data per user, see SqlitePersistence
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _migration_post_search(cur):
+    # full-text index over posts.text, kept in sync by triggers so every insert,
+    # delete (user or expiry) and edit is reflected without application code
+    cur.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+        "text, content='posts', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF text ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO posts_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """
+    )
+    cur.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+
+
+def _migration_wallet_ledger(cur):
+    # append-only history of balance changes; users.balance stays the snapshot
+    # and always equals SUM(amount) of the user's ledger rows
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wallet_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            idem_key TEXT UNIQUE,
+            post_id INTEGER,
+            balance_after INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger (user_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_created ON wallet_ledger (created_at)")
+    # existing balances become each user's opening entry
+    now = int(datetime.now(timezone.utc).timestamp())
+    cur.execute(
+        "INSERT INTO wallet_ledger (user_id, amount, kind, balance_after, created_at) "
+        "SELECT user_id, balance, 'opening', balance, ? FROM users",
+        (now,),
+    )
+
+
+def _migration_subscriptions(cur):
+    # category subscribers, and one outbox row per new post that still has
+    # subscribers to notify; after_user_id is how far delivery got (NULL = not
+    # started), so a restart resumes instead of losing or resending the lot
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            category TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            lang TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (category, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS notify_outbox (
+            post_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            creator_id INTEGER NOT NULL,
+            after_user_id INTEGER,
+            created_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _migration_post_stats(cur):
+    # post counts per (creator, category) plus per-category totals under
+    # creator_id 0, kept in step by triggers on every insert and delete (user
+    # or expiry) so profile and category screens never count posts rows
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS post_stats (
+            creator_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            posts INTEGER NOT NULL,
+            PRIMARY KEY (creator_id, category)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_stats_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO post_stats (creator_id, category, posts) VALUES (new.creator_id, new.category, 1), (0, new.category, 1)
+                ON CONFLICT (creator_id, category) DO UPDATE SET posts = posts + 1;
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_stats_delete AFTER DELETE ON posts BEGIN
+            UPDATE post_stats SET posts = posts - 1 WHERE creator_id IN (old.creator_id, 0) AND category = old.category;
+            DELETE FROM post_stats WHERE creator_id = old.creator_id AND category = old.category AND posts <= 0;
+        END
+        """
+    )
+    cur.execute("DELETE FROM post_stats")
+    cur.execute("INSERT INTO post_stats SELECT creator_id, category, COUNT(*) FROM posts GROUP BY creator_id, category")
+    cur.execute("INSERT INTO post_stats SELECT 0, category, COUNT(*) FROM posts GROUP BY category")
+
+
+def _migration_posts_archive(cur):
+    # expired and deleted posts, moved out of the hot posts table
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS posts_archive (
+            id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            text TEXT NOT NULL,
+            creator_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            creator_username TEXT,
+            preview TEXT,
+            archived_at INTEGER NOT NULL,
+            reason TEXT NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_posts_archive_archived ON posts_archive (archived_at)")
+
+
+def _migration_post_photos(cur):
+    # photo posts keep only Telegram's file_id; identical images (same
+    # file_unique_id) share one photos row, and every post of it the same file_id
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS photos (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            added_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    for table in ("posts", "posts_archive"):
+        cur.execute(f"PRAGMA table_info({table})")
+        cols = {r[1] for r in cur.fetchall()}
+        for col in ("photo_file_id", "photo_unique_id"):
+            if col not in cols:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} TEXT")
+
+
+def _migration_post_stats_totals(cur):
+    # the per-category totals (creator_id 0) are dropped at zero like every
+    # other counter row, instead of lingering as (category, 0)
+    cur.execute("DROP TRIGGER IF EXISTS posts_stats_delete")
+    cur.execute(
+        """
+        CREATE TRIGGER posts_stats_delete AFTER DELETE ON posts BEGIN
+            UPDATE post_stats SET posts = posts - 1 WHERE creator_id IN (old.creator_id, 0) AND category = old.category;
+            DELETE FROM post_stats WHERE creator_id IN (old.creator_id, 0) AND category = old.category AND posts <= 0;
+        END
+        """
+    )
+    cur.execute("DELETE FROM post_stats WHERE posts <= 0")
+
+
+# Schema migrations in order. PRAGMA user_version stores how many have been
+# applied; only append to this list, never reorder or edit a shipped step.
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_post_indexes,
+    _migration_keyset_indexes,
+    _migration_post_preview,
+    _migration_user_state,
+    _migration_post_search,
+    _migration_wallet_ledger,
+    _migration_subscriptions,
+    _migration_post_stats,
+    _migration_posts_archive,
+    _migration_post_photos,
+    _migration_post_stats_totals,
+]
+
+
+def migrate_db(conn: sqlite3.Connection) -> int:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            step(cur)
+            cur.execute(f"PRAGMA user_version = {target}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        version = target
+    return version
+
+
+class Storage(ABC):
+    """Everything the bot persists: posts, users/wallet, expiry and user_data.
+
+    Methods are blocking and always run on the db thread (see storage_task in
+    test.py), so engines need no locking of their own. Row shapes:
+
+    - post rows: (id, category, text, creator_id, created_at, expires_at,
+      creator_username, preview, photo file_id or None)
+    - category rows: (id, text, creator_id, created_at, expires_at, preview)
+
+    Reads only return active posts (expires_at in the future); expired rows
+    stay until delete_expired removes them.
+    """
+
+    @abstractmethod
+    def migrate(self):
+        ...
+
+    def close(self):
+        pass
+
+    # posts
+
+    @abstractmethod
+    def insert_post(self, category: str, text: str, creator_id: int, creator_username: str = None, expires_seconds: int = 7200, photo=None):
+        """Insert an unpaid post and return its post row.
+
+        photo is (file_id, file_unique_id) of a Telegram photo, or None. When
+        the same image was stored before, its first file_id is reused.
+        """
+
+    @abstractmethod
+    def publish_paid_post(self, category: str, text: str, creator_id: int, creator_username: str, price: int, expires_seconds: int,
+                          idem_key: str = None, photo=None):
+        """Charge the creator and insert the post atomically.
+
+        Returns (post id, new row), (post id, None) when idem_key was already
+        published, or None when the wallet cannot cover the price. A free post
+        (price 0) touches no wallet and writes no ledger row; idem_key is kept
+        with the charge, so it only guards paid posts.
+        """
+
+    @abstractmethod
+    def get_posts(self, category: str):
+        """Category rows, newest first."""
+
+    @abstractmethod
+    def get_post(self, post_id: int):
+        """Post row, or None."""
+
+    @abstractmethod
+    def get_posts_by_id(self, post_ids):
+        """Post rows of those of post_ids that are active, in any order."""
+
+    @abstractmethod
+    def get_all_posts(self):
+        """Post rows, newest first."""
+
+    @abstractmethod
+    def get_posts_page(self, category, cursor, direction: str, limit: int):
+        """One page plus one row after the (created_at, id) cursor.
+
+        Newest first for direction "n" (cursor None is the first page), oldest
+        first for "p". Category rows when category is given, else post rows.
+        """
+
+    @abstractmethod
+    def delete_post(self, post_id: int):
+        """Move the post to the archive (reason "deleted")."""
+
+    @abstractmethod
+    def get_post_photos(self, post_ids):
+        """[(id, photo file_id)] for those of post_ids that have a photo."""
+
+    @abstractmethod
+    def search_posts(self, terms: str, page: int = 0, limit: int = POSTS_PAGE_SIZE):
+        """One page plus one row of (id, category, preview), best match first."""
+
+    @abstractmethod
+    def get_category_counts(self, now: int):
+        """[(category, active post count)] for categories with active posts.
+
+        The post counters minus the posts that have expired (expires_at <= now)
+        but are not archived yet, so a count always matches the listing it
+        opens. Only those few expired rows are read, never the whole table.
+        """
+
+    @abstractmethod
+    def get_profile(self, uid: int, now: int):
+        """(balance, per-category counts, [(category, expires_at)]) for the
+        profile screen; creates the wallet on first use."""
+
+    # expiry
+
+    @abstractmethod
+    def get_expiry_schedule(self):
+        """[(expires_at, id)] of every stored post, expired or not."""
+
+    @abstractmethod
+    def delete_expired(self, post_ids) -> int:
+        """Archive one batch of due posts; returns how many were removed."""
+
+    @abstractmethod
+    def prune_archive(self, cutoff: int, batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+        """Drop up to batch_size posts archived before cutoff; returns how many."""
+
+    def vacuum_step(self, pages: int = VACUUM_PAGES) -> int:
+        """Release up to `pages` free pages; returns how many are still free."""
+        return 0
+
+    # users and wallet
+
+    @abstractmethod
+    def ensure_user(self, uid: int):
+        ...
+
+    @abstractmethod
+    def get_balance(self, uid: int) -> int:
+        ...
+
+    @abstractmethod
+    def wallet_transaction(self, uid: int, amount: int, kind: str, idem_key: str = None):
+        """Apply one ledger entry; returns the new balance, or None if a debit
+        would overdraw. Replaying idem_key returns the balance recorded the
+        first time without applying the amount again."""
+
+    @abstractmethod
+    def get_ledger(self, uid: int, limit: int = 20):
+        """Newest entries first: (id, amount, kind, post_id, balance_after, created_at)."""
+
+    @abstractmethod
+    def compact_ledger(self, cutoff: int, batch_size: int = LEDGER_COMPACT_BATCH) -> int:
+        """Fold each user's entries created before cutoff into one checkpoint.
+
+        The checkpoint keeps the id, balance_after and created_at of the newest
+        folded entry, so the sum and ordering are unchanged. Handles at most
+        batch_size users; returns how many entries were removed (0 when done).
+        """
+
+    @abstractmethod
+    def list_users(self, after: int = None, direction: str = "n", limit: int = USERS_PAGE_SIZE):
+        """One page plus one row of (user_id, balance): ascending after `after`
+        (direction "n") or descending before it ("p")."""
+
+    # subscriptions and the notification outbox; inserting a post adds its
+    # outbox row in the same transaction when the category has subscribers
+
+    @abstractmethod
+    def set_subscription(self, uid: int, category: str, lang: str, subscribed: bool):
+        """Subscribe or unsubscribe; lang is updated on all of the user's subscriptions."""
+
+    @abstractmethod
+    def get_subscriptions(self, uid: int):
+        """Set of categories the user is subscribed to."""
+
+    @abstractmethod
+    def remove_subscriber(self, uid: int):
+        """Drop every subscription of the user (they blocked the bot)."""
+
+    @abstractmethod
+    def get_subscribers(self, category: str, after: int = None, limit: int = FANOUT_BATCH_SIZE):
+        """Up to limit (user_id, lang) with user_id above after, ascending."""
+
+    @abstractmethod
+    def pending_notifications(self):
+        """Outbox rows (post_id, category, creator_id, after_user_id), oldest first."""
+
+    @abstractmethod
+    def advance_notification(self, post_id: int, after: int):
+        """Record that subscribers up to and including `after` were notified."""
+
+    @abstractmethod
+    def finish_notification(self, post_id: int):
+        ...
+
+    # user_data
+
+    @abstractmethod
+    def load_user_state(self, uid: int):
+        ...
+
+    @abstractmethod
+    def save_user_states(self, states: dict):
+        """states: user_id -> JSON text, or None to delete."""
+
+
+# column lists of the post row and category row shapes
+POST_COLUMNS = "id, category, text, creator_id, created_at, expires_at, creator_username, preview, photo_file_id"
+CATEGORY_COLUMNS = "id, text, creator_id, created_at, expires_at, preview"
+
+
+def _insert_post_row(cur, category: str, text: str, creator_id: int, creator_username: str, expires_seconds: int, photo=None):
+    now = int(datetime.now(timezone.utc).timestamp())
+    expires = now + expires_seconds
+    preview = make_preview(text)
+    file_id = unique_id = None
+    if photo is not None:
+        file_id, unique_id = photo
+        cur.execute("INSERT OR IGNORE INTO photos (file_unique_id, file_id, added_at) VALUES (?, ?, ?)", (unique_id, file_id, now))
+        file_id = cur.execute("SELECT file_id FROM photos WHERE file_unique_id = ?", (unique_id,)).fetchone()[0]
+    cur.execute(
+        "INSERT INTO posts (category, text, creator_id, created_at, expires_at, creator_username, preview, photo_file_id, photo_unique_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (category, text, creator_id, now, expires, creator_username, preview, file_id, unique_id),
+    )
+    pid = cur.lastrowid
+    cur.execute(
+        "INSERT INTO notify_outbox (post_id, category, creator_id, created_at) "
+        "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM subscriptions WHERE category = ?)",
+        (pid, category, creator_id, now, category),
+    )
+    return (pid, category, text, creator_id, now, expires, creator_username, preview, file_id)
+
+
+def _ensure_wallet(cur, uid: int, now: int):
+    cur.execute("INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, ?)", (uid, WALLET_START_BALANCE))
+    if cur.rowcount:
+        cur.execute(
+            "INSERT INTO wallet_ledger (user_id, amount, kind, balance_after, created_at) VALUES (?, ?, 'opening', ?, ?)",
+            (uid, WALLET_START_BALANCE, WALLET_START_BALANCE, now),
+        )
+
+
+def _wallet_find(cur, idem_key: str):
+    # (balance_after, post_id) of the entry already recorded under idem_key, or None
+    if idem_key is None:
+        return None
+    return cur.execute("SELECT balance_after, post_id FROM wallet_ledger WHERE idem_key = ?", (idem_key,)).fetchone()
+
+
+def _wallet_apply(cur, uid: int, amount: int, kind: str, idem_key: str = None, post_id: int = None):
+    # snapshot update and ledger row in the caller's transaction; the balance
+    # check is part of the UPDATE, so concurrent writers cannot overdraw.
+    # Returns the new balance, or None when a debit would go below zero.
+    now = int(datetime.now(timezone.utc).timestamp())
+    _ensure_wallet(cur, uid, now)
+    cur.execute(
+        "UPDATE users SET balance = balance + ? WHERE user_id = ? AND (? >= 0 OR balance + ? >= 0)",
+        (amount, uid, amount, amount),
+    )
+    if cur.rowcount == 0:
+        return None
+    balance = cur.execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
+    cur.execute(
+        "INSERT INTO wallet_ledger (user_id, amount, kind, idem_key, post_id, balance_after, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (uid, amount, kind, idem_key, post_id, balance, now),
+    )
+    return balance
+
+
+def _archive_posts(cur, post_ids, reason: str) -> int:
+    # copy to posts_archive and delete in the caller's transaction
+    now = int(datetime.now(timezone.utc).timestamp())
+    ids = list(post_ids)
+    placeholders = ",".join("?" * len(ids))
+    cur.execute(
+        "INSERT OR REPLACE INTO posts_archive "
+        "(id, category, text, creator_id, created_at, expires_at, creator_username, preview, photo_file_id, photo_unique_id, archived_at, reason) "
+        "SELECT id, category, text, creator_id, created_at, expires_at, creator_username, preview, photo_file_id, photo_unique_id, ?, ? "
+        f"FROM posts WHERE id IN ({placeholders})",
+        [now, reason] + ids,
+    )
+    cur.execute(f"DELETE FROM posts WHERE id IN ({placeholders})", ids)
+    return cur.rowcount
+
+
+def fts_query(terms: str) -> str:
+    # user words -> prefix match on each word, e.g. 'nail sal' -> '"nail"* "sal"*'
+    words = [w.replace('"', '""') for w in terms.split() if w.strip('"')]
+    return " ".join(f'"{w}"*' for w in words[:10])
+
+
+class SqliteStorage(Storage):
+    """The default engine: posts.db through the shared connection from get_db()."""
+
+    def migrate(self):
+        conn = get_db()
+        migrate_db(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        if not DB_CONVERT_AUTO_VACUUM:
+            # vacuum_step frees nothing until the file is converted
+            log.warning(
+                "%s does not use incremental auto_vacuum; restart once with DB_CONVERT_AUTO_VACUUM=1 "
+                "to convert it (a full VACUUM that rewrites the file)", DB_PATH,
+            )
+            return
+        log.info("Converting %s to incremental auto_vacuum...", DB_PATH)
+        conn.execute("VACUUM")
+        log.info("Converted %s to incremental auto_vacuum", DB_PATH)
+
+    def close(self):
+        close_db()
+
+    def insert_post(self, category: str, text: str, creator_id: int, creator_username: str = None, expires_seconds: int = 7200, photo=None):
+        conn = get_db()
+        row = _insert_post_row(conn.cursor(), category, text, creator_id, creator_username, expires_seconds, photo)
+        conn.commit()
+        return row
+
+    def publish_paid_post(self, category: str, text: str, creator_id: int, creator_username: str, price: int, expires_seconds: int,
+                          idem_key: str = None, photo=None):
+        conn = get_db()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            found = _wallet_find(cur, idem_key)
+            if found:
+                conn.rollback()
+                return found[1], None
+            row = _insert_post_row(cur, category, text, creator_id, creator_username, expires_seconds, photo)
+            if price > 0 and _wallet_apply(cur, creator_id, -price, "charge", idem_key, row[0]) is None:
+                conn.rollback()
+                return None
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        return row[0], row
+
+    def get_posts(self, category: str):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return get_db().execute(
+            "SELECT id, text, creator_id, created_at, expires_at, preview FROM posts WHERE category = ? AND expires_at > ? ORDER BY created_at DESC, id DESC",
+            (category, now),
+        ).fetchall()
+
+    def get_post(self, post_id: int):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return get_db().execute(
+            f"SELECT {POST_COLUMNS} FROM posts WHERE id = ? AND expires_at > ?",
+            (post_id, now),
+        ).fetchone()
+
+    def get_posts_by_id(self, post_ids):
+        now = int(datetime.now(timezone.utc).timestamp())
+        ids = list(post_ids)
+        placeholders = ",".join("?" * len(ids))
+        return get_db().execute(
+            f"SELECT {POST_COLUMNS} FROM posts WHERE id IN ({placeholders}) AND expires_at > ?", ids + [now]
+        ).fetchall()
+
+    def get_all_posts(self):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return get_db().execute(
+            f"SELECT {POST_COLUMNS} FROM posts WHERE expires_at > ? ORDER BY created_at DESC, id DESC",
+            (now,)
+        ).fetchall()
+
+    def get_posts_page(self, category, cursor, direction: str, limit: int):
+        now = int(datetime.now(timezone.utc).timestamp())
+        if category is None:
+            cols = POST_COLUMNS
+            where, args = "expires_at > ?", [now]
+        else:
+            cols = "id, text, creator_id, created_at, expires_at, preview"
+            where, args = "category = ? AND expires_at > ?", [category, now]
+        if direction == "p":
+            where += " AND (created_at, id) > (?, ?)"
+            order = "created_at ASC, id ASC"
+        else:
+            # the first page still gets a (sentinel) bound so the planner walks the created_at index
+            where += " AND (created_at, id) < (?, ?)"
+            order = "created_at DESC, id DESC"
+            if cursor is None:
+                cursor = (2 ** 63 - 1, 0)
+        args.extend(cursor)
+        args.append(limit + 1)
+        return get_db().execute(f"SELECT {cols} FROM posts WHERE {where} ORDER BY {order} LIMIT ?", args).fetchall()
+
+    def delete_post(self, post_id: int):
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            _archive_posts(cur, [post_id], "deleted")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def get_post_photos(self, post_ids):
+        ids = list(post_ids)
+        placeholders = ",".join("?" * len(ids))
+        return get_db().execute(
+            f"SELECT id, photo_file_id FROM posts WHERE id IN ({placeholders}) AND photo_file_id IS NOT NULL", ids
+        ).fetchall()
+
+    def search_posts(self, terms: str, page: int = 0, limit: int = POSTS_PAGE_SIZE):
+        match = fts_query(terms)
+        if not match:
+            return []
+        now = int(datetime.now(timezone.utc).timestamp())
+        return get_db().execute(
+            "SELECT p.id, p.category, p.preview FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid "
+            "WHERE posts_fts MATCH ? AND p.expires_at > ? ORDER BY bm25(posts_fts) LIMIT ? OFFSET ?",
+            (match, now, limit + 1, page * limit),
+        ).fetchall()
+
+    def get_category_counts(self, now: int):
+        return get_db().execute(
+            "SELECT category, posts - expired FROM (SELECT category, posts, "
+            "(SELECT COUNT(*) FROM posts p WHERE p.category = s.category AND p.expires_at <= ?) AS expired "
+            "FROM post_stats s WHERE creator_id = 0) t WHERE posts > expired",
+            (now,),
+        ).fetchall()
+
+    def get_profile(self, uid: int, now: int):
+        conn = get_db()
+        cur = conn.cursor()
+        _ensure_wallet(cur, uid, now)
+        if conn.in_transaction:
+            conn.commit()
+        balance = cur.execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()[0]
+        counts = cur.execute("SELECT category, posts FROM post_stats WHERE creator_id = ?", (uid,)).fetchall()
+        posts = cur.execute(
+            "SELECT category, expires_at FROM posts WHERE creator_id = ? AND expires_at > ? ORDER BY expires_at ASC",
+            (uid, now),
+        ).fetchall() if counts else []
+        return int(balance), counts, posts
+
+    def get_expiry_schedule(self):
+        return get_db().execute("SELECT expires_at, id FROM posts").fetchall()
+
+    def delete_expired(self, post_ids) -> int:
+        # one batch in a single transaction
+        conn = get_db()
+        cur = conn.cursor()
+        try:
+            removed = _archive_posts(cur, post_ids, "expired")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        return removed
+
+    def prune_archive(self, cutoff: int, batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+        conn = get_db()
+        cur = conn.execute(
+            "DELETE FROM posts_archive WHERE id IN (SELECT id FROM posts_archive WHERE archived_at < ? LIMIT ?)",
+            (cutoff, batch_size),
+        )
+        conn.commit()
+        return cur.rowcount
+
+    def vacuum_step(self, pages: int = VACUUM_PAGES) -> int:
+        conn = get_db()
+        # the pragma frees one page per step and returns no columns, so execute()
+        # would stop after the first page; executescript steps it to the end
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def ensure_user(self, uid: int):
+        conn = get_db()
+        _ensure_wallet(conn.cursor(), uid, int(datetime.now(timezone.utc).timestamp()))
+        conn.commit()
+
+    def get_balance(self, uid: int) -> int:
+        # snapshot column, kept in step with the ledger by every write
+        r = get_db().execute("SELECT balance FROM users WHERE user_id = ?", (uid,)).fetchone()
+        if not r:
+            return 0
+        return int(r[0])
+
+    def wallet_transaction(self, uid: int, amount: int, kind: str, idem_key: str = None):
+        conn = get_db()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            found = _wallet_find(cur, idem_key)
+            balance = found[0] if found else _wallet_apply(cur, uid, amount, kind, idem_key)
+        except Exception:
+            conn.rollback()
+            raise
+        if balance is None:
+            conn.rollback()
+        else:
+            conn.commit()
+        return balance
+
+    def get_ledger(self, uid: int, limit: int = 20):
+        return get_db().execute(
+            "SELECT id, amount, kind, post_id, balance_after, created_at FROM wallet_ledger "
+            "WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (uid, limit),
+        ).fetchall()
+
+    def compact_ledger(self, cutoff: int, batch_size: int = LEDGER_COMPACT_BATCH) -> int:
+        conn = get_db()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        removed = 0
+        try:
+            # by created_at, so only rows old enough to fold are read, not the whole ledger
+            users = cur.execute(
+                "SELECT user_id, MAX(id) FROM wallet_ledger INDEXED BY idx_wallet_ledger_created"
+                " WHERE created_at < ? GROUP BY user_id HAVING COUNT(*) > 1 LIMIT ?",
+                (cutoff, batch_size),
+            ).fetchall()
+            for uid, last_id in users:
+                total = cur.execute("SELECT SUM(amount) FROM wallet_ledger WHERE user_id = ? AND id <= ?", (uid, last_id)).fetchone()[0]
+                balance, created_at = cur.execute("SELECT balance_after, created_at FROM wallet_ledger WHERE id = ?", (last_id,)).fetchone()
+                cur.execute("DELETE FROM wallet_ledger WHERE user_id = ? AND id <= ?", (uid, last_id))
+                removed += cur.rowcount - 1
+                cur.execute(
+                    "INSERT INTO wallet_ledger (id, user_id, amount, kind, balance_after, created_at) VALUES (?, ?, ?, 'checkpoint', ?, ?)",
+                    (last_id, uid, total, balance, created_at),
+                )
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        return removed
+
+    def list_users(self, after: int = None, direction: str = "n", limit: int = USERS_PAGE_SIZE):
+        if direction == "p":
+            sql = "SELECT user_id, balance FROM users WHERE user_id < ? ORDER BY user_id DESC LIMIT ?"
+        else:
+            sql = "SELECT user_id, balance FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+            if after is None:
+                after = -(2 ** 63)
+        return get_db().execute(sql, (after, limit + 1)).fetchall()
+
+    def set_subscription(self, uid: int, category: str, lang: str, subscribed: bool):
+        conn = get_db()
+        if subscribed:
+            conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (category, user_id, lang, created_at) VALUES (?, ?, ?, ?)",
+                (category, uid, lang, int(datetime.now(timezone.utc).timestamp())),
+            )
+        else:
+            conn.execute("DELETE FROM subscriptions WHERE category = ? AND user_id = ?", (category, uid))
+        conn.execute("UPDATE subscriptions SET lang = ? WHERE user_id = ?", (lang, uid))
+        conn.commit()
+
+    def get_subscriptions(self, uid: int):
+        return {r[0] for r in get_db().execute("SELECT category FROM subscriptions WHERE user_id = ?", (uid,))}
+
+    def remove_subscriber(self, uid: int):
+        conn = get_db()
+        conn.execute("DELETE FROM subscriptions WHERE user_id = ?", (uid,))
+        conn.commit()
+
+    def get_subscribers(self, category: str, after: int = None, limit: int = FANOUT_BATCH_SIZE):
+        # a range scan of the (category, user_id) primary key
+        return get_db().execute(
+            "SELECT user_id, lang FROM subscriptions WHERE category = ? AND user_id > ? ORDER BY user_id LIMIT ?",
+            (category, -(2 ** 63) if after is None else after, limit),
+        ).fetchall()
+
+    def pending_notifications(self):
+        return get_db().execute("SELECT post_id, category, creator_id, after_user_id FROM notify_outbox ORDER BY post_id").fetchall()
+
+    def advance_notification(self, post_id: int, after: int):
+        conn = get_db()
+        conn.execute("UPDATE notify_outbox SET after_user_id = ? WHERE post_id = ?", (after, post_id))
+        conn.commit()
+
+    def finish_notification(self, post_id: int):
+        conn = get_db()
+        conn.execute("DELETE FROM notify_outbox WHERE post_id = ?", (post_id,))
+        conn.commit()
+
+    def load_user_state(self, uid: int):
+        r = get_db().execute("SELECT data FROM user_state WHERE user_id = ?", (uid,)).fetchone()
+        return json.loads(r[0]) if r else None
+
+    def save_user_states(self, states: dict):
+        now = int(datetime.now(timezone.utc).timestamp())
+        conn = get_db()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for uid, data in states.items():
+                if data is None:
+                    cur.execute("DELETE FROM user_state WHERE user_id = ?", (uid,))
+                else:
+                    cur.execute(
+                        "INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                        (uid, data, now),
+                    )
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+class MemoryStorage(Storage):
+    """Everything in process memory, for tests and load benchmarks.
+
+    Posts live in a dict with sorted (created_at, id) key lists overall and
+    per category (pages are cut with bisect), a per-creator id set and an
+    expiry heap; users in a dict plus a sorted id list; subscribers per
+    category in a dict plus a sorted id list. Nothing survives a restart.
+    """
+
+    def __init__(self):
+        self._posts = {}
+        self._order = []
+        self._by_cat = {}
+        self._by_creator = {}
+        self._expiry = []
+        self._stats = {}  # (creator_id, category) -> posts; creator_id 0 holds the totals
+        self._photos = {}  # file_unique_id -> file_id
+        self._next_post_id = 1
+        self._balances = {}
+        self._user_ids = []
+        self._ledger = {}  # user_id -> [(id, amount, kind, idem_key, post_id, balance_after, created_at)]
+        self._idem = {}  # idem_key -> (balance_after, post_id)
+        self._next_entry_id = 1
+        self._user_state = {}
+        self._subs = {}  # category -> {user_id: lang}
+        self._sub_ids = {}  # category -> sorted user ids
+        self._outbox = {}  # post_id -> [category, creator_id, after_user_id]
+
+    def migrate(self):
+        pass
+
+    @staticmethod
+    def _category_row(r):
+        return (r[0], r[2], r[3], r[4], r[5], r[7])
+
+    def _active(self, keys, lo: int = 0, hi: int = None, newest_first: bool = True):
+        # active rows of keys[lo:hi], walked by index so a page does not copy the list
+        now = int(datetime.now(timezone.utc).timestamp())
+        hi = len(keys) if hi is None else hi
+        for i in range(hi - 1, lo - 1, -1) if newest_first else range(lo, hi):
+            r = self._posts[keys[i][1]]
+            if r[5] > now:
+                yield r
+
+    def insert_post(self, category: str, text: str, creator_id: int, creator_username: str = None, expires_seconds: int = 7200, photo=None):
+        now = int(datetime.now(timezone.utc).timestamp())
+        pid = self._next_post_id
+        self._next_post_id += 1
+        file_id = self._photos.setdefault(photo[1], photo[0]) if photo is not None else None
+        row = (pid, category, text, creator_id, now, now + expires_seconds, creator_username, make_preview(text), file_id)
+        self._posts[pid] = row
+        key = (now, pid)
+        bisect.insort(self._order, key)
+        bisect.insort(self._by_cat.setdefault(category, []), key)
+        self._by_creator.setdefault(creator_id, set()).add(pid)
+        heapq.heappush(self._expiry, (row[5], pid))
+        if self._subs.get(category):
+            self._outbox[pid] = [category, creator_id, None]
+        self._count(creator_id, category, 1)
+        return row
+
+    def _count(self, creator_id: int, category: str, delta: int):
+        for key in ((creator_id, category), (0, category)):
+            n = self._stats.get(key, 0) + delta
+            if n > 0:
+                self._stats[key] = n
+            else:
+                self._stats.pop(key, None)
+
+    def publish_paid_post(self, category: str, text: str, creator_id: int, creator_username: str, price: int, expires_seconds: int,
+                          idem_key: str = None, photo=None):
+        found = self._idem.get(idem_key) if idem_key is not None else None
+        if found:
+            return found[1], None
+        if price <= 0:
+            row = self.insert_post(category, text, creator_id, creator_username, expires_seconds, photo)
+            return row[0], row
+        self._ensure(creator_id)
+        if self._balances[creator_id] < price:
+            return None
+        row = self.insert_post(category, text, creator_id, creator_username, expires_seconds, photo)
+        self._apply(creator_id, -price, "charge", idem_key, row[0])
+        return row[0], row
+
+    def get_posts(self, category: str):
+        return [self._category_row(r) for r in self._active(self._by_cat.get(category, []))]
+
+    def get_post(self, post_id: int):
+        r = self._posts.get(post_id)
+        if r is None or r[5] <= int(datetime.now(timezone.utc).timestamp()):
+            return None
+        return r
+
+    def get_posts_by_id(self, post_ids):
+        now = int(datetime.now(timezone.utc).timestamp())
+        rows = (self._posts.get(pid) for pid in post_ids)
+        return [r for r in rows if r is not None and r[5] > now]
+
+    def get_all_posts(self):
+        return list(self._active(self._order))
+
+    def get_posts_page(self, category, cursor, direction: str, limit: int):
+        keys = self._order if category is None else self._by_cat.get(category, [])
+        if direction == "p":
+            rows = self._active(keys, bisect.bisect_right(keys, tuple(cursor)), newest_first=False)
+        else:
+            rows = self._active(keys, 0, None if cursor is None else bisect.bisect_left(keys, tuple(cursor)))
+        page = []
+        for r in rows:
+            page.append(r if category is None else self._category_row(r))
+            if len(page) > limit:
+                break
+        return page
+
+    def delete_post(self, post_id: int):
+        row = self._posts.pop(post_id, None)
+        if row is None:
+            return False
+        key = (row[4], post_id)
+        for keys in (self._order, self._by_cat.get(row[1], [])):
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+        self._by_creator.get(row[3], set()).discard(post_id)
+        self._count(row[3], row[1], -1)
+        return True
+
+    def get_post_photos(self, post_ids):
+        rows = (self._posts.get(pid) for pid in post_ids)
+        return [(r[0], r[8]) for r in rows if r is not None and r[8] is not None]
+
+    def search_posts(self, terms: str, page: int = 0, limit: int = POSTS_PAGE_SIZE):
+        # every word must prefix-match a word of the post; newest first
+        prefixes = [w.casefold() for w in terms.split()][:10]
+        if not prefixes:
+            return []
+        matches = []
+        for r in self._active(self._order):
+            words = r[2].casefold().split()
+            if all(any(w.startswith(p) for w in words) for p in prefixes):
+                matches.append((r[0], r[1], r[7]))
+                if len(matches) > (page + 1) * limit:
+                    break
+        return matches[page * limit:]
+
+    def get_category_counts(self, now: int):
+        counts = {c: n for (creator_id, c), n in self._stats.items() if creator_id == 0}
+        # walk only the expired top of the heap; entries of removed posts are skipped
+        stack = [0] if self._expiry else []
+        while stack:
+            i = stack.pop()
+            expires_at, pid = self._expiry[i]
+            if expires_at > now:
+                continue
+            r = self._posts.get(pid)
+            if r is not None and r[5] == expires_at:
+                counts[r[1]] -= 1
+            stack.extend(j for j in (2 * i + 1, 2 * i + 2) if j < len(self._expiry))
+        return [(c, n) for c, n in counts.items() if n > 0]
+
+    def get_profile(self, uid: int, now: int):
+        self._ensure(uid)
+        counts = sorted((c, n) for (creator_id, c), n in self._stats.items() if creator_id == uid)
+        rows = [self._posts[pid] for pid in self._by_creator.get(uid, ())]
+        rows = sorted((r for r in rows if r[5] > now), key=lambda r: r[5])
+        return self._balances[uid], counts, [(r[1], r[5]) for r in rows]
+
+    def get_expiry_schedule(self):
+        self._expiry = [(e, pid) for e, pid in self._expiry if pid in self._posts]
+        heapq.heapify(self._expiry)
+        return list(self._expiry)
+
+    def delete_expired(self, post_ids) -> int:
+        return sum(1 for pid in post_ids if self.delete_post(pid))
+
+    def prune_archive(self, cutoff: int, batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+        # removed posts are not kept, there is nothing to prune
+        return 0
+
+    def _ensure(self, uid: int):
+        if uid not in self._balances:
+            self._balances[uid] = 0
+            bisect.insort(self._user_ids, uid)
+            self._apply(uid, WALLET_START_BALANCE, "opening")
+
+    def _apply(self, uid: int, amount: int, kind: str, idem_key: str = None, post_id: int = None):
+        balance = self._balances[uid] + amount
+        if amount < 0 and balance < 0:
+            return None
+        self._balances[uid] = balance
+        entry = (self._next_entry_id, amount, kind, idem_key, post_id, balance, int(datetime.now(timezone.utc).timestamp()))
+        self._next_entry_id += 1
+        self._ledger.setdefault(uid, []).append(entry)
+        if idem_key is not None:
+            self._idem[idem_key] = (balance, post_id)
+        return balance
+
+    def ensure_user(self, uid: int):
+        self._ensure(uid)
+
+    def get_balance(self, uid: int) -> int:
+        return self._balances.get(uid, 0)
+
+    def wallet_transaction(self, uid: int, amount: int, kind: str, idem_key: str = None):
+        found = self._idem.get(idem_key) if idem_key is not None else None
+        if found:
+            return found[0]
+        self._ensure(uid)
+        return self._apply(uid, amount, kind, idem_key)
+
+    def get_ledger(self, uid: int, limit: int = 20):
+        return [(e[0], e[1], e[2], e[4], e[5], e[6]) for e in reversed(self._ledger.get(uid, [])[-limit:])]
+
+    def compact_ledger(self, cutoff: int, batch_size: int = LEDGER_COMPACT_BATCH) -> int:
+        removed = 0
+        users = 0
+        for entries in self._ledger.values():
+            old = 0
+            while old < len(entries) and entries[old][6] < cutoff:
+                old += 1
+            if old < 2:
+                continue
+            folded = entries[:old]
+            last = folded[-1]
+            for e in folded:
+                self._idem.pop(e[3], None)
+            entries[:old] = [(last[0], sum(e[1] for e in folded), "checkpoint", None, None, last[5], last[6])]
+            removed += old - 1
+            users += 1
+            if users >= batch_size:
+                break
+        return removed
+
+    def list_users(self, after: int = None, direction: str = "n", limit: int = USERS_PAGE_SIZE):
+        if direction == "p":
+            end = bisect.bisect_left(self._user_ids, after)
+            ids = self._user_ids[max(0, end - limit - 1):end][::-1]
+        else:
+            start = 0 if after is None else bisect.bisect_right(self._user_ids, after)
+            ids = self._user_ids[start:start + limit + 1]
+        return [(uid, self._balances[uid]) for uid in ids]
+
+    def set_subscription(self, uid: int, category: str, lang: str, subscribed: bool):
+        subs = self._subs.setdefault(category, {})
+        ids = self._sub_ids.setdefault(category, [])
+        if subscribed and uid not in subs:
+            bisect.insort(ids, uid)
+        elif not subscribed and uid in subs:
+            del subs[uid]
+            del ids[bisect.bisect_left(ids, uid)]
+        if subscribed:
+            subs[uid] = lang
+        for other in self._subs.values():
+            if uid in other:
+                other[uid] = lang
+
+    def get_subscriptions(self, uid: int):
+        return {c for c, subs in self._subs.items() if uid in subs}
+
+    def remove_subscriber(self, uid: int):
+        for category in self.get_subscriptions(uid):
+            self.set_subscription(uid, category, "en", False)
+
+    def get_subscribers(self, category: str, after: int = None, limit: int = FANOUT_BATCH_SIZE):
+        ids = self._sub_ids.get(category, [])
+        start = 0 if after is None else bisect.bisect_right(ids, after)
+        subs = self._subs.get(category, {})
+        return [(uid, subs[uid]) for uid in ids[start:start + limit]]
+
+    def pending_notifications(self):
+        return [(pid, *entry) for pid, entry in sorted(self._outbox.items())]
+
+    def advance_notification(self, post_id: int, after: int):
+        if post_id in self._outbox:
+            self._outbox[post_id][2] = after
+
+    def finish_notification(self, post_id: int):
+        self._outbox.pop(post_id, None)
+
+    def load_user_state(self, uid: int):
+        data = self._user_state.get(uid)
+        return json.loads(data) if data is not None else None
+
+    def save_user_states(self, states: dict):
+        for uid, data in states.items():
+            if data is None:
+                self._user_state.pop(uid, None)
+            else:
+                self._user_state[uid] = data
+
+
+# PostgreSQL schema; CREATE ... IF NOT EXISTS, applied by PostgresStorage.migrate()
+POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS posts (
+        id BIGSERIAL PRIMARY KEY,
+        category TEXT NOT NULL,
+        text TEXT NOT NULL,
+        creator_id BIGINT NOT NULL,
+        created_at BIGINT NOT NULL,
+        expires_at BIGINT NOT NULL,
+        creator_username TEXT,
+        preview TEXT,
+        search TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_posts_category_expires ON posts (category, expires_at, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_posts_creator_expires ON posts (creator_id, expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_posts_expires ON posts (expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_posts_category_created ON posts (category, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_posts_search ON posts USING GIN (search)",
+    "CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, balance BIGINT NOT NULL DEFAULT 100)",
+    """
+    CREATE TABLE IF NOT EXISTS wallet_ledger (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        amount BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        idem_key TEXT UNIQUE,
+        post_id BIGINT,
+        balance_after BIGINT NOT NULL,
+        created_at BIGINT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_wallet_ledger_created ON wallet_ledger (created_at)",
+    "CREATE TABLE IF NOT EXISTS user_state (user_id BIGINT PRIMARY KEY, data TEXT NOT NULL, updated_at BIGINT NOT NULL)",
+    """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        category TEXT NOT NULL,
+        user_id BIGINT NOT NULL,
+        lang TEXT NOT NULL,
+        created_at BIGINT NOT NULL,
+        PRIMARY KEY (category, user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id)",
+    """
+    CREATE TABLE IF NOT EXISTS notify_outbox (
+        post_id BIGINT PRIMARY KEY,
+        category TEXT NOT NULL,
+        creator_id BIGINT NOT NULL,
+        after_user_id BIGINT,
+        created_at BIGINT NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS post_stats (creator_id BIGINT, category TEXT, posts BIGINT NOT NULL, PRIMARY KEY (creator_id, category))",
+    # backfill once, for databases created before the counters existed
+    """
+    INSERT INTO post_stats
+    SELECT creator_id, category, COUNT(*) FROM posts WHERE NOT EXISTS (SELECT 1 FROM post_stats) GROUP BY creator_id, category
+    UNION ALL
+    SELECT 0, category, COUNT(*) FROM posts WHERE NOT EXISTS (SELECT 1 FROM post_stats) GROUP BY category
+    """,
+    """
+    CREATE OR REPLACE FUNCTION posts_stats() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO post_stats (creator_id, category, posts) VALUES (NEW.creator_id, NEW.category, 1), (0, NEW.category, 1)
+                ON CONFLICT (creator_id, category) DO UPDATE SET posts = post_stats.posts + 1;
+            RETURN NEW;
+        END IF;
+        UPDATE post_stats SET posts = posts - 1 WHERE creator_id IN (OLD.creator_id, 0) AND category = OLD.category;
+        DELETE FROM post_stats WHERE creator_id IN (OLD.creator_id, 0) AND category = OLD.category AND posts <= 0;
+        RETURN OLD;
+    END
+    $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS posts_archive (
+        id BIGINT PRIMARY KEY,
+        category TEXT NOT NULL,
+        text TEXT NOT NULL,
+        creator_id BIGINT NOT NULL,
+        created_at BIGINT NOT NULL,
+        expires_at BIGINT NOT NULL,
+        creator_username TEXT,
+        preview TEXT,
+        archived_at BIGINT NOT NULL,
+        reason TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_posts_archive_archived ON posts_archive (archived_at)",
+    "CREATE TABLE IF NOT EXISTS photos (file_unique_id TEXT PRIMARY KEY, file_id TEXT NOT NULL, added_at BIGINT NOT NULL)",
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS photo_file_id TEXT",
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS photo_unique_id TEXT",
+    "ALTER TABLE posts_archive ADD COLUMN IF NOT EXISTS photo_file_id TEXT",
+    "ALTER TABLE posts_archive ADD COLUMN IF NOT EXISTS photo_unique_id TEXT",
+    # totals are dropped at zero too (databases from before that kept (category, 0) rows)
+    "DELETE FROM post_stats WHERE posts <= 0",
+    "DROP TRIGGER IF EXISTS posts_stats ON posts",
+    "CREATE TRIGGER posts_stats AFTER INSERT OR DELETE ON posts FOR EACH ROW EXECUTE FUNCTION posts_stats()",
+]
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL through psycopg 3 (optional dependency), one connection on the db thread.
+
+    Same schema and semantics as SqliteStorage; search uses a generated
+    tsvector column with prefix matching instead of FTS5.
+    """
+
+    def __init__(self, dsn: str):
+        if psycopg is None:
+            raise RuntimeError("STORAGE=postgres needs psycopg: pip install 'psycopg[binary]'")
+        self.dsn = dsn
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            # autocommit, so every method's conn.transaction() is one real transaction
+            self._conn = psycopg.connect(self.dsn, autocommit=True)
+        return self._conn
+
+    def migrate(self):
+        conn = self._db()
+        with conn.transaction():
+            for statement in POSTGRES_SCHEMA:
+                conn.execute(statement)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _fetchall(self, sql: str, args=()):
+        conn = self._db()
+        with conn.transaction():
+            return conn.execute(sql, args).fetchall()
+
+    def _fetchone(self, sql: str, args=()):
+        conn = self._db()
+        with conn.transaction():
+            return conn.execute(sql, args).fetchone()
+
+    @staticmethod
+    def _insert_post(conn, category: str, text: str, creator_id: int, creator_username: str, expires_seconds: int, photo=None):
+        now = int(datetime.now(timezone.utc).timestamp())
+        expires = now + expires_seconds
+        preview = make_preview(text)
+        file_id = unique_id = None
+        if photo is not None:
+            file_id, unique_id = photo
+            conn.execute(
+                "INSERT INTO photos (file_unique_id, file_id, added_at) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                (unique_id, file_id, now),
+            )
+            file_id = conn.execute("SELECT file_id FROM photos WHERE file_unique_id = %s", (unique_id,)).fetchone()[0]
+        pid = conn.execute(
+            "INSERT INTO posts (category, text, creator_id, created_at, expires_at, creator_username, preview, photo_file_id, photo_unique_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
+            (category, text, creator_id, now, expires, creator_username, preview, file_id, unique_id),
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO notify_outbox (post_id, category, creator_id, created_at) "
+            "SELECT %s, %s, %s, %s WHERE EXISTS (SELECT 1 FROM subscriptions WHERE category = %s)",
+            (pid, category, creator_id, now, category),
+        )
+        return (pid, category, text, creator_id, now, expires, creator_username, preview, file_id)
+
+    @staticmethod
+    def _ensure(conn, uid: int, now: int):
+        cur = conn.execute(
+            "INSERT INTO users (user_id, balance) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
+            (uid, WALLET_START_BALANCE),
+        )
+        if cur.rowcount:
+            conn.execute(
+                "INSERT INTO wallet_ledger (user_id, amount, kind, balance_after, created_at) VALUES (%s, %s, 'opening', %s, %s)",
+                (uid, WALLET_START_BALANCE, WALLET_START_BALANCE, now),
+            )
+
+    @classmethod
+    def _apply(cls, conn, uid: int, amount: int, kind: str, idem_key: str = None, post_id: int = None):
+        now = int(datetime.now(timezone.utc).timestamp())
+        cls._ensure(conn, uid, now)
+        r = conn.execute(
+            "UPDATE users SET balance = balance + %s WHERE user_id = %s AND (%s >= 0 OR balance + %s >= 0) RETURNING balance",
+            (amount, uid, amount, amount),
+        ).fetchone()
+        if r is None:
+            return None
+        conn.execute(
+            "INSERT INTO wallet_ledger (user_id, amount, kind, idem_key, post_id, balance_after, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (uid, amount, kind, idem_key, post_id, r[0], now),
+        )
+        return r[0]
+
+    @staticmethod
+    def _find(conn, idem_key: str):
+        if idem_key is None:
+            return None
+        return conn.execute("SELECT balance_after, post_id FROM wallet_ledger WHERE idem_key = %s", (idem_key,)).fetchone()
+
+    def insert_post(self, category: str, text: str, creator_id: int, creator_username: str = None, expires_seconds: int = 7200, photo=None):
+        conn = self._db()
+        with conn.transaction():
+            return self._insert_post(conn, category, text, creator_id, creator_username, expires_seconds, photo)
+
+    def publish_paid_post(self, category: str, text: str, creator_id: int, creator_username: str, price: int, expires_seconds: int,
+                          idem_key: str = None, photo=None):
+        conn = self._db()
+        result = None
+        with conn.transaction():
+            found = self._find(conn, idem_key)
+            if found:
+                return found[1], None
+            row = self._insert_post(conn, category, text, creator_id, creator_username, expires_seconds, photo)
+            if price > 0 and self._apply(conn, creator_id, -price, "charge", idem_key, row[0]) is None:
+                raise psycopg.Rollback()
+            result = row[0], row
+        return result
+
+    def get_posts(self, category: str):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return self._fetchall(
+            f"SELECT {CATEGORY_COLUMNS} FROM posts WHERE category = %s AND expires_at > %s ORDER BY created_at DESC, id DESC",
+            (category, now),
+        )
+
+    def get_post(self, post_id: int):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return self._fetchone(f"SELECT {POST_COLUMNS} FROM posts WHERE id = %s AND expires_at > %s", (post_id, now))
+
+    def get_posts_by_id(self, post_ids):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return self._fetchall(f"SELECT {POST_COLUMNS} FROM posts WHERE id = ANY(%s) AND expires_at > %s", (list(post_ids), now))
+
+    def get_all_posts(self):
+        now = int(datetime.now(timezone.utc).timestamp())
+        return self._fetchall(f"SELECT {POST_COLUMNS} FROM posts WHERE expires_at > %s ORDER BY created_at DESC, id DESC", (now,))
+
+    def get_posts_page(self, category, cursor, direction: str, limit: int):
+        now = int(datetime.now(timezone.utc).timestamp())
+        if category is None:
+            cols, where, args = POST_COLUMNS, "expires_at > %s", [now]
+        else:
+            cols, where, args = CATEGORY_COLUMNS, "category = %s AND expires_at > %s", [category, now]
+        if direction == "p":
+            where += " AND (created_at, id) > (%s, %s)"
+            order = "created_at ASC, id ASC"
+        else:
+            where += " AND (created_at, id) < (%s, %s)"
+            order = "created_at DESC, id DESC"
+            if cursor is None:
+                cursor = (2 ** 63 - 1, 0)
+        args.extend(cursor)
+        args.append(limit + 1)
+        return self._fetchall(f"SELECT {cols} FROM posts WHERE {where} ORDER BY {order} LIMIT %s", args)
+
+    @staticmethod
+    def _archive(conn, post_ids, reason: str) -> int:
+        now = int(datetime.now(timezone.utc).timestamp())
+        return conn.execute(
+            "WITH moved AS (DELETE FROM posts WHERE id = ANY(%s) RETURNING *) "
+            f"INSERT INTO posts_archive ({POST_COLUMNS}, archived_at, reason, photo_unique_id) "
+            f"SELECT {POST_COLUMNS}, %s, %s, photo_unique_id FROM moved ON CONFLICT (id) DO NOTHING",
+            (list(post_ids), now, reason),
+        ).rowcount
+
+    def delete_post(self, post_id: int):
+        conn = self._db()
+        with conn.transaction():
+            self._archive(conn, [post_id], "deleted")
+
+    def get_post_photos(self, post_ids):
+        return self._fetchall(
+            "SELECT id, photo_file_id FROM posts WHERE id = ANY(%s) AND photo_file_id IS NOT NULL", (list(post_ids),)
+        )
+
+    def search_posts(self, terms: str, page: int = 0, limit: int = POSTS_PAGE_SIZE):
+        # 'nail sal' -> 'nail:* & sal:*'; anything but word characters is dropped
+        words = ["".join(ch for ch in w if ch.isalnum() or ch == "_") for w in terms.split()][:10]
+        match = " & ".join(f"{w}:*" for w in words if w)
+        if not match:
+            return []
+        now = int(datetime.now(timezone.utc).timestamp())
+        return self._fetchall(
+            "SELECT id, category, preview FROM posts, to_tsquery('simple', %s) q "
+            "WHERE search @@ q AND expires_at > %s ORDER BY ts_rank(search, q) DESC, id DESC LIMIT %s OFFSET %s",
+            (match, now, limit + 1, page * limit),
+        )
+
+    def get_category_counts(self, now: int):
+        return self._fetchall(
+            "SELECT category, posts - expired FROM (SELECT category, posts, "
+            "(SELECT COUNT(*) FROM posts p WHERE p.category = s.category AND p.expires_at <= %s) AS expired "
+            "FROM post_stats s WHERE creator_id = 0) t WHERE posts > expired",
+            (now,),
+        )
+
+    def get_profile(self, uid: int, now: int):
+        conn = self._db()
+        with conn.transaction():
+            self._ensure(conn, uid, now)
+            balance = conn.execute("SELECT balance FROM users WHERE user_id = %s", (uid,)).fetchone()[0]
+            counts = conn.execute("SELECT category, posts FROM post_stats WHERE creator_id = %s", (uid,)).fetchall()
+            posts = conn.execute(
+                "SELECT category, expires_at FROM posts WHERE creator_id = %s AND expires_at > %s ORDER BY expires_at ASC",
+                (uid, now),
+            ).fetchall() if counts else []
+        return int(balance), counts, posts
+
+    def get_expiry_schedule(self):
+        return self._fetchall("SELECT expires_at, id FROM posts")
+
+    def delete_expired(self, post_ids) -> int:
+        conn = self._db()
+        with conn.transaction():
+            return self._archive(conn, post_ids, "expired")
+
+    def prune_archive(self, cutoff: int, batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+        # freed space is reclaimed by autovacuum, so vacuum_step stays a no-op here
+        conn = self._db()
+        with conn.transaction():
+            return conn.execute(
+                "DELETE FROM posts_archive WHERE id IN (SELECT id FROM posts_archive WHERE archived_at < %s LIMIT %s)",
+                (cutoff, batch_size),
+            ).rowcount
+
+    def ensure_user(self, uid: int):
+        conn = self._db()
+        with conn.transaction():
+            self._ensure(conn, uid, int(datetime.now(timezone.utc).timestamp()))
+
+    def get_balance(self, uid: int) -> int:
+        r = self._fetchone("SELECT balance FROM users WHERE user_id = %s", (uid,))
+        return int(r[0]) if r else 0
+
+    def wallet_transaction(self, uid: int, amount: int, kind: str, idem_key: str = None):
+        conn = self._db()
+        balance = None
+        with conn.transaction():
+            found = self._find(conn, idem_key)
+            if found:
+                return found[0]
+            balance = self._apply(conn, uid, amount, kind, idem_key)
+            if balance is None:
+                raise psycopg.Rollback()
+        return balance
+
+    def get_ledger(self, uid: int, limit: int = 20):
+        return self._fetchall(
+            "SELECT id, amount, kind, post_id, balance_after, created_at FROM wallet_ledger "
+            "WHERE user_id = %s ORDER BY id DESC LIMIT %s",
+            (uid, limit),
+        )
+
+    def compact_ledger(self, cutoff: int, batch_size: int = LEDGER_COMPACT_BATCH) -> int:
+        conn = self._db()
+        removed = 0
+        with conn.transaction():
+            users = conn.execute(
+                "SELECT user_id, MAX(id) FROM wallet_ledger WHERE created_at < %s GROUP BY user_id HAVING COUNT(*) > 1 LIMIT %s",
+                (cutoff, batch_size),
+            ).fetchall()
+            for uid, last_id in users:
+                total = conn.execute(
+                    "SELECT SUM(amount)::BIGINT FROM wallet_ledger WHERE user_id = %s AND id <= %s", (uid, last_id)
+                ).fetchone()[0]
+                balance, created_at = conn.execute(
+                    "SELECT balance_after, created_at FROM wallet_ledger WHERE id = %s", (last_id,)
+                ).fetchone()
+                removed += conn.execute("DELETE FROM wallet_ledger WHERE user_id = %s AND id <= %s", (uid, last_id)).rowcount - 1
+                conn.execute(
+                    "INSERT INTO wallet_ledger (id, user_id, amount, kind, balance_after, created_at) VALUES (%s, %s, %s, 'checkpoint', %s, %s)",
+                    (last_id, uid, total, balance, created_at),
+                )
+        return removed
+
+    def list_users(self, after: int = None, direction: str = "n", limit: int = USERS_PAGE_SIZE):
+        if direction == "p":
+            sql = "SELECT user_id, balance FROM users WHERE user_id < %s ORDER BY user_id DESC LIMIT %s"
+        else:
+            sql = "SELECT user_id, balance FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s"
+            if after is None:
+                after = -(2 ** 63)
+        return self._fetchall(sql, (after, limit + 1))
+
+    def set_subscription(self, uid: int, category: str, lang: str, subscribed: bool):
+        conn = self._db()
+        with conn.transaction():
+            if subscribed:
+                conn.execute(
+                    "INSERT INTO subscriptions (category, user_id, lang, created_at) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
+                    (category, uid, lang, int(datetime.now(timezone.utc).timestamp())),
+                )
+            else:
+                conn.execute("DELETE FROM subscriptions WHERE category = %s AND user_id = %s", (category, uid))
+            conn.execute("UPDATE subscriptions SET lang = %s WHERE user_id = %s", (lang, uid))
+
+    def get_subscriptions(self, uid: int):
+        return {r[0] for r in self._fetchall("SELECT category FROM subscriptions WHERE user_id = %s", (uid,))}
+
+    def remove_subscriber(self, uid: int):
+        conn = self._db()
+        with conn.transaction():
+            conn.execute("DELETE FROM subscriptions WHERE user_id = %s", (uid,))
+
+    def get_subscribers(self, category: str, after: int = None, limit: int = FANOUT_BATCH_SIZE):
+        return self._fetchall(
+            "SELECT user_id, lang FROM subscriptions WHERE category = %s AND user_id > %s ORDER BY user_id LIMIT %s",
+            (category, -(2 ** 63) if after is None else after, limit),
+        )
+
+    def pending_notifications(self):
+        return self._fetchall("SELECT post_id, category, creator_id, after_user_id FROM notify_outbox ORDER BY post_id")
+
+    def advance_notification(self, post_id: int, after: int):
+        conn = self._db()
+        with conn.transaction():
+            conn.execute("UPDATE notify_outbox SET after_user_id = %s WHERE post_id = %s", (after, post_id))
+
+    def finish_notification(self, post_id: int):
+        conn = self._db()
+        with conn.transaction():
+            conn.execute("DELETE FROM notify_outbox WHERE post_id = %s", (post_id,))
+
+    def load_user_state(self, uid: int):
+        r = self._fetchone("SELECT data FROM user_state WHERE user_id = %s", (uid,))
+        return json.loads(r[0]) if r else None
+
+    def save_user_states(self, states: dict):
+        now = int(datetime.now(timezone.utc).timestamp())
+        conn = self._db()
+        with conn.transaction():
+            for uid, data in states.items():
+                if data is None:
+                    conn.execute("DELETE FROM user_state WHERE user_id = %s", (uid,))
+                else:
+                    conn.execute(
+                        "INSERT INTO user_state (user_id, data, updated_at) VALUES (%s, %s, %s) "
+                        "ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at",
+                        (uid, data, now),
+                    )
+
+
+def make_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "postgres":
+        return PostgresStorage(POSTGRES_DSN)
+    return SqliteStorage()
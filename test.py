@@ -1,19 +1,138 @@
+import io
 import os
-import sqlite3
+import csv
+import json
+import time
+import logging
+import heapq
+import bisect
 import asyncio
+import pstats
+import cProfile
+import hashlib
+import threading
+import functools
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputMediaPhoto,
+    InputTextMessageContent,
+    Update,
+)
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
+    BasePersistence,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
+    PersistenceInput,
     filters,
 )
 
-DB_PATH = "posts.db"
+from storage import (
+    EXPIRY_BATCH_SIZE,
+    FANOUT_BATCH_SIZE,
+    POSTS_PAGE_SIZE,
+    USERS_PAGE_SIZE,
+    VACUUM_PAGES,
+    make_storage,
+)
+
+# diagnostics (failures, slow handlers) go through logging, i.e. stderr, never stdout
+log = logging.getLogger("bot")
+
+# rendered listing keyboards kept per (screen, page, lang, posts version)
+LISTING_CACHE_SIZE = int(os.environ.get("LISTING_CACHE_SIZE", "256"))
+# inline mode (@bot <words>): results per page, server-side cache TTL/size and
+# how long Telegram may cache an answer on its side
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TTL = float(os.environ.get("INLINE_CACHE_TTL", "30"))
+INLINE_CACHE_SIZE = 1024
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "30"))
+# set POST_CACHE=0 to serve every read straight from SQLite (for comparison)
+POST_CACHE_ENABLED = os.environ.get("POST_CACHE", "1") != "0"
+# a failed expiry batch is retried after this many seconds
+EXPIRY_RETRY_SECONDS = 5
+# expired and deleted posts are moved to posts_archive (EXPIRY_BATCH_SIZE at a time,
+# EXPIRY_PAUSE_SECONDS apart while a backlog drains) and dropped from there after
+# ARCHIVE_RETENTION_DAYS; every MAINTENANCE_SECONDS, while no update is being
+# handled, free pages are returned to the filesystem VACUUM_PAGES at a time. Under
+# constant traffic a step runs anyway once it has waited MAINTENANCE_MAX_WAIT_SECONDS
+EXPIRY_PAUSE_SECONDS = float(os.environ.get("EXPIRY_PAUSE_SECONDS", "0.05"))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("ARCHIVE_RETENTION_DAYS", "30"))
+MAINTENANCE_SECONDS = float(os.environ.get("MAINTENANCE_SECONDS", "60"))
+MAINTENANCE_MAX_WAIT_SECONDS = float(os.environ.get("MAINTENANCE_MAX_WAIT_SECONDS", "5"))
+# wallet: ledger rows older than LEDGER_RETENTION_DAYS are rolled into one
+# checkpoint per user every LEDGER_COMPACT_SECONDS (their idempotency keys go
+# with them), LEDGER_COMPACT_BATCH users per transaction
+LEDGER_RETENTION_DAYS = int(os.environ.get("LEDGER_RETENTION_DAYS", "30"))
+LEDGER_COMPACT_SECONDS = float(os.environ.get("LEDGER_COMPACT_SECONDS", "3600"))
+# admin user listing: /listusers shows USERS_PAGE_SIZE users per page; /exportusers
+# reads EXPORT_CHUNK_ROWS rows per query and uploads a new CSV part once one
+# reaches EXPORT_PART_BYTES
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_PART_BYTES = int(os.environ.get("EXPORT_PART_BYTES", str(20 * 1024 * 1024)))
+# new-post notifications (FANOUT_BATCH_SIZE subscribers per outbox step):
+# notifications per second across all chats (0 = unlimited) and sends in flight
+# at once
+FANOUT_RATE = float(os.environ.get("FANOUT_RATE", "20"))
+FANOUT_CONCURRENCY = 20
+# photo posts: captions are cut to Telegram's limit; album listings send at most
+# MEDIA_GROUP_LIMIT photos per sendMediaGroup call
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+# message cleanup: max parallel deleteMessage calls when the bulk API is unavailable,
+# and CLEANUP_IN_BACKGROUND=1 to send the new screen before old messages are gone
+CLEANUP_CONCURRENCY = int(os.environ.get("CLEANUP_CONCURRENCY", "8"))
+CLEANUP_IN_BACKGROUND = os.environ.get("CLEANUP_IN_BACKGROUND", "0") == "1"
+DELETE_MESSAGES_LIMIT = 100
+# "edit" keeps one screen message per chat and edits it in place; "send" posts a new message per click
+NAV_MODE = os.environ.get("NAV_MODE", "edit")
+# outbound Bot API limits (requests per second and burst size); RATE_LIMIT=0 disables throttling
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT", "1") != "0"
+GLOBAL_RATE = float(os.environ.get("GLOBAL_RATE", "30"))
+GLOBAL_BURST = int(os.environ.get("GLOBAL_BURST", "30"))
+PER_CHAT_RATE = float(os.environ.get("PER_CHAT_RATE", "1"))
+PER_CHAT_BURST = int(os.environ.get("PER_CHAT_BURST", "3"))
+RETRY_AFTER_ATTEMPTS = 3
+# BOT_MODE=webhook serves updates over HTTP (needs python-telegram-bot[webhooks]); default is polling
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Bot API endpoint, e.g. a local Bot API server or loadtest.py's fake one
+BOT_API_URL = os.environ.get("BOT_API_URL")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+# updates handled in parallel across users; each user's updates still run in order
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "64"))
+# a repeated tap (same callback data) arriving within DEBOUNCE_SECONDS while the
+# user's previous update is still being handled is dropped (0 = off)
+DEBOUNCE_SECONDS = float(os.environ.get("DEBOUNCE_SECONDS", "1"))
+# identical reads in flight at the same time share one query; SINGLE_FLIGHT=0 to compare
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT", "1") != "0"
+# user_data (language, pending post, screen/message ids) is saved to posts.db;
+# changed users are written in one transaction every PERSISTENCE_FLUSH_SECONDS
+PERSISTENCE_ENABLED = os.environ.get("PERSISTENCE", "1") != "0"
+PERSISTENCE_FLUSH_SECONDS = float(os.environ.get("PERSISTENCE_FLUSH_SECONDS", "10"))
+# Prometheus text metrics at http://METRICS_HOST:METRICS_PORT/metrics (0 disables);
+# /cprofile <seconds> captures at most PROFILE_MAX_SECONDS, reporting PROFILE_TOP_N functions
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+PROFILE_MAX_SECONDS = 120
+PROFILE_TOP_N = 40
 CATEGORIES = [
     "computer services",
     "massage",
@@ -57,7 +176,7 @@ T = {
         "posts_in": "📰 Posts in {cat}:",
         "create_post": "➕ Create Post",
         "back": "↩️ Back",
-        "send_post_text": "Send the post text for {cat} (it will auto-delete after 2 hours).",
+        "send_post_text": "Send the post text for {cat}, or a photo with the text as its caption (it will auto-delete after 2 hours).",
         "post_created": "✅ Post created (id {id}). It will be removed in 2 hours.",
         "post_not_found": "⚠️ Post not found or expired.",
         "only_creator": "⚠️ Only the creator can delete this post.",
@@ -72,6 +191,17 @@ T = {
         "all_posts": "All posts:",
         "successfully_listed": "✅ Successfully listed.",
         "categories": "Categories",
+        "prev_page": "⬅️ Prev",
+        "next_page": "Next ➡️",
+        "search": "🔎 Search",
+        "search_prompt": "🔎 Send the words to search for (or use /search <words>).",
+        "search_results": "🔎 Results for \u201c{q}\u201d:",
+        "search_no_results": "Nothing found for \u201c{q}\u201d.",
+        "subscriptions": "🔔 Subscriptions",
+        "subscriptions_title": "🔔 Get a message when a new post appears in:",
+        "new_post_notification": "🔔 New in {cat}: {preview}",
+        "open_post": "👀 Open",
+        "photos": "🖼 Photos ({count})",
     },
     "ru": {
         "choose_lang": "🌐 Выберите язык / Choose language:",
@@ -80,7 +210,7 @@ T = {
         "posts_in": "📰 Объявления в {cat}:",
         "create_post": "➕ Создать объявление",
         "back": "↩️ Назад",
-        "send_post_text": "Отправьте текст объявления для {cat} (будет удалено через 2 часа).",
+        "send_post_text": "Отправьте текст объявления для {cat} или фото с текстом в подписи (будет удалено через 2 часа).",
         "post_created": "✅ Объявление создано (id {id}). Оно будет удалено через 2 часа.",
         "post_not_found": "⚠️ Объявление не найдено или уже истекло.",
         "only_creator": "⚠️ Только автор может удалить это объявление.",
@@ -95,201 +225,889 @@ T = {
         "all_posts": "Все объявления:",
         "successfully_listed": "✅ Объявление успешно размещено.",
         "categories": "Категории",
+        "prev_page": "⬅️ Пред.",
+        "next_page": "След. ➡️",
+        "search": "🔎 Поиск",
+        "search_prompt": "🔎 Отправьте слова для поиска (или /search <слова>).",
+        "search_results": "🔎 Результаты по запросу \u00ab{q}\u00bb:",
+        "search_no_results": "По запросу \u00ab{q}\u00bb ничего не найдено.",
+        "subscriptions": "🔔 Подписки",
+        "subscriptions_title": "🔔 Сообщать о новых объявлениях в:",
+        "new_post_notification": "🔔 Новое в {cat}: {preview}",
+        "open_post": "👀 Открыть",
+        "photos": "🖼 Фото ({count})",
     },
 }
 
+# Locale bundles resolved once at import: every locale has every key (English
+# fallback) and a label for every category.
+LOCALE_TEXTS = {lang: {**T["en"], **T.get(lang, {})} for lang in LOCALES}
+CATEGORY_LABELS = {
+    lang: {c: CAT_TRANSLATIONS.get(lang, {}).get(c) or CAT_TRANSLATIONS["en"].get(c, c.title()) for c in CATEGORIES}
+    for lang in LOCALES
+}
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category TEXT NOT NULL,
-            text TEXT NOT NULL,
-            creator_id INTEGER NOT NULL,
-            created_at INTEGER NOT NULL,
-            expires_at INTEGER NOT NULL,
-            creator_username TEXT
-        )
-        """
-    )
-    # migrate: add creator_username column if missing
-    cur.execute("PRAGMA table_info(posts)")
-    cols = [r[1] for r in cur.fetchall()]
-    if "creator_username" not in cols:
+
+def texts(lang: str) -> dict:
+    return LOCALE_TEXTS.get(lang) or LOCALE_TEXTS["en"]
+
+
+def category_label(lang: str, category: str) -> str:
+    labels = CATEGORY_LABELS.get(lang) or CATEGORY_LABELS["en"]
+    return labels.get(category) or category.title()
+
+
+# Metrics: counters/gauges and latency histograms keyed by (name, labels), where
+# labels is a tuple of (key, value) pairs. Updated from the event loop and the
+# db thread, rendered in Prometheus text format by render_metrics().
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+METRIC_HELP = {
+    "bot_updates_in_flight": ("gauge", "Updates accepted and not yet fully handled."),
+    "bot_handler_seconds": ("histogram", "Handler latency."),
+    "bot_handler_errors_total": ("counter", "Handlers that raised."),
+    "bot_callback_route_seconds": ("histogram", "Callback route latency, per route prefix."),
+    "bot_callback_route_errors_total": ("counter", "Callback routes that raised."),
+    "bot_db_seconds": ("histogram", "Time spent in a storage helper on the db thread."),
+    "bot_db_errors_total": ("counter", "Storage helpers that raised."),
+    "bot_api_seconds": ("histogram", "Outbound Bot API request latency, per method."),
+    "bot_api_errors_total": ("counter", "Outbound Bot API requests that failed or returned an error status."),
+    "bot_single_flight_calls_total": ("counter", "Coalescable storage reads requested."),
+    "bot_single_flight_shared_total": ("counter", "Storage reads served by joining an identical read already in flight."),
+    "bot_callbacks_debounced_total": ("counter", "Repeated button taps dropped while the previous one was being handled."),
+}
+METRICS = {}
+HISTOGRAMS = {}
+_metrics_lock = threading.Lock()
+# callables returning [(name, type, help, labels, value)], evaluated on each scrape
+METRIC_COLLECTORS = []
+
+
+def metric_inc(name: str, labels: tuple = (), value: float = 1):
+    with _metrics_lock:
+        METRICS[(name, labels)] = METRICS.get((name, labels), 0) + value
+
+
+def metric_observe(name: str, labels: tuple, seconds: float):
+    with _metrics_lock:
+        hist = HISTOGRAMS.get((name, labels))
+        if hist is None:
+            # count per bucket, overflow count, sum of seconds
+            hist = HISTOGRAMS[(name, labels)] = [0] * (len(LATENCY_BUCKETS_MS) + 1) + [0.0]
+        hist[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+        hist[-1] += seconds
+
+
+def _metric_labels(labels, extra=()) -> str:
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+async def render_metrics() -> str:
+    families = {}
+    with _metrics_lock:
+        for (name, labels), value in METRICS.items():
+            families.setdefault(name, []).append(f"{name}{_metric_labels(labels)} {value}")
+        for (name, labels), hist in HISTOGRAMS.items():
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS_MS, hist):
+                cumulative += count
+                lines.append(f"{name}_bucket{_metric_labels(labels, [('le', bound / 1000)])} {cumulative}")
+            cumulative += hist[-2]
+            lines.append(f"{name}_bucket{_metric_labels(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{name}_sum{_metric_labels(labels)} {hist[-1]}")
+            lines.append(f"{name}_count{_metric_labels(labels)} {cumulative}")
+    helps = dict(METRIC_HELP)
+    for collect in METRIC_COLLECTORS:
         try:
-            cur.execute("ALTER TABLE posts ADD COLUMN creator_username TEXT")
-        except Exception:
+            samples = collect()
+            if asyncio.iscoroutine(samples):
+                samples = await samples
+        except Exception as e:
+            log.warning("metrics: collector %s failed: %s", collect.__name__, e)
+            continue
+        for name, kind, text, labels, value in samples:
+            helps.setdefault(name, (kind, text))
+            families.setdefault(name, []).append(f"{name}{_metric_labels(labels)} {value}")
+    out = []
+    for name in sorted(families):
+        kind, text = helps.get(name, ("untyped", name))
+        out.append(f"# HELP {name} {text}")
+        out.append(f"# TYPE {name} {kind}")
+        out.extend(families[name])
+    return "\n".join(out) + "\n"
+
+
+async def _serve_metrics(reader, writer):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
             pass
+        parts = request.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body, ctype = "200 OK", (await render_metrics()).encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body, ctype = "404 Not Found", b"not found\n", "text/plain"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
 
-    # create users table for virtual wallet
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            balance INTEGER NOT NULL DEFAULT 100
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
 
+# Storage (storage.py) runs on a single worker thread that owns the connection.
+# Every helper below is a @db_task, so callers await it and the event loop never
+# blocks on disk I/O.
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tgpp-db")
 
-def create_post(category: str, text: str, creator_id: int, creator_username: str = None, expires_seconds: int = 7200):
-    now = int(datetime.now(timezone.utc).timestamp())
-    expires = now + expires_seconds
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO posts (category, text, creator_id, created_at, expires_at, creator_username) VALUES (?, ?, ?, ?, ?, ?)",
-        (category, text, creator_id, now, expires, creator_username),
-    )
-    post_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    return post_id
-
-
-def ensure_user(uid: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR IGNORE INTO users (user_id, balance) VALUES (?, ?)", (uid, 100))
-    conn.commit()
-    conn.close()
-
-
-def get_balance(uid: int) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT balance FROM users WHERE user_id = ?", (uid,))
-    r = cur.fetchone()
-    conn.close()
-    if not r:
-        return 0
-    return int(r[0])
-
-
-def charge_user(uid: int, amount: int) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT balance FROM users WHERE user_id = ?", (uid,))
-    r = cur.fetchone()
-    if not r:
-        conn.close()
-        return False
-    bal = int(r[0])
-    if bal < amount:
-        conn.close()
-        return False
-    cur.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (amount, uid))
-    conn.commit()
-    conn.close()
-    return True
-
-
-def get_posts(category: str):
-    now = int(datetime.now(timezone.utc).timestamp())
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, text, creator_id, created_at, expires_at FROM posts WHERE category = ? AND expires_at > ? ORDER BY created_at DESC",
-        (category, now),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
+def db_task(fn):
+    """Run a blocking storage helper on the db thread and return an awaitable."""
+    labels = (("op", fn.__name__),)
 
-def get_post(post_id: int):
-    now = int(datetime.now(timezone.utc).timestamp())
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, category, text, creator_id, created_at, expires_at, creator_username FROM posts WHERE id = ? AND expires_at > ?",
-        (post_id, now),
-    )
-    row = cur.fetchone()
-    conn.close()
+    def measured(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            metric_inc("bot_db_errors_total", labels)
+            raise
+        finally:
+            metric_observe("bot_db_seconds", labels, time.perf_counter() - start)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_db_executor, functools.partial(measured, *args, **kwargs))
+    wrapper.sync = fn
+    return wrapper
+
+
+storage = make_storage()
+
+
+def storage_task(name: str):
+    """An awaitable that calls storage.<name> on the db thread."""
+    def call(*args, **kwargs):
+        return getattr(storage, name)(*args, **kwargs)
+    call.__name__ = name
+    return db_task(call)
+
+
+def single_flight(fn):
+    """Let concurrent calls with the same arguments share one in-flight call.
+
+    The first caller starts fn; callers arriving before it finishes await the
+    same future and get the same result (or exception). Only for reads.
+    """
+    in_flight = {}
+    labels = (("op", fn.__name__),)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not SINGLE_FLIGHT_ENABLED:
+            return await fn(*args, **kwargs)
+        metric_inc("bot_single_flight_calls_total", labels)
+        key = (args, tuple(sorted(kwargs.items())))
+        fut = in_flight.get(key)
+        if fut is None:
+            fut = in_flight[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            fut.add_done_callback(lambda _: in_flight.pop(key, None))
+        else:
+            metric_inc("bot_single_flight_shared_total", labels)
+        # shielded, so one caller being cancelled does not cancel the others
+        return await asyncio.shield(fut)
+    return wrapper
+
+
+def init_db():
+    storage.migrate()
+
+
+_db_insert_post = storage_task("insert_post")
+_db_publish_paid_post = storage_task("publish_paid_post")
+_db_get_post = single_flight(storage_task("get_post"))
+_db_get_posts_by_id = single_flight(storage_task("get_posts_by_id"))
+_db_get_all_posts = single_flight(storage_task("get_all_posts"))
+_db_get_posts_page = single_flight(storage_task("get_posts_page"))
+_db_delete_post = storage_task("delete_post")
+_db_get_post_photos = single_flight(storage_task("get_post_photos"))
+search_posts = single_flight(storage_task("search_posts"))
+get_category_counts = single_flight(storage_task("get_category_counts"))
+get_profile = storage_task("get_profile")
+_db_get_expiry_schedule = storage_task("get_expiry_schedule")
+cleanup_expired = storage_task("delete_expired")
+prune_archive = storage_task("prune_archive")
+vacuum_step = storage_task("vacuum_step")
+ensure_user = storage_task("ensure_user")
+get_balance = storage_task("get_balance")
+_wallet_transaction = storage_task("wallet_transaction")
+get_ledger = storage_task("get_ledger")
+compact_ledger = storage_task("compact_ledger")
+list_users = storage_task("list_users")
+set_subscription = storage_task("set_subscription")
+get_subscriptions = storage_task("get_subscriptions")
+remove_subscriber = storage_task("remove_subscriber")
+get_subscribers = storage_task("get_subscribers")
+pending_notifications = storage_task("pending_notifications")
+advance_notification = storage_task("advance_notification")
+finish_notification = storage_task("finish_notification")
+_db_load_user_state = storage_task("load_user_state")
+_db_save_user_states = storage_task("save_user_states")
+
+
+async def topup_user(uid: int, amount: int, idem_key: str = None):
+    # new balance, or None if a negative amount would overdraw the wallet
+    return await _wallet_transaction(uid, amount, "topup", idem_key)
+
+
+class PostCache:
+    """Active posts held in memory, indexed by id and by category.
+
+    Rows use the get_post shape (id, category, text, creator_id, created_at,
+    expires_at, creator_username, preview, photo). Listings are kept as sorted (created_at, id)
+    key lists so pages can be cut with bisect. Entries are evicted from an
+    expiry heap as soon as expires_at passes, independent of the DB delete.
+    Only touched from the event loop thread.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        # bumped on every add/remove so rendered listings know when they are stale
+        self.version = 0
+        self._by_id = {}
+        self._order = []
+        self._by_cat = {}
+        self._expiry = []
+
+    def load(self, rows):
+        self._by_id.clear()
+        self._order.clear()
+        self._by_cat.clear()
+        self._expiry.clear()
+        if not self.enabled:
+            return
+        for row in rows:
+            self.add(row)
+        self.loaded = True
+
+    def add(self, row):
+        self.version += 1
+        if not self.enabled:
+            return
+        pid, category, created_at, expires_at = row[0], row[1], row[4], row[5]
+        key = (created_at, pid)
+        self._by_id[pid] = row
+        bisect.insort(self._order, key)
+        bisect.insort(self._by_cat.setdefault(category, []), key)
+        heapq.heappush(self._expiry, (expires_at, pid))
+
+    def remove(self, post_id: int):
+        self.version += 1
+        row = self._by_id.pop(post_id, None)
+        if row is None:
+            # already gone; a stale heap entry is discarded when it comes due
+            return
+        key = (row[4], post_id)
+        for keys in (self._order, self._by_cat.get(row[1], [])):
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def evict_expired(self, now: int):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, pid = heapq.heappop(self._expiry)
+            self.remove(pid)
+
+    # the readers below return None on a miss so callers fall back to the DB
+
+    def _ready(self, now: int) -> bool:
+        if not (self.enabled and self.loaded):
+            self.misses += 1
+            return False
+        self.evict_expired(now)
+        return True
+
+    def _rows(self, keys, category):
+        rows = [self._by_id[pid] for _, pid in keys]
+        if category is not None:
+            rows = [(r[0], r[2], r[3], r[4], r[5], r[7]) for r in rows]
+        return rows
+
+    def get(self, post_id: int, now: int):
+        if not self._ready(now):
+            return None
+        row = self._by_id.get(post_id)
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def page(self, category, cursor, direction: str, limit: int, now: int):
+        # same contract as _db_get_posts_page
+        if not self._ready(now):
+            return None
+        self.hits += 1
+        keys = self._order if category is None else self._by_cat.get(category, [])
+        if direction == "p":
+            i = bisect.bisect_right(keys, cursor)
+            return self._rows(keys[i:i + limit + 1], category)
+        i = len(keys) if cursor is None else bisect.bisect_left(keys, cursor)
+        return self._rows(reversed(keys[max(0, i - limit - 1):i]), category)
+
+    def photos(self, post_ids, now: int):
+        # same contract as _db_get_post_photos
+        if not self._ready(now):
+            return None
+        self.hits += 1
+        rows = (self._by_id.get(pid) for pid in post_ids)
+        return [(row[0], row[8]) for row in rows if row is not None and row[8] is not None]
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "size": len(self._by_id), "hits": self.hits, "misses": self.misses}
+
+
+post_cache = PostCache(enabled=POST_CACHE_ENABLED)
+
+
+class ExpiryScheduler:
+    """Archives posts when they expire, from one min-heap of (expires_at, id).
+
+    The heap is rebuilt from the posts table at boot, so nothing is lost on
+    restart: rows that expired while the bot was down are due immediately. A
+    single task sleeps until the earliest deadline (or until an earlier post is
+    scheduled) and moves due posts to posts_archive in batches of
+    EXPIRY_BATCH_SIZE, pausing EXPIRY_PAUSE_SECONDS between batches so a large
+    backlog does not hold the db thread against live traffic.
+    """
+
+    def __init__(self, batch_size: int = EXPIRY_BATCH_SIZE, pause: float = EXPIRY_PAUSE_SECONDS):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.deleted = 0
+        self.last_lag = 0
+        self.max_lag = 0
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        self._heap = list(await _db_get_expiry_schedule())
+        heapq.heapify(self._heap)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, post_id: int, expires_at: int):
+        heapq.heappush(self._heap, (expires_at, post_id))
+        if self._heap[0][1] == post_id:
+            self._wakeup.set()
+
+    def due(self, now: int) -> int:
+        # entries with expires_at <= now; only the part of the heap above now is walked
+        heap, count, stack = self._heap, 0, [0] if self._heap else []
+        while stack:
+            i = stack.pop()
+            if heap[i][0] <= now:
+                count += 1
+                stack.extend(j for j in (2 * i + 1, 2 * i + 2) if j < len(heap))
+        return count
+
+    def stats(self) -> dict:
+        now = int(datetime.now(timezone.utc).timestamp())
+        overdue = now - self._heap[0][0] if self._heap and self._heap[0][0] <= now else 0
+        return {
+            "scheduled": len(self._heap),
+            "due": self.due(now),
+            "deleted": self.deleted,
+            "overdue_seconds": overdue,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+        }
+
+    async def _run(self):
+        while True:
+            now = int(datetime.now(timezone.utc).timestamp())
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                due.append(heapq.heappop(self._heap))
+            if due:
+                ids = [pid for _, pid in due]
+                try:
+                    self.deleted += await cleanup_expired(ids)
+                except Exception as e:
+                    log.warning("expiry: failed to delete %d posts, retrying: %s", len(ids), e)
+                    for item in due:
+                        heapq.heappush(self._heap, item)
+                    await asyncio.sleep(EXPIRY_RETRY_SECONDS)
+                    continue
+                for pid in ids:
+                    post_cache.remove(pid)
+                self.last_lag = now - due[0][0]
+                self.max_lag = max(self.max_lag, self.last_lag)
+                if len(due) == self.batch_size:
+                    await asyncio.sleep(self.pause)
+                continue
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+expiry_scheduler = ExpiryScheduler()
+
+
+class LedgerCompactor:
+    """Rolls old wallet_ledger rows into per-user checkpoints in the background.
+
+    Every LEDGER_COMPACT_SECONDS it compacts rows older than
+    LEDGER_RETENTION_DAYS in short transactions, yielding to other database
+    work between batches, so the ledger stays proportional to recent activity.
+    """
+
+    def __init__(self, interval: float = LEDGER_COMPACT_SECONDS):
+        self.interval = interval
+        self.runs = 0
+        self.removed = 0
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def compact(self) -> int:
+        cutoff = int(datetime.now(timezone.utc).timestamp()) - LEDGER_RETENTION_DAYS * 86400
+        removed = 0
+        while True:
+            n = await compact_ledger(cutoff)
+            if not n:
+                break
+            removed += n
+        self.runs += 1
+        self.removed += removed
+        return removed
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "removed": self.removed}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                log.warning("ledger: compaction failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+ledger_compactor = LedgerCompactor()
+
+
+def updates_in_flight() -> int:
+    return METRICS.get(("bot_updates_in_flight", ()), 0)
+
+
+class DbMaintenance:
+    """Keeps the database file small in the background.
+
+    Every MAINTENANCE_SECONDS it drops posts archived more than
+    ARCHIVE_RETENTION_DAYS ago, one EXPIRY_BATCH_SIZE batch at a time, then
+    hands free pages back to the filesystem with incremental_vacuum steps of
+    VACUUM_PAGES. Each step is a short db task and waits for a moment when no
+    update is being handled, so it fills idle time instead of adding to
+    latency. If the bot is never idle, a step runs anyway after max_wait
+    seconds, so under constant traffic the work still advances one step at a time.
+    """
+
+    def __init__(
+        self, interval: float = MAINTENANCE_SECONDS, pages: int = VACUUM_PAGES, pause: float = EXPIRY_PAUSE_SECONDS,
+        max_wait: float = MAINTENANCE_MAX_WAIT_SECONDS,
+    ):
+        self.interval = interval
+        self.pages = pages
+        self.pause = pause
+        self.max_wait = max_wait
+        self.runs = 0
+        self.pruned = 0
+        self.free_pages = 0
+        self.forced_steps = 0
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "pruned": self.pruned, "free_pages": self.free_pages, "forced_steps": self.forced_steps}
+
+    async def _idle(self):
+        deadline = time.monotonic() + self.max_wait
+        while updates_in_flight() > 0:
+            if time.monotonic() >= deadline:
+                self.forced_steps += 1
+                return
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self):
+        cutoff = int(datetime.now(timezone.utc).timestamp()) - ARCHIVE_RETENTION_DAYS * 86400
+        while True:
+            await self._idle()
+            n = await prune_archive(cutoff)
+            self.pruned += n
+            if n < EXPIRY_BATCH_SIZE:
+                break
+            await asyncio.sleep(self.pause)
+        free = None
+        while free != 0:
+            await self._idle()
+            prev, free = free, await vacuum_step(self.pages)
+            self.free_pages = free
+            if free == prev:
+                break
+            await asyncio.sleep(self.pause)
+        self.runs += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                log.warning("maintenance: failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+db_maintenance = DbMaintenance()
+
+
+class NotificationFanout:
+    """Tells category subscribers about new posts, from the notify_outbox table.
+
+    Posts are handled one at a time in id order, FANOUT_BATCH_SIZE subscribers
+    per step. The outbox cursor only moves once a whole batch has been sent, so
+    after a restart delivery resumes where it stopped, resending at most one
+    batch. Sends are paced to FANOUT_RATE per second with at most
+    FANOUT_CONCURRENCY in flight, and go through the bot's OutboundLimiter (when
+    enabled) at PRIORITY_NOTIFY, which adds the per-chat limit and lets screen
+    replies overtake them. Users who blocked the bot are unsubscribed.
+    """
+
+    def __init__(self, batch_size: int = FANOUT_BATCH_SIZE, rate: float = FANOUT_RATE, concurrency: int = FANOUT_CONCURRENCY):
+        self.batch_size = batch_size
+        self.rate = rate
+        self.concurrency = concurrency
+        self.sent = 0
+        self.failed = 0
+        self.unsubscribed = 0
+        self.pending = 0
+        self._bot = None
+        self._bucket = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self, bot):
+        self._bot = bot
+        self._bucket = TokenBucket(self.rate, max(1, int(self.rate))) if self.rate > 0 else None
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "sent": self.sent, "failed": self.failed, "unsubscribed": self.unsubscribed}
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                outbox = await pending_notifications()
+                self.pending = len(outbox)
+                for post_id, category, creator_id, after in outbox:
+                    await self._deliver(post_id, category, creator_id, after)
+                    self.pending -= 1
+            except Exception as e:
+                log.warning("fanout: delivery failed, retrying: %s", e)
+                await asyncio.sleep(EXPIRY_RETRY_SECONDS)
+                continue
+            if not outbox:
+                await self._wakeup.wait()
+
+    async def _deliver(self, post_id: int, category: str, creator_id: int, after):
+        messages = {}
+        limit = asyncio.Semaphore(self.concurrency)
+        while True:
+            # stop early once the post is deleted or expires
+            row = await get_post(post_id)
+            if row is None:
+                break
+            subscribers = await get_subscribers(category, after, self.batch_size)
+            if not subscribers:
+                break
+            tasks = []
+            for uid, lang in subscribers:
+                if uid == creator_id:
+                    continue
+                if lang not in messages:
+                    text = texts(lang)["new_post_notification"].format(cat=category_label(lang, category), preview=row[7])
+                    markup = InlineKeyboardMarkup([[InlineKeyboardButton(texts(lang)["open_post"], callback_data=f"view:{post_id}")]])
+                    messages[lang] = (text, markup)
+                await self._pace()
+                await limit.acquire()
+                tasks.append(asyncio.create_task(self._send(limit, uid, *messages[lang])))
+            await asyncio.gather(*tasks)
+            after = subscribers[-1][0]
+            await advance_notification(post_id, after)
+        await finish_notification(post_id)
+
+    async def _pace(self):
+        if self._bucket is None:
+            return
+        while True:
+            now = time.monotonic()
+            delay = self._bucket.delay(now)
+            if delay <= 0:
+                self._bucket.take(now)
+                return
+            await asyncio.sleep(delay)
+
+    async def _send(self, limit: asyncio.Semaphore, uid: int, text: str, markup):
+        kwargs = {"rate_limit_args": {"priority": PRIORITY_NOTIFY}} if self._bot.rate_limiter else {}
+        try:
+            for attempt in range(2):
+                try:
+                    await self._bot.send_message(chat_id=uid, text=text, reply_markup=markup, **kwargs)
+                    self.sent += 1
+                    return
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                    await asyncio.sleep(delay)
+            self.failed += 1
+        except Forbidden:
+            # blocked the bot or deactivated; stop notifying them
+            self.unsubscribed += 1
+            await remove_subscriber(uid)
+        except TelegramError as e:
+            self.failed += 1
+            log.warning("fanout: notify %s failed: %s", uid, e)
+        finally:
+            limit.release()
+
+
+notification_fanout = NotificationFanout()
+
+
+async def create_post(category: str, text: str, creator_id: int, creator_username: str = None, expires_seconds: int = 7200, photo=None):
+    row = await _db_insert_post(category, text, creator_id, creator_username, expires_seconds, photo)
+    post_cache.add(row)
+    expiry_scheduler.schedule(row[0], row[5])
+    notification_fanout.wake()
+    return row[0]
+
+
+async def publish_paid_post(
+    category: str, text: str, creator_id: int, creator_username: str = None, price: int = 0, expires_seconds: int = 7200, idem_key: str = None,
+    photo=None,
+):
+    """Charge the creator and create the post in one transaction.
+
+    Returns the new post id, or None when the wallet cannot cover the price.
+    A repeated idem_key returns the id of the post it already created (paid
+    posts only; a free post is not charged and leaves no ledger row). photo
+    is (file_id, file_unique_id) for a photo post.
+    """
+    result = await _db_publish_paid_post(category, text, creator_id, creator_username, price, expires_seconds, idem_key, photo)
+    if result is None:
+        return None
+    pid, row = result
+    if row is None:
+        return pid
+    post_cache.add(row)
+    expiry_scheduler.schedule(row[0], row[5])
+    notification_fanout.wake()
+    return row[0]
+
+
+async def delete_post_db(post_id: int):
+    # the cache follows the DB only once the delete is committed
+    await _db_delete_post(post_id)
+    post_cache.remove(post_id)
+
+
+async def get_post(post_id: int):
+    # a cache miss is confirmed against the DB rather than trusted
+    row = post_cache.get(post_id, int(datetime.now(timezone.utc).timestamp()))
+    if row is None:
+        row = await _db_get_post(post_id)
     return row
 
 
-def get_all_posts():
+async def get_posts_by_id(post_ids):
+    """Post rows for post_ids, in that order; posts that are gone are skipped."""
     now = int(datetime.now(timezone.utc).timestamp())
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, category, text, creator_id, created_at, expires_at, creator_username FROM posts WHERE expires_at > ? ORDER BY created_at DESC",
-        (now,)
-    )
-    rows = cur.fetchall()
-    conn.close()
+    found = {}
+    for pid in post_ids:
+        row = post_cache.get(pid, now)
+        if row is not None:
+            found[pid] = row
+    missing = tuple(pid for pid in post_ids if pid not in found)
+    if missing:
+        for row in await _db_get_posts_by_id(missing):
+            found[row[0]] = row
+    return [found[pid] for pid in post_ids if pid in found]
+
+
+async def get_post_photos(post_ids):
+    """(post_id, file_id) for those of post_ids that have a photo."""
+    rows = post_cache.photos(post_ids, int(datetime.now(timezone.utc).timestamp()))
+    if rows is None:
+        rows = await _db_get_post_photos(tuple(post_ids))
     return rows
 
 
-def list_all_posts_markup(posts, lang: str = "en"):
+def encode_cursor(direction: str, key) -> str:
+    return f"{direction}:{key[0]}:{key[1]}"
+
+
+def decode_cursor(raw: str):
+    # "n:<created_at>:<id>" -> ("n", (created_at, id)); anything invalid is the first page
+    try:
+        direction, created_at, pid = raw.split(":")
+        if direction in ("n", "p"):
+            return direction, (int(created_at), int(pid))
+    except Exception:
+        pass
+    return "n", None
+
+
+async def get_posts_page(category: str = None, cursor=None, direction: str = "n", limit: int = POSTS_PAGE_SIZE):
+    """Return (rows, prev_cursor, next_cursor) for one listing page.
+
+    category=None pages over all posts (get_all_posts row shape), otherwise
+    over one category (get_posts row shape). Cursors are encoded for callback
+    data, or None when there is nothing further in that direction.
+    """
+    if direction == "p" and cursor is None:
+        direction = "n"
+    now = int(datetime.now(timezone.utc).timestamp())
+    rows = post_cache.page(category, cursor, direction, limit, now)
+    if rows is None:
+        rows = await _db_get_posts_page(category, cursor, direction, limit)
+    ts = 4 if category is None else 3
+    more = len(rows) > limit
+    rows = list(rows[:limit])
+    if direction == "p":
+        if not rows:
+            # everything newer is gone; show the first page instead
+            return await get_posts_page(category, None, "n", limit)
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+    prev_cursor = encode_cursor("p", (rows[0][ts], rows[0][0])) if rows and has_prev else None
+    next_cursor = encode_cursor("n", (rows[-1][ts], rows[-1][0])) if rows and has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+def page_nav_row(prefix: str, prev_cursor, next_cursor, lang: str = "en"):
+    row = []
+    if prev_cursor:
+        row.append(InlineKeyboardButton(texts(lang)["prev_page"], callback_data=f"{prefix}:{prev_cursor}"))
+    if next_cursor:
+        row.append(InlineKeyboardButton(texts(lang)["next_page"], callback_data=f"{prefix}:{next_cursor}"))
+    return row
+
+
+def list_all_posts_markup(posts, lang: str = "en", prev_cursor: str = None, next_cursor: str = None):
     keyboard = []
     for p in posts:
-        pid = p[0]
-        # p: (id, category, text, creator_id, created_at, expires_at, creator_username)
-        cat = p[1]
-        text = p[2]
+        # p: (id, category, text, creator_id, created_at, expires_at, creator_username, preview, photo)
         # show only emoji (no category text) alongside a short preview
-        emoji = CAT_EMOJIS.get(cat, "")
-        label_text = text if len(text) <= 30 else text[:27] + "..."
-        label = f"{emoji} {label_text}"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"view:{pid}")])
+        keyboard.append([InlineKeyboardButton(f"{CAT_EMOJIS.get(p[1], '')} {p[7]}", callback_data=f"view:{p[0]}")])
+    nav = page_nav_row("allposts", prev_cursor, next_cursor, lang)
+    if nav:
+        keyboard.append(nav)
     # bottom row: profile and categories
     keyboard.append([
         InlineKeyboardButton("👤 Profile", callback_data="profile"),
-        InlineKeyboardButton(T.get(lang, T["en"])["categories"], callback_data="categories"),
+        InlineKeyboardButton(texts(lang)["categories"], callback_data="categories"),
     ])
     return InlineKeyboardMarkup(keyboard)
 
 
-def list_posts_markup(category: str, posts, lang: str = "en"):
-    """Build markup for posts within a single category. Shows emoji + preview for each post."""
+def list_posts_markup(category: str, posts, lang: str = "en", prev_cursor: str = None, next_cursor: str = None, photos: int = 0, page: str = None):
+    """Build markup for posts within a single category. Shows emoji + preview for each post.
+
+    photos is how many posts on the page have a photo; when there are any, a
+    button sends them as an album (page is the page's own cursor, if not the first).
+    """
     keyboard = []
+    emoji = CAT_EMOJIS.get(category, "")
     for p in posts:
-        pid = p[0]
-        # p: (id, text, creator_id, created_at, expires_at)
-        text = p[1]
-        emoji = CAT_EMOJIS.get(category, "")
-        label_text = text if len(text) <= 30 else text[:27] + "..."
-        label = f"{emoji} {label_text}"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"view:{pid}")])
+        # p: (id, text, creator_id, created_at, expires_at, preview)
+        keyboard.append([InlineKeyboardButton(f"{emoji} {p[5]}", callback_data=f"view:{p[0]}")])
+    nav = page_nav_row(f"cat:{cat_code(category)}", prev_cursor, next_cursor, lang)
+    if nav:
+        keyboard.append(nav)
+    if photos:
+        album = f"album:{cat_code(category)}" + (f":{page}" if page else "")
+        keyboard.append([InlineKeyboardButton(texts(lang)["photos"].format(count=photos), callback_data=album)])
     # actions: create and back
-    keyboard.append([InlineKeyboardButton(T.get(lang, T["en"])["create_post"], callback_data=f"create:{category}")])
-    keyboard.append([InlineKeyboardButton(T.get(lang, T["en"])["back"], callback_data="back")])
+    keyboard.append([InlineKeyboardButton(texts(lang)["create_post"], callback_data=f"create:{cat_code(category)}")])
+    keyboard.append([InlineKeyboardButton(texts(lang)["back"], callback_data="back")])
     return InlineKeyboardMarkup(keyboard)
 
 
-def delete_post_db(post_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM posts WHERE id = ?", (post_id,))
-    conn.commit()
-    conn.close()
-
-
-async def cleanup_expired():
-    now = int(datetime.now(timezone.utc).timestamp())
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM posts WHERE expires_at <= ?", (now,))
-    conn.commit()
-    conn.close()
-
-
-def build_categories_markup(lang: str = "en"):
+def _categories_markup(lang: str, counts: dict):
     keyboard = []
     for c in CATEGORIES:
-        label = CAT_TRANSLATIONS.get(lang, CAT_TRANSLATIONS["en"]).get(c, c.title())
+        label = category_label(lang, c)
         emoji = CAT_EMOJIS.get(c, "")
-        keyboard.append([InlineKeyboardButton(f"{emoji} {label}", callback_data=f"cat:{c}")])
-    # all posts, profile button and language switch
-    keyboard.append([InlineKeyboardButton("📰 All Posts", callback_data="allposts")])
+        keyboard.append([InlineKeyboardButton(f"{emoji} {label} ({counts.get(c, 0)})", callback_data=f"cat:{cat_code(c)}")])
+    # all posts, search, profile button and language switch
+    keyboard.append([
+        InlineKeyboardButton("📰 All Posts", callback_data="allposts"),
+        InlineKeyboardButton(texts(lang)["search"], callback_data="search"),
+    ])
     keyboard.append([
         InlineKeyboardButton("👤 Profile", callback_data="profile"),
         InlineKeyboardButton("🌐 Рус/En", callback_data="switchlang"),
@@ -297,6 +1115,123 @@ def build_categories_markup(lang: str = "en"):
     return InlineKeyboardMarkup(keyboard)
 
 
+def _language_markup(lang: str):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("English", callback_data="lang:en"), InlineKeyboardButton("Русский", callback_data="lang:ru")]
+    ])
+
+
+def _no_posts_markup(lang: str, category: str):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(texts(lang)["create_post"], callback_data=f"create:{cat_code(category)}")],
+        [InlineKeyboardButton(texts(lang)["back"], callback_data="back")],
+    ])
+
+
+def _empty_listing_markup(lang: str):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(texts(lang)["categories"], callback_data="categories")]])
+
+
+def _create_duration_markup(lang: str, category: str):
+    code = cat_code(category)
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("⏱️ 2h — 20₽", callback_data=f"create2:{code}"), InlineKeyboardButton("⏱️ 24h — 50₽", callback_data=f"create24:{code}")],
+        [InlineKeyboardButton(texts(lang)["back"], callback_data=f"cat:{code}")],
+    ])
+
+
+def _search_prompt_markup(lang: str):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(texts(lang)["back"], callback_data="back")]])
+
+
+def _profile_markup(lang: str):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("💳 Top UP", callback_data="topup")],
+        [InlineKeyboardButton(texts(lang)["subscriptions"], callback_data="subs")],
+        [InlineKeyboardButton(texts(lang)["back"], callback_data="back")],
+    ])
+
+
+# keyboards that never change, built once per (name, lang[, category])
+STATIC_KEYBOARDS = {}
+_STATIC_BUILDERS = {
+    "language": _language_markup,
+    "empty_listing": _empty_listing_markup,
+    "profile": _profile_markup,
+    "search_prompt": _search_prompt_markup,
+    "no_posts": _no_posts_markup,
+    "create_duration": _create_duration_markup,
+}
+_PER_CATEGORY_KEYBOARDS = ("no_posts", "create_duration")
+
+
+def static_keyboard(name: str, lang: str = "en", category: str = None):
+    key = (name, lang, category)
+    markup = STATIC_KEYBOARDS.get(key)
+    if markup is None:
+        builder = _STATIC_BUILDERS[name]
+        markup = builder(lang, category) if category is not None else builder(lang)
+        STATIC_KEYBOARDS[key] = markup
+    return markup
+
+
+def compile_keyboards():
+    for lang in LOCALES:
+        for name in _STATIC_BUILDERS:
+            if name in _PER_CATEGORY_KEYBOARDS:
+                for c in CATEGORIES:
+                    static_keyboard(name, lang, c)
+            else:
+                static_keyboard(name, lang)
+
+
+# lang -> (posts version, markup); the counts are re-read only after a post was added or removed
+_categories_markups = {}
+
+
+async def build_categories_markup(lang: str = "en"):
+    now = int(datetime.now(timezone.utc).timestamp())
+    # a post that just expired bumps the version here, as it does for the listings
+    post_cache.evict_expired(now)
+    version = post_cache.version
+    cached = _categories_markups.get(lang)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    markup = _categories_markup(lang, dict(await get_category_counts(now)))
+    _categories_markups[lang] = (version, markup)
+    return markup
+
+
+# LRU of rendered listing pages; keyed on post_cache.version so any post change misses
+_listing_cache = OrderedDict()
+listing_cache_stats = {"hits": 0, "misses": 0}
+
+
+async def render_listing(category, cursor, lang: str):
+    """Return (has_posts, markup) for one listing page (category=None for all posts)."""
+    direction, key = cursor
+    cache_key = (category, direction, key, lang, post_cache.version)
+    cached = _listing_cache.get(cache_key)
+    if cached is not None:
+        _listing_cache.move_to_end(cache_key)
+        listing_cache_stats["hits"] += 1
+        return cached
+    listing_cache_stats["misses"] += 1
+    posts, prev_cursor, next_cursor = await get_posts_page(category, key, direction)
+    if not posts:
+        result = (False, None)
+    elif category is None:
+        result = (True, list_all_posts_markup(posts, lang, prev_cursor, next_cursor))
+    else:
+        photos = await get_post_photos(tuple(p[0] for p in posts))
+        page = encode_cursor(direction, key) if key is not None else None
+        result = (True, list_posts_markup(category, posts, lang, prev_cursor, next_cursor, len(photos), page))
+    _listing_cache[cache_key] = result
+    if len(_listing_cache) > LISTING_CACHE_SIZE:
+        _listing_cache.popitem(last=False)
+    return result
+
+
 def format_duration(seconds: int, lang: str = "en") -> str:
     seconds = max(0, int(seconds))
     mins = seconds // 60
@@ -316,24 +1251,430 @@ def format_duration(seconds: int, lang: str = "en") -> str:
     return f"{mins}m"
 
 
-async def clear_user_messages(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_data: dict):
-    # delete previously recorded USER and BOT messages for a user/chat
-    # delete user messages first
-    user_msg_ids = user_data.get("user_messages", [])
-    for mid in user_msg_ids:
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        # seconds until one token is available (0 if available now)
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+# outbound priority classes, lower goes first; pass rate_limit_args={"priority": ...} to override
+PRIORITY_REPLY = 0
+PRIORITY_CLEANUP = 1
+PRIORITY_NOTIFY = 2
+CLEANUP_ENDPOINTS = {"deleteMessage", "deleteMessages"}
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """Throttles chat-bound Bot API calls through a prioritized queue.
+
+    Every call that targets a chat waits for a token from the global bucket and
+    from that chat's bucket. Waiting calls are released in (priority, arrival)
+    order, skipping over calls whose chat is still throttled, so screens for the
+    current click overtake queued cleanup deletions. A RetryAfter from Telegram
+    pauses all sending for the requested time and the call is retried.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: int = GLOBAL_BURST,
+                 chat_rate: float = PER_CHAT_RATE, chat_burst: int = PER_CHAT_BURST):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}
+        self._waiting = []
+        self._seq = 0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.retry_after_hits = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def initialize(self):
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self._waiting),
+            "max_queue_depth": self.max_depth,
+            "sent": self.sent,
+            "retry_after": self.retry_after_hits,
+            "avg_wait_seconds": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # callback answers, inline answers etc. are not chat sends
+            return await callback(*args, **kwargs)
+        priority = PRIORITY_CLEANUP if endpoint in CLEANUP_ENDPOINTS else PRIORITY_REPLY
+        if isinstance(rate_limit_args, dict):
+            priority = rate_limit_args.get("priority", priority)
+        for attempt in range(RETRY_AFTER_ATTEMPTS):
+            await self._acquire(str(chat_id), priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_hits += 1
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if attempt == RETRY_AFTER_ATTEMPTS - 1:
+                    raise
+
+    async def _acquire(self, chat_id: str, priority: int):
+        if self._task is None:
+            # not running inside an Application (e.g. a bare Bot); nothing to wait for
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        enqueued = time.monotonic()
+        bisect.insort(self._waiting, (priority, self._seq, chat_id, fut))
+        self.max_depth = max(self.max_depth, len(self._waiting))
+        self._wakeup.set()
+        await fut
+        waited = time.monotonic() - enqueued
+        self.sent += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _chat_bucket(self, chat_id: str, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # forget chats that have been idle long enough to refill
+                self._chats = {k: b for k, b in self._chats.items() if not b.full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            delay = None
+            if self._waiting:
+                now = time.monotonic()
+                delay = max(self._paused_until - now, self._global.delay(now))
+                if delay <= 0:
+                    delay = None
+                    for i, (_, _, chat_id, fut) in enumerate(self._waiting):
+                        if fut.done():
+                            # caller gave up (cancelled)
+                            del self._waiting[i]
+                            delay = 0
+                            break
+                        bucket = self._chat_bucket(chat_id, now)
+                        wait = bucket.delay(now)
+                        if wait <= 0:
+                            del self._waiting[i]
+                            bucket.take(now)
+                            self._global.take(now)
+                            fut.set_result(None)
+                            delay = 0
+                            break
+                        delay = wait if delay is None else min(delay, wait)
+                if delay == 0:
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and failures per Bot API method."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        labels = (("method", url.rsplit("/", 1)[-1]),)
+        start = time.perf_counter()
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=mid)
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
         except Exception:
-            pass
-    user_data["user_messages"] = []
-    # then delete bot messages recorded earlier
-    bot_msg_ids = user_data.get("bot_messages", [])
-    for mid in bot_msg_ids:
+            metric_inc("bot_api_errors_total", labels)
+            raise
+        finally:
+            metric_observe("bot_api_seconds", labels, time.perf_counter() - start)
+        if code >= 400:
+            metric_inc("bot_api_errors_total", labels)
+        return code, payload
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently, but one at a time per user (or chat).
+
+    Different users proceed in parallel up to MAX_CONCURRENT_UPDATES; updates
+    from the same user wait for the previous one, so context.user_data is never
+    touched by two handlers at once. A slot is only taken once the user's turn
+    has come, so a user with a backlog of updates cannot hold the slots other
+    users need. A callback with the same data as the
+    user's last one, arriving within DEBOUNCE_SECONDS while that user still has
+    an update in progress, is answered and dropped: a double tap would only
+    redraw the same screen.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        # our own slots: the base class's semaphore is private to PTB
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_update(self, update, coroutine):
+        # the base class takes its semaphore here, before do_process_update;
+        # _process_in_order takes a slot after the per-user lock instead
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        metric_inc("bot_updates_in_flight")
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=mid)
+            await self._process_in_order(update, coroutine)
+        finally:
+            metric_inc("bot_updates_in_flight", value=-1)
+
+    async def _process_in_order(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                key = ("user", update.effective_user.id)
+            elif update.effective_chat is not None:
+                key = ("chat", update.effective_chat.id)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        entry = self._locks.get(key)
+        query = update.callback_query
+        if query is not None and DEBOUNCE_SECONDS > 0:
+            now = time.monotonic()
+            if entry is not None and entry[2] == query.data and now - entry[3] < DEBOUNCE_SECONDS:
+                coroutine.close()
+                metric_inc("bot_callbacks_debounced_total")
+                try:
+                    await query.answer()
+                except TelegramError:
+                    pass
+                return
+        if entry is None:
+            # [lock, updates queued or running, last callback data, when it arrived]
+            entry = self._locks[key] = [asyncio.Lock(), 0, None, 0.0]
+        if query is not None:
+            entry[2], entry[3] = query.data, time.monotonic()
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+class SqlitePersistence(BasePersistence):
+    """Keeps context.user_data in the user_state table of posts.db.
+
+    Nothing is read at startup: a user's row is loaded the first time one of
+    their updates arrives (refresh_user_data). The Application hands over
+    changed users every PERSISTENCE_FLUSH_SECONDS; they are buffered as dirty
+    and written together in a single transaction, and whatever is still dirty
+    is written on shutdown. Chat data, bot data and conversations are not
+    stored.
+    """
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_SECONDS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded = set()
+        self._dirty = {}
+        self._flush_task = None
+        self.flushes = 0
+        self.rows_written = 0
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        stored = await _db_load_user_state(user_id)
+        if stored:
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id, data):
+        self._loaded.add(user_id)
+        self._dirty[user_id] = json.dumps(data, separators=(",", ":"))
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._loaded.discard(user_id)
+        self._dirty[user_id] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # the Application updates every changed user in one burst; write them as one batch
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_dirty())
+
+    async def _flush_dirty(self):
+        await asyncio.sleep(0)
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await _db_save_user_states(batch)
+        except Exception as e:
+            log.warning("persistence: failed to save %d users, will retry: %s", len(batch), e)
+            for uid, data in batch.items():
+                self._dirty.setdefault(uid, data)
+            return
+        self.flushes += 1
+        self.rows_written += len(batch)
+
+    async def flush(self):
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_dirty()
+
+    # only user_data is persisted
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+
+# handler latency: name -> [count, total_seconds, max_seconds]
+HANDLER_TIMINGS = {}
+SLOW_HANDLER_MS = int(os.environ.get("SLOW_HANDLER_MS", "500"))
+
+
+def record_timing(name: str, elapsed: float):
+    stats = HANDLER_TIMINGS.setdefault(name, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] = max(stats[2], elapsed)
+
+
+def timed(fn):
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await fn(update, context)
         except Exception:
-            pass
+            metric_inc("bot_handler_errors_total", (("handler", fn.__name__),))
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            record_timing(fn.__name__, elapsed)
+            metric_observe("bot_handler_seconds", (("handler", fn.__name__),), elapsed)
+            if elapsed * 1000 >= SLOW_HANDLER_MS:
+                log.warning("slow handler %s: %.1f ms", fn.__name__, elapsed * 1000)
+    return wrapper
+
+
+async def delete_messages(bot, chat_id: int, message_ids):
+    # bulk deleteMessages in chunks of 100; fall back to bounded parallel single deletes
+    start = time.perf_counter()
+    leftover = []
+    for i in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+        chunk = message_ids[i:i + DELETE_MESSAGES_LIMIT]
+        try:
+            await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+        except Exception:
+            leftover.extend(chunk)
+    if leftover:
+        sem = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+
+        async def delete_one(mid):
+            async with sem:
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=mid)
+                except Exception:
+                    pass
+        await asyncio.gather(*(delete_one(mid) for mid in leftover))
+    record_timing("clear_user_messages", time.perf_counter() - start)
+
+
+async def clear_user_messages(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_data: dict, background: bool = None):
+    # delete previously recorded USER and BOT messages for a user/chat (user messages first)
+    message_ids = user_data.get("user_messages", []) + user_data.get("bot_messages", [])
+    user_data["user_messages"] = []
     user_data["bot_messages"] = []
+    if not message_ids:
+        return
+    if background is None:
+        background = CLEANUP_IN_BACKGROUND
+    if background:
+        # ids are already detached from user_data, so the next screen can be recorded right away
+        context.application.create_task(delete_messages(context.bot, chat_id, message_ids))
+        return
+    await delete_messages(context.bot, chat_id, message_ids)
 
 
 def record_bot_message(user_data: dict, message):
@@ -344,6 +1685,79 @@ def record_bot_message(user_data: dict, message):
         pass
 
 
+def _screen_digest(text: str, reply_markup) -> str:
+    raw = text + "\0" + (reply_markup.to_json() if reply_markup is not None else "")
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+async def show_screen(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup=None, new: bool = False, photo: str = None):
+    """Show a navigation screen to the user.
+
+    In edit mode the chat's current screen message (user_data["screen"]) is
+    edited in place, and nothing is sent when text and markup are unchanged. A
+    new message is sent only when there is no screen yet, new=True, or the edit
+    fails; the replaced screen is then recorded for cleanup like any other bot
+    message. In send mode every call sends and records a new message.
+
+    With photo (a Telegram file_id) the screen is a photo with text as its
+    caption. A photo screen is edited with editMessageMedia; switching between
+    a text and a photo screen always sends a new message.
+    """
+    user_data = context.user_data
+    screen = user_data.get("screen")
+    if photo is not None:
+        text = text[:CAPTION_LIMIT]
+    digest = _screen_digest(text if photo is None else f"{photo}\0{text}", reply_markup)
+    if NAV_MODE == "edit" and screen and not new and screen.get("photo", False) == (photo is not None):
+        if screen["digest"] == digest:
+            return
+        try:
+            if photo is None:
+                await context.bot.edit_message_text(chat_id=chat_id, message_id=screen["message_id"], text=text, reply_markup=reply_markup)
+            else:
+                await context.bot.edit_message_media(
+                    chat_id=chat_id, message_id=screen["message_id"], media=InputMediaPhoto(photo, caption=text), reply_markup=reply_markup
+                )
+            screen["digest"] = digest
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                screen["digest"] = digest
+                return
+        except Exception:
+            pass
+    if photo is None:
+        msg = await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    else:
+        msg = await context.bot.send_photo(chat_id=chat_id, photo=photo, caption=text, reply_markup=reply_markup)
+    if NAV_MODE != "edit":
+        record_bot_message(user_data, msg)
+        return
+    if screen:
+        user_data.setdefault("bot_messages", []).append(screen["message_id"])
+    user_data["screen"] = {"message_id": msg.message_id, "digest": digest}
+    if photo is not None:
+        user_data["screen"]["photo"] = True
+
+
+def adopt_screen(user_data: dict, message):
+    """Make the message a button was tapped on the screen, if it is not already.
+
+    Buttons can sit on messages other than the current screen (a new-post
+    notification, an older screen further up); the answer then replaces the
+    tapped message instead of editing a screen the user may not see. The
+    previous screen is recorded for cleanup.
+    """
+    screen = user_data.get("screen")
+    if screen and screen["message_id"] == message.message_id:
+        return
+    if screen:
+        user_data.setdefault("bot_messages", []).append(screen["message_id"])
+    user_data["screen"] = {"message_id": message.message_id, "digest": None}
+    if message.photo:
+        user_data["screen"]["photo"] = True
+
+
 def record_user_message(user_data: dict, message):
     user_data.setdefault("user_messages", [])
     try:
@@ -359,17 +1773,147 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # show language selection (clear previous user messages)
     chat_id = update.effective_chat.id
     await clear_user_messages(context, chat_id, context.user_data)
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("English", callback_data="lang:en"), InlineKeyboardButton("Русский", callback_data="lang:ru")]
-    ])
-    msg = await context.bot.send_message(chat_id=chat_id, text=T["en"]["choose_lang"], reply_markup=keyboard)
-    # record this bot message so it can be cleared when the user selects a language
-    record_bot_message(context.user_data, msg)
+    keyboard = static_keyboard("language")
+    # always a fresh screen: /start is typed, so the old one has scrolled away
+    await show_screen(context, chat_id, texts("en")["choose_lang"], keyboard, new=True)
     return
 
 
+async def search_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /search <words>
+    lang = context.user_data.get("lang", "en")
+    chat_id = update.effective_chat.id
+    await clear_user_messages(context, chat_id, context.user_data)
+    record_user_message(context.user_data, update.message)
+    terms = " ".join(context.args).strip()
+    if not terms:
+        context.user_data["searching"] = True
+        await show_screen(context, chat_id, texts(lang)["search_prompt"], static_keyboard("search_prompt", lang), new=True)
+        return
+    context.user_data.pop("searching", None)
+    context.user_data["search_query"] = terms[:200]
+    # typed command, so the results start a fresh screen
+    await show_search_results(context, chat_id, lang, terms[:200], new=True)
+
+
+# (query, lang, offset, posts version) -> (expires_at monotonic, results, next_offset)
+_inline_cache = OrderedDict()
+inline_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _inline_category(terms: str):
+    # "nails", "Nails", "маникюр" -> "nails" (any locale's label, or the key itself)
+    needle = terms.casefold()
+    for labels in CATEGORY_LABELS.values():
+        for c, label in labels.items():
+            if needle in (c, label.casefold()):
+                return c
+    return None
+
+
+def _inline_result(row, lang: str):
+    # row in get_post shape
+    pid, category, text, creator_id, created_at, expires_at, creator_username, preview, _ = row
+    contact = f"@{creator_username}" if creator_username else "(no username)"
+    label = category_label(lang, category)
+    return InlineQueryResultArticle(
+        id=str(pid),
+        title=f"{CAT_EMOJIS.get(category, '')} {preview}",
+        description=label,
+        input_message_content=InputTextMessageContent(f"{label}\n\n{text}\n\nContact: {contact}"),
+    )
+
+
+async def _inline_rows(terms: str, offset: str):
+    """One page of rows in get_post shape, and the offset of the next page ("" at the end).
+
+    Browsing (no terms, or a category name) pages by keyset, so the offset is
+    the cursor after the last row shown; a search offset counts results.
+    """
+    category = _inline_category(terms) if terms else None
+    if not terms or category is not None:
+        _, cursor = decode_cursor(offset)
+        rows, _, next_cursor = await get_posts_page(category, cursor, "n", INLINE_PAGE_SIZE)
+        if category is not None:
+            # category rows lack the text and username the result needs
+            rows = await get_posts_by_id([r[0] for r in rows])
+        return rows, next_cursor or ""
+    start = int(offset) if offset.isdigit() else 0
+    found = await search_posts(terms, start // INLINE_PAGE_SIZE, INLINE_PAGE_SIZE)
+    rows = await get_posts_by_id([r[0] for r in found[:INLINE_PAGE_SIZE]])
+    return rows, str(start + INLINE_PAGE_SIZE) if len(found) > INLINE_PAGE_SIZE else ""
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # @bot <category or words>: matching active posts, INLINE_PAGE_SIZE at a time
+    inline_query = update.inline_query
+    terms = " ".join(inline_query.query.split())[:100]
+    lang = context.user_data.get("lang")
+    if lang not in LOCALES:
+        code = inline_query.from_user.language_code or ""
+        lang = "ru" if code.startswith("ru") else "en"
+    offset = inline_query.offset or ""
+    key = (terms.casefold(), lang, offset, post_cache.version)
+    now = time.monotonic()
+    cached = _inline_cache.get(key)
+    if cached is not None and cached[0] > now:
+        inline_cache_stats["hits"] += 1
+        _, results, next_offset = cached
+    else:
+        inline_cache_stats["misses"] += 1
+        rows, next_offset = await _inline_rows(terms, offset)
+        results = [_inline_result(r, lang) for r in rows]
+        _inline_cache[key] = (now + INLINE_CACHE_TTL, results, next_offset)
+        if len(_inline_cache) > INLINE_CACHE_SIZE:
+            _inline_cache.popitem(last=False)
+    # results depend on the user's language, so Telegram caches them per user
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
+
+
+def is_admin(user) -> bool:
+    admin_id = os.environ.get("ADMIN_ID")
+    if admin_id and str(user.id) == str(admin_id):
+        return True
+    return bool(user.username and user.username.lower() == "kittiking")
+
+
+async def get_users_page(after: int = None, direction: str = "n"):
+    """Return (rows, prev_cursor, next_cursor) for one /listusers page.
+
+    Cursors are "n:<user_id>" / "p:<user_id>" for callback data, or None when
+    there is nothing further in that direction.
+    """
+    if direction == "p" and after is None:
+        direction = "n"
+    rows = await list_users(after, direction)
+    more = len(rows) > USERS_PAGE_SIZE
+    rows = rows[:USERS_PAGE_SIZE]
+    if direction == "p":
+        if not rows:
+            return await get_users_page()
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+    prev_cursor = f"p:{rows[0][0]}" if rows and has_prev else None
+    next_cursor = f"n:{rows[-1][0]}" if rows and has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+async def show_users_page(context, chat_id: int, after: int = None, direction: str = "n", new: bool = False):
+    rows, prev_cursor, next_cursor = await get_users_page(after, direction)
+    if not rows:
+        await show_screen(context, chat_id, "No users found.", new=new)
+        return
+    lines = [f"Users {rows[0][0]}..{rows[-1][0]}:"]
+    for uid, bal in rows:
+        lines.append(f"{uid}: {bal}₽")
+    nav = page_nav_row("users", prev_cursor, next_cursor, context.user_data.get("lang", "en"))
+    await show_screen(context, chat_id, "\n".join(lines), InlineKeyboardMarkup([nav]) if nav else None, new=new)
+
+
 async def listusers_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # list users and balances
+    # list users and balances, USERS_PAGE_SIZE per page -- restricted to admin
     chat_id = update.effective_chat.id
     await clear_user_messages(context, chat_id, context.user_data)
     # record the user's /listusers command
@@ -377,32 +1921,53 @@ async def listusers_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         record_user_message(context.user_data, update.message)
     except Exception:
         pass
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, balance FROM users ORDER BY user_id")
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        msg = await context.bot.send_message(chat_id=chat_id, text="No users found.")
+    if not is_admin(update.effective_user):
+        msg = await context.bot.send_message(chat_id=chat_id, text="Not authorized.")
         record_bot_message(context.user_data, msg)
         return
-    lines = [f"Users ({len(rows)}):"]
-    for uid, bal in rows:
-        lines.append(f"{uid}: {bal}₽")
-    msg = await context.bot.send_message(chat_id=chat_id, text="\n".join(lines))
+    await show_users_page(context, chat_id, new=True)
+
+
+async def exportusers_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /exportusers -- all users as CSV, restricted to admin. Rows are read in
+    # keyset chunks and spooled to a temp file, so memory does not grow with
+    # the user count; very large exports are split into several documents.
+    chat_id = update.effective_chat.id
+    record_user_message(context.user_data, update.message)
+    if not is_admin(update.effective_user):
+        msg = await update.message.reply_text("Not authorized.")
+        record_bot_message(context.user_data, msg)
+        return
+    part, total, after = 0, 0, None
+    done = False
+    while not done:
+        part += 1
+        with tempfile.TemporaryFile() as fh:
+            fh.write(b"user_id,balance\r\n")
+            rows_in_part = 0
+            while fh.tell() < EXPORT_PART_BYTES:
+                rows = await list_users(after, "n", EXPORT_CHUNK_ROWS)
+                more = len(rows) > EXPORT_CHUNK_ROWS
+                rows = rows[:EXPORT_CHUNK_ROWS]
+                buf = io.StringIO()
+                csv.writer(buf).writerows(rows)
+                fh.write(buf.getvalue().encode())
+                rows_in_part += len(rows)
+                if not more:
+                    done = True
+                    break
+                after = rows[-1][0]
+            total += rows_in_part
+            if rows_in_part or part == 1:
+                fh.seek(0)
+                await context.bot.send_document(chat_id=chat_id, document=fh, filename=f"users-{part}.csv")
+    msg = await update.message.reply_text(f"Exported {total} users.")
     record_bot_message(context.user_data, msg)
 
 
 async def topup_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # /topup <userid> <amount> -- restricted to admin
-    user = update.effective_user
-    allowed = False
-    admin_id = os.environ.get("ADMIN_ID")
-    if admin_id and str(user.id) == str(admin_id):
-        allowed = True
-    if user.username and user.username.lower() == "kittiking":
-        allowed = True
-    if not allowed:
+    if not is_admin(update.effective_user):
         msg = await update.message.reply_text("Not authorized.")
         record_user_message(context.user_data, update.message)
         record_bot_message(context.user_data, msg)
@@ -421,229 +1986,380 @@ async def topup_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
         record_user_message(context.user_data, update.message)
         record_bot_message(context.user_data, msg)
         return
-    ensure_user(uid)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amt, uid))
-    conn.commit()
-    conn.close()
-    msg = await update.message.reply_text(f"Topped up {amt}₽ to user {uid}.")
+    balance = await topup_user(uid, amt, f"topup:{update.effective_chat.id}:{update.message.message_id}")
+    if balance is None:
+        msg = await update.message.reply_text(f"User {uid} balance cannot go below zero.")
+    else:
+        msg = await update.message.reply_text(f"Topped up {amt}₽ to user {uid}.")
     record_user_message(context.user_data, update.message)
     record_bot_message(context.user_data, msg)
 
 
-async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    data = query.data
-    user_id = query.from_user.id
-    lang = context.user_data.get("lang", "en")
-    chat_id = query.message.chat_id
-    # clear previous USER messages for cleaner UI
-    await clear_user_messages(context, chat_id, context.user_data)
+# Callback routing: callback data is "<prefix>:<arg>:<arg>...". Each prefix maps
+# to one route; lookup is a dict hit, so adding screens costs the hot routes nothing.
+CALLBACK_ROUTES = {}
+# hooks run around every route: before(route, query), after(route, query, elapsed_seconds, error)
+ROUTE_HOOKS = {"before": [], "after": []}
 
-    if data == "back":
-        msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["choose_category"], reply_markup=build_categories_markup(lang))
-        record_bot_message(context.user_data, msg)
-        return
 
-    if data == "switchlang":
-        # toggle
-        new = "ru" if lang == "en" else "en"
-        context.user_data["lang"] = new
-        posts = get_all_posts()
-        if posts:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(new, T["en"])["all_posts"], reply_markup=list_all_posts_markup(posts, new))
-        else:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(new, T["en"])["all_posts"], reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(T.get(new, T["en"])["categories"], callback_data="categories")]]))
-        record_bot_message(context.user_data, msg)
-        return
+# categories travel in callback data as their index in CATEGORIES
+_CATEGORY_CODES = {c: str(i) for i, c in enumerate(CATEGORIES)}
 
-    if data.startswith("lang:"):
-        new = data.split(":", 1)[1]
-        if new not in LOCALES:
-            new = "en"
-        context.user_data["lang"] = new
-        posts = get_all_posts()
-        if posts:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(new, T["en"])["all_posts"], reply_markup=list_all_posts_markup(posts, new))
-        else:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(new, T["en"])["all_posts"], reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(T.get(new, T["en"])["categories"], callback_data="categories")]]))
-        record_bot_message(context.user_data, msg)
-        return
 
-    if data.startswith("cat:"):
-        category = data.split(":", 1)[1]
-        posts = get_posts(category)
-        cat_label = CAT_TRANSLATIONS.get(lang, CAT_TRANSLATIONS["en"]).get(category, category.title())
-        if posts:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["posts_in"].format(cat=cat_label), reply_markup=list_posts_markup(category, posts, lang))
-            record_bot_message(context.user_data, msg)
+def cat_code(category: str) -> str:
+    return _CATEGORY_CODES.get(category, category)
+
+
+def arg_category(raw: str) -> str:
+    # accepts the compact index and, for buttons sent before it existed, the full name
+    if raw.isdigit() and int(raw) < len(CATEGORIES):
+        return CATEGORIES[int(raw)]
+    if raw in CATEGORIES:
+        return raw
+    raise ValueError(f"unknown category {raw!r}")
+
+
+def arg_cursor(raw: str):
+    return decode_cursor(raw)
+
+
+def callback_route(prefix: str, *arg_types, clear: bool = True, answer: bool = True):
+    """Register a callback route.
+
+    arg_types parse the ":"-separated arguments after the prefix (the last one
+    receives the remainder, so cursors may contain ":"). Missing trailing
+    arguments are left to the handler's defaults. clear=False skips the
+    clear_user_messages call and answer=False skips query.answer() for routes
+    that do these themselves.
+    """
+    def decorator(fn):
+        CALLBACK_ROUTES[prefix] = (fn, arg_types, clear, answer)
+        return fn
+    return decorator
+
+
+def _record_route_latency(route: str, query, elapsed: float, error):
+    metric_observe("bot_callback_route_seconds", (("route", route),), elapsed)
+    if error is not None:
+        metric_inc("bot_callback_route_errors_total", (("route", route),))
+
+
+ROUTE_HOOKS["after"].append(_record_route_latency)
+
+
+async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    prefix, _, raw_args = (query.data or "").partition(":")
+    route = CALLBACK_ROUTES.get(prefix)
+    if route is None:
+        await query.answer()
+        return
+    fn, arg_types, clear, answer = route
+    try:
+        raw = raw_args.split(":", len(arg_types) - 1) if arg_types and raw_args else []
+        args = [parse(value) for parse, value in zip(arg_types, raw)]
+    except (ValueError, IndexError):
+        log.warning("callback: bad data %r", query.data)
+        await query.answer()
+        return
+    if answer:
+        await query.answer()
+    # messages older than 48 hours come back inaccessible and cannot be edited
+    if NAV_MODE == "edit" and query.message is not None and query.message.is_accessible:
+        adopt_screen(context.user_data, query.message)
+    for hook in ROUTE_HOOKS["before"]:
+        hook(prefix, query)
+    start = time.perf_counter()
+    error = None
+    try:
+        if clear:
+            # clear previous USER messages for cleaner UI
+            await clear_user_messages(context, query.message.chat_id, context.user_data)
+        await fn(query, context, *args)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        for hook in ROUTE_HOOKS["after"]:
+            hook(prefix, query, elapsed, error)
+
+
+def _lang(context) -> str:
+    return context.user_data.get("lang", "en")
+
+
+async def _show_all_posts(query, context, lang: str, cursor=("n", None)):
+    has_posts, markup = await render_listing(None, cursor, lang)
+    if not has_posts:
+        markup = static_keyboard("empty_listing", lang)
+    await show_screen(context, query.message.chat_id, texts(lang)["all_posts"], markup)
+
+
+@callback_route("back")
+@callback_route("categories")
+async def cb_categories(query, context):
+    lang = _lang(context)
+    await show_screen(context, query.message.chat_id, texts(lang)["choose_category"], await build_categories_markup(lang))
+
+
+@callback_route("switchlang")
+async def cb_switchlang(query, context):
+    # toggle
+    new = "ru" if _lang(context) == "en" else "en"
+    context.user_data["lang"] = new
+    await _show_all_posts(query, context, new)
+
+
+@callback_route("lang", str)
+async def cb_lang(query, context, new: str = "en"):
+    if new not in LOCALES:
+        new = "en"
+    context.user_data["lang"] = new
+    await _show_all_posts(query, context, new)
+
+
+@callback_route("allposts", arg_cursor)
+async def cb_allposts(query, context, cursor=("n", None)):
+    # show all posts, one page at a time (allposts:<cursor> for later pages)
+    await _show_all_posts(query, context, _lang(context), cursor)
+
+
+@callback_route("cat", arg_category, arg_cursor)
+async def cb_category(query, context, category: str, cursor=("n", None)):
+    lang = _lang(context)
+    has_posts, markup = await render_listing(category, cursor, lang)
+    cat_label = category_label(lang, category)
+    if has_posts:
+        await show_screen(context, query.message.chat_id, texts(lang)["posts_in"].format(cat=cat_label), markup)
+    else:
+        await show_screen(context, query.message.chat_id, texts(lang)["no_posts"].format(cat=cat_label), static_keyboard("no_posts", lang, category))
+
+
+@callback_route("album", arg_category, arg_cursor)
+async def cb_album(query, context, category: str, cursor=("n", None)):
+    # the photos of one listing page as albums, sent by file_id
+    lang = _lang(context)
+    chat_id = query.message.chat_id
+    direction, key = cursor
+    posts, _, _ = await get_posts_page(category, key, direction)
+    file_ids = dict(await get_post_photos(tuple(p[0] for p in posts)))
+    items = [(file_ids[p[0]], p[5]) for p in posts if p[0] in file_ids]
+    for i in range(0, len(items), MEDIA_GROUP_LIMIT):
+        chunk = items[i:i + MEDIA_GROUP_LIMIT]
+        if len(chunk) == 1:
+            # a media group needs at least two items
+            messages = [await context.bot.send_photo(chat_id=chat_id, photo=chunk[0][0], caption=chunk[0][1])]
         else:
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(T.get(lang, T["en"])["create_post"], callback_data=f"create:{category}")],
-                [InlineKeyboardButton(T.get(lang, T["en"])["back"], callback_data="back")],
-            ])
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["no_posts"].format(cat=cat_label), reply_markup=keyboard)
+            messages = await context.bot.send_media_group(chat_id=chat_id, media=[InputMediaPhoto(f, caption=c) for f, c in chunk])
+        for msg in messages:
             record_bot_message(context.user_data, msg)
+    # the listing again below the album, so its buttons stay at the bottom
+    has_posts, markup = await render_listing(category, cursor, lang)
+    cat_label = category_label(lang, category)
+    if has_posts:
+        await show_screen(context, chat_id, texts(lang)["posts_in"].format(cat=cat_label), markup, new=True)
+    else:
+        await show_screen(context, chat_id, texts(lang)["no_posts"].format(cat=cat_label), static_keyboard("no_posts", lang, category), new=True)
+
+
+def arg_user_cursor(raw: str):
+    # "n:<user_id>" -> ("n", user_id); anything invalid is the first page
+    direction, _, uid = raw.partition(":")
+    if direction in ("n", "p") and uid.lstrip("-").isdigit():
+        return direction, int(uid)
+    return "n", None
+
+
+@callback_route("users", arg_user_cursor)
+async def cb_users(query, context, cursor=("n", None)):
+    if not is_admin(query.from_user):
         return
+    direction, after = cursor
+    await show_users_page(context, query.message.chat_id, after, direction)
 
-    if data == "categories":
-        # show categories list
-        msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["choose_category"], reply_markup=build_categories_markup(lang))
-        record_bot_message(context.user_data, msg)
-        return
 
-    if data == "allposts":
-        # show all posts
-        posts = get_all_posts()
-        if posts:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["all_posts"], reply_markup=list_all_posts_markup(posts, lang))
-        else:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["all_posts"], reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(T.get(lang, T["en"])["categories"], callback_data="categories")]]))
-        record_bot_message(context.user_data, msg)
-        return
+@callback_route("topup")
+async def cb_topup(query, context):
+    # send admin contact for top-up
+    admin_contact = os.environ.get("ADMIN_CONTACT", "@kittiking")
+    try:
+        await query.message.delete()
+    except Exception:
+        pass
+    await context.bot.send_message(chat_id=query.message.chat_id, text=f"To top up your wallet contact: {admin_contact}")
 
-    if data == "topup":
-        # send admin contact for top-up
-        admin_contact = os.environ.get("ADMIN_CONTACT", "@kittiking")
-        try:
-            await query.message.delete()
-        except Exception:
-            pass
-        await context.bot.send_message(chat_id=query.message.chat_id, text=f"To top up your wallet contact: {admin_contact}")
-        return
 
-    if data.startswith("view:"):
-        pid = int(data.split(":", 1)[1])
-        row = get_post(pid)
-        if not row:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["post_not_found"])
-            record_bot_message(context.user_data, msg)
-            return
-        _, category, text, creator_id, created_at, expires_at, creator_username = row
-        now = int(datetime.now(timezone.utc).timestamp())
-        created_delta = now - created_at
-        expires_delta = expires_at - now
-        created_label = format_duration(created_delta, lang)
-        expires_label = format_duration(expires_delta, lang)
-        created = T.get(lang, T["en"])["created_ago"].format(time_ago=created_label)
-        expires = T.get(lang, T["en"])["expires_in"].format(time_left=expires_label)
-        # include category in the view
-        cat_label = CAT_TRANSLATIONS.get(lang, CAT_TRANSLATIONS["en"]).get(category, category.title())
-        cat_line = f"Category: {cat_label}"
-        kb = []
-        if user_id == creator_id:
-            kb.append([InlineKeyboardButton("Delete Post", callback_data=f"delete:{pid}")])
-        # add contact info if username present
-        contact_line = None
-        if creator_username:
-            contact_line = f"Contact: https://t.me/{creator_username} (@{creator_username})"
-        else:
-            contact_line = "Contact: (no username)"
-        kb.append([InlineKeyboardButton(T.get(lang, T["en"])["back"], callback_data=f"cat:{category}")])
-        msg = await context.bot.send_message(chat_id=chat_id, text=f"{cat_line}\n\n{text}\n\n{created}\n{expires}\n{contact_line}", reply_markup=InlineKeyboardMarkup(kb))
-        record_bot_message(context.user_data, msg)
+@callback_route("view", int)
+async def cb_view(query, context, pid: int):
+    lang = _lang(context)
+    chat_id = query.message.chat_id
+    row = await get_post(pid)
+    if not row:
+        await show_screen(context, chat_id, texts(lang)["post_not_found"])
         return
-
-    if data.startswith("delete:"):
-        pid = int(data.split(":", 1)[1])
-        row = get_post(pid)
-        if not row:
-            msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["post_not_found"])
-            record_bot_message(context.user_data, msg)
-            return
-        _, category, text, creator_id, *_ = row
-        if user_id != creator_id:
-            await query.answer(T.get(lang, T["en"])["only_creator"], show_alert=True)
-            return
-        delete_post_db(pid)
-        msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["post_deleted"])
-        record_bot_message(context.user_data, msg)
+    _, category, text, creator_id, created_at, expires_at, creator_username, _, photo = row
+    now = int(datetime.now(timezone.utc).timestamp())
+    created_delta = now - created_at
+    expires_delta = expires_at - now
+    created_label = format_duration(created_delta, lang)
+    expires_label = format_duration(expires_delta, lang)
+    created = texts(lang)["created_ago"].format(time_ago=created_label)
+    expires = texts(lang)["expires_in"].format(time_left=expires_label)
+    # include category in the view
+    cat_label = category_label(lang, category)
+    cat_line = f"Category: {cat_label}"
+    kb = []
+    if query.from_user.id == creator_id:
+        kb.append([InlineKeyboardButton("Delete Post", callback_data=f"delete:{pid}")])
+    # add contact info if username present
+    contact_line = None
+    if creator_username:
+        contact_line = f"Contact: https://t.me/{creator_username} (@{creator_username})"
+    else:
+        contact_line = "Contact: (no username)"
+    kb.append([InlineKeyboardButton(texts(lang)["back"], callback_data=f"cat:{cat_code(category)}")])
+    # photo posts are shown by file_id; Telegram serves the image, nothing is uploaded
+    await show_screen(context, chat_id, f"{cat_line}\n\n{text}\n\n{created}\n{expires}\n{contact_line}", InlineKeyboardMarkup(kb), photo=photo)
+
+
+@callback_route("delete", int, clear=False, answer=False)
+async def cb_delete(query, context, pid: int):
+    lang = _lang(context)
+    chat_id = query.message.chat_id
+    row = await get_post(pid)
+    if row and query.from_user.id != row[3]:
+        # nothing changes on screen, so keep the current messages
+        await query.answer(texts(lang)["only_creator"], show_alert=True)
         return
-
-    if data.startswith("create:"):
-        category = data.split(":", 1)[1]
-        # present price/duration options (previous messages already cleared)
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("⏱️ 2h — 20₽", callback_data=f"create2:{category}"), InlineKeyboardButton("⏱️ 24h — 50₽", callback_data=f"create24:{category}")],
-            [InlineKeyboardButton(T.get(lang, T["en"])["back"], callback_data=f"cat:{category}")],
-        ])
-        msg = await context.bot.send_message(chat_id=chat_id, text=f"{T.get(lang, T['en'])['create_post']} — choose duration and price:", reply_markup=keyboard)
-        record_bot_message(context.user_data, msg)
+    await query.answer()
+    await clear_user_messages(context, chat_id, context.user_data)
+    if not row:
+        await show_screen(context, chat_id, texts(lang)["post_not_found"])
         return
+    await delete_post_db(pid)
+    await show_screen(context, chat_id, texts(lang)["post_deleted"])
 
-    if data.startswith("create2:") or data.startswith("create24:"):
-        # user chose duration and price, now ask for post text
-        parts = data.split(":", 1)
-        kind = parts[0]
-        category = parts[1]
-        if kind == "create2":
-            duration = 2 * 3600
-            price = 20
-        else:
-            duration = 24 * 3600
-            price = 50
-        # previous messages already cleared
-        # store pending creation details in user_data
-        context.user_data["creating_cat"] = category
-        context.user_data["creating_price"] = price
-        context.user_data["creating_duration"] = duration
-        cat_label = CAT_TRANSLATIONS.get(lang, CAT_TRANSLATIONS["en"]).get(category, category.title())
-        msg = await context.bot.send_message(chat_id=chat_id, text=T.get(lang, T["en"])["send_post_text"].format(cat=cat_label))
-        record_bot_message(context.user_data, msg)
-        return
 
-    if data == "profile":
-        # show profile for user
-        uid = user_id
-        now = int(datetime.now(timezone.utc).timestamp())
-        ensure_user(uid)
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT category, COUNT(*) FROM posts WHERE creator_id = ? AND expires_at > ? GROUP BY category",
-            (uid, now),
-        )
-        counts = cur.fetchall()
-        cur.execute(
-            "SELECT category, expires_at FROM posts WHERE creator_id = ? AND expires_at > ? ORDER BY expires_at ASC",
-            (uid, now),
-        )
-        posts = cur.fetchall()
-        conn.close()
-
-        bal = get_balance(uid)
-        lines = [T.get(lang, T["en"])["profile_title"]]
-        lines.append(f"User ID: {uid}")
-        lines.append(T.get(lang, T["en"])["wallet"].format(amount=bal))
-        if counts:
-            for cat, cnt in counts:
-                cat_label = CAT_TRANSLATIONS.get(lang, CAT_TRANSLATIONS["en"]).get(cat, cat.title())
-                lines.append(T.get(lang, T["en"])["posts_count_line"].format(cat=cat_label, count=cnt))
-        else:
-            lines.append(T.get(lang, T["en"])["no_posts_user"])
-
-        if posts:
-            for cat, expires_at in posts:
-                left = expires_at - now
-                mins = max(0, int(left // 60))
-                if mins >= 60:
-                    hrs = mins // 60
-                    mins = mins % 60
-                    tl = f"{hrs}h {mins}m" if mins else f"{hrs}h"
-                else:
-                    tl = f"{mins}m"
-                cat_label = CAT_TRANSLATIONS.get(lang, CAT_TRANSLATIONS["en"]).get(cat, cat.title())
-                lines.append(T.get(lang, T["en"])["post_line"].format(cat=cat_label, time_left=tl))
+@callback_route("create", arg_category)
+async def cb_create(query, context, category: str):
+    lang = _lang(context)
+    # present price/duration options (previous messages already cleared)
+    keyboard = static_keyboard("create_duration", lang, category)
+    await show_screen(context, query.message.chat_id, f"{texts(lang)['create_post']} — choose duration and price:", keyboard)
 
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("💳 Top UP", callback_data="topup")],
-            [InlineKeyboardButton(T.get(lang, T["en"])["back"], callback_data="back")],
-        ])
-        msg = await context.bot.send_message(chat_id=chat_id, text="\n".join(lines), reply_markup=keyboard)
-        record_bot_message(context.user_data, msg)
+
+async def _start_creation(query, context, category: str, duration: int, price: int):
+    # user chose duration and price, now ask for post text
+    lang = _lang(context)
+    # store pending creation details in user_data
+    context.user_data.pop("searching", None)
+    context.user_data["creating_cat"] = category
+    context.user_data["creating_price"] = price
+    context.user_data["creating_duration"] = duration
+    cat_label = category_label(lang, category)
+    await show_screen(context, query.message.chat_id, texts(lang)["send_post_text"].format(cat=cat_label))
+
+
+@callback_route("create2", arg_category)
+async def cb_create_2h(query, context, category: str):
+    await _start_creation(query, context, category, 2 * 3600, 20)
+
+
+@callback_route("create24", arg_category)
+async def cb_create_24h(query, context, category: str):
+    await _start_creation(query, context, category, 24 * 3600, 50)
+
+
+async def show_search_results(context, chat_id: int, lang: str, terms: str, page: int = 0, new: bool = False):
+    rows = await search_posts(terms, page)
+    keyboard = []
+    for pid, category, preview in rows[:POSTS_PAGE_SIZE]:
+        keyboard.append([InlineKeyboardButton(f"{CAT_EMOJIS.get(category, '')} {preview}", callback_data=f"view:{pid}")])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(texts(lang)["prev_page"], callback_data=f"search:{page - 1}"))
+    if len(rows) > POSTS_PAGE_SIZE:
+        nav.append(InlineKeyboardButton(texts(lang)["next_page"], callback_data=f"search:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton(texts(lang)["back"], callback_data="back")])
+    key = "search_results" if rows else "search_no_results"
+    await show_screen(context, chat_id, texts(lang)[key].format(q=terms), InlineKeyboardMarkup(keyboard), new=new)
+
+
+@callback_route("search", int)
+async def cb_search(query, context, page: int = None):
+    # search          -> ask for words (the next text message is the query)
+    # search:<page>   -> another page of the last query
+    lang = _lang(context)
+    terms = context.user_data.get("search_query")
+    if page is None or not terms:
+        context.user_data.pop("creating_cat", None)
+        context.user_data["searching"] = True
+        await show_screen(context, query.message.chat_id, texts(lang)["search_prompt"], static_keyboard("search_prompt", lang))
         return
+    await show_search_results(context, query.message.chat_id, lang, terms, max(0, page))
+
+
+@callback_route("profile")
+async def cb_profile(query, context):
+    # show profile for user
+    lang = _lang(context)
+    uid = query.from_user.id
+    now = int(datetime.now(timezone.utc).timestamp())
+    # wallet, counters and the post list in one trip to the db thread
+    bal, counts, posts = await get_profile(uid, now)
+    lines = [texts(lang)["profile_title"]]
+    lines.append(f"User ID: {uid}")
+    lines.append(texts(lang)["wallet"].format(amount=bal))
+    if counts:
+        for cat, cnt in counts:
+            cat_label = category_label(lang, cat)
+            lines.append(texts(lang)["posts_count_line"].format(cat=cat_label, count=cnt))
+    else:
+        lines.append(texts(lang)["no_posts_user"])
+
+    if posts:
+        for cat, expires_at in posts:
+            left = expires_at - now
+            mins = max(0, int(left // 60))
+            if mins >= 60:
+                hrs = mins // 60
+                mins = mins % 60
+                tl = f"{hrs}h {mins}m" if mins else f"{hrs}h"
+            else:
+                tl = f"{mins}m"
+            cat_label = category_label(lang, cat)
+            lines.append(texts(lang)["post_line"].format(cat=cat_label, time_left=tl))
+
+    await show_screen(context, query.message.chat_id, "\n".join(lines), static_keyboard("profile", lang))
+
+
+def subscriptions_markup(lang: str, subscribed):
+    keyboard = []
+    for c in CATEGORIES:
+        mark = "✅" if c in subscribed else "▫️"
+        keyboard.append([InlineKeyboardButton(f"{mark} {CAT_EMOJIS.get(c, '')} {category_label(lang, c)}", callback_data=f"sub:{cat_code(c)}")])
+    keyboard.append([InlineKeyboardButton(texts(lang)["back"], callback_data="profile")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@callback_route("subs")
+async def cb_subscriptions(query, context):
+    lang = _lang(context)
+    subscribed = await get_subscriptions(query.from_user.id)
+    await show_screen(context, query.message.chat_id, texts(lang)["subscriptions_title"], subscriptions_markup(lang, subscribed))
+
+
+@callback_route("sub", arg_category)
+async def cb_toggle_subscription(query, context, category: str):
+    lang = _lang(context)
+    uid = query.from_user.id
+    subscribed = await get_subscriptions(uid)
+    await set_subscription(uid, category, lang, category not in subscribed)
+    subscribed ^= {category}
+    await show_screen(context, query.message.chat_id, texts(lang)["subscriptions_title"], subscriptions_markup(lang, subscribed))
 
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -653,67 +2369,216 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         record_user_message(context.user_data, update.message)
     except Exception:
         pass
+    if update.message.text and context.user_data.pop("searching", None):
+        terms = update.message.text.strip()[:200]
+        context.user_data["search_query"] = terms
+        chat_id = update.effective_chat.id
+        await clear_user_messages(context, chat_id, context.user_data)
+        await show_search_results(context, chat_id, lang, terms)
+        return
     if "creating_cat" in context.user_data:
         category = context.user_data.pop("creating_cat")
-        text = update.message.text
+        text = update.message.text or update.message.caption or "📷"
+        # keep only the largest size's ids; the image itself is never downloaded
+        photo = None
+        if update.message.photo:
+            size = update.message.photo[-1]
+            photo = (size.file_id, size.file_unique_id)
         creator_id = update.message.from_user.id
         creator_username = update.message.from_user.username
         # determine duration and price (set earlier in create2/create24 flow)
         expires_seconds = context.user_data.pop("creating_duration", None) or 2 * 3600
         price = context.user_data.pop("creating_price", 0)
-        # charge user if needed
-        ensure_user(creator_id)
-        if price and not charge_user(creator_id, price):
+        # charge and create the post with the selected expiration in one step
+        # keyed by the message, so a redelivered update cannot charge twice
+        idem_key = f"post:{update.effective_chat.id}:{update.message.message_id}"
+        pid = await publish_paid_post(category, text, creator_id, creator_username, price, expires_seconds, idem_key, photo)
+        if pid is None:
             await update.message.reply_text("Insufficient balance. Please top up your wallet.")
             return
-        # create post with the selected expiration
-        pid = create_post(category, text, creator_id, creator_username, expires_seconds=expires_seconds)
-        # schedule deletion via application job queue
-        context.application.job_queue.run_once(_job_delete_wrapper, when=expires_seconds, data=pid)
 
         # clear previous user and bot messages for cleaner UI
         chat_id = update.effective_chat.id
         await clear_user_messages(context, chat_id, context.user_data)
 
-        created_msg = T.get(lang, T["en"])["post_created"].format(id=pid)
-        success_msg = T.get(lang, T["en"])["successfully_listed"]
-        msg = await context.bot.send_message(chat_id=chat_id, text=f"{created_msg}\n\n{success_msg}")
-        record_bot_message(context.user_data, msg)
-
-        # send Back button to return to category list
+        created_msg = texts(lang)["post_created"].format(id=pid)
+        success_msg = texts(lang)["successfully_listed"]
+        # Back button to return to category list
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(T.get(lang, T["en"])["back"], callback_data="back")]
+            [InlineKeyboardButton(texts(lang)["back"], callback_data="back")]
         ])
+        if NAV_MODE == "edit":
+            # the "send post text" prompt becomes the confirmation screen
+            await show_screen(context, chat_id, f"{created_msg}\n\n{success_msg}", keyboard)
+            return
+
+        msg = await context.bot.send_message(chat_id=chat_id, text=f"{created_msg}\n\n{success_msg}")
+        record_bot_message(context.user_data, msg)
         msg = await context.bot.send_message(chat_id=chat_id, text="✅", reply_markup=keyboard)
         record_bot_message(context.user_data, msg)
         return
 
-    await update.message.reply_text(T.get(lang, T["en"])["choose_category"])
+    await update.message.reply_text(texts(lang)["choose_category"])
+
+
+# stats() keys that only ever grow are exported as counters, the rest as gauges
+COUNTER_STATS = {"deleted", "hits", "misses", "sent", "retry_after", "runs", "removed", "failed", "unsubscribed", "pruned"}
+# help text where "<component> <key>." would be misleading
+STATS_HELP = {
+    ("expiry", "scheduled"): "Expiry deadlines held by the scheduler, future ones and entries of already deleted posts included.",
+    ("expiry", "due"): "Scheduled expiries whose time has passed and that are not archived yet.",
+}
+
+
+def _stats_samples(component: str, stats: dict):
+    samples = []
+    for key, value in stats.items():
+        help_text = STATS_HELP.get((component, key), f"{component} {key}.")
+        if key in COUNTER_STATS:
+            samples.append((f"bot_{component}_{key}_total", "counter", help_text, (), int(value)))
+        else:
+            samples.append((f"bot_{component}_{key}", "gauge", help_text, (), float(value)))
+    return samples
+
+
+def _component_metrics():
+    return (
+        _stats_samples("expiry", expiry_scheduler.stats())
+        + _stats_samples("post_cache", post_cache.stats())
+        + _stats_samples("listing_cache", listing_cache_stats)
+        + _stats_samples("inline_cache", inline_cache_stats)
+        + _stats_samples("ledger_compactor", ledger_compactor.stats())
+        + _stats_samples("fanout", notification_fanout.stats())
+        + _stats_samples("maintenance", db_maintenance.stats())
+    )
+
+
+async def _active_post_metrics():
+    counts = dict.fromkeys(CATEGORIES, 0)
+    # the same counters as the category buttons, so a scrape never scans posts
+    counts.update(await get_category_counts(int(datetime.now(timezone.utc).timestamp())))
+    return [("bot_active_posts", "gauge", "Unexpired posts per category.", (("category", c),), n) for c, n in counts.items()]
+
+
+METRIC_COLLECTORS.extend([_component_metrics, _active_post_metrics])
+_metrics_server = None
+_profiler = None
 
 
-async def _job_delete_wrapper(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    pid = job.data
-    delete_post_db(pid)
+async def _profile_and_report(bot, chat_id: int, seconds: int):
+    # profiles the event loop thread only; db work shows up as awaiting its future
+    global _profiler
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        _profiler.disable()
+        profiler, _profiler = _profiler, None
+    buf = io.StringIO()
+    pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+    await bot.send_document(chat_id=chat_id, document=buf.getvalue().encode(), filename=f"profile-{int(time.time())}.txt")
+
+
+async def cprofile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /cprofile [seconds] -- capture a cProfile of live traffic, restricted to admin
+    record_user_message(context.user_data, update.message)
+    if not is_admin(update.effective_user):
+        msg = await update.message.reply_text("Not authorized.")
+    elif _profiler is not None:
+        msg = await update.message.reply_text("A profile is already running.")
+    else:
+        try:
+            seconds = min(max(int(context.args[0]), 1), PROFILE_MAX_SECONDS) if context.args else 10
+        except ValueError:
+            seconds = 10
+        # runs in the background so this user's next updates are not held up
+        context.application.create_task(_profile_and_report(context.bot, update.effective_chat.id, seconds))
+        msg = await update.message.reply_text(f"Profiling for {seconds}s...")
+    record_bot_message(context.user_data, msg)
+
+
+async def _post_init(app):
+    global _metrics_server
+    compile_keyboards()
+    # cache rows are appended in creation order
+    post_cache.load(reversed(await _db_get_all_posts()))
+    await expiry_scheduler.start()
+    await ledger_compactor.start()
+    await db_maintenance.start()
+    # picks up notifications left in the outbox by the previous run
+    await notification_fanout.start(app.bot)
+    limiter = app.bot.rate_limiter
+    if isinstance(limiter, OutboundLimiter):
+        METRIC_COLLECTORS.append(lambda: _stats_samples("outbound", limiter.stats()))
+    if METRICS_PORT:
+        _metrics_server = await asyncio.start_server(_serve_metrics, METRICS_HOST, METRICS_PORT)
+        log.info("Metrics on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+
+async def _post_shutdown(app):
+    if _metrics_server is not None:
+        _metrics_server.close()
+    await expiry_scheduler.stop()
+    await ledger_compactor.stop()
+    await db_maintenance.stop()
+    await notification_fanout.stop()
+    # flush and close the shared connection on the db thread it belongs to
+    await db_task(storage.close)()
+    _db_executor.shutdown(wait=True)
+
+
+def build_application(token: str):
+    builder = ApplicationBuilder().token(token).post_init(_post_init).post_shutdown(_post_shutdown)
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    # same pool size as the builder's default request; getUpdates is left alone
+    builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+    builder = builder.concurrent_updates(PerUserUpdateProcessor())
+    if PERSISTENCE_ENABLED:
+        builder = builder.persistence(SqlitePersistence())
+    if RATE_LIMIT_ENABLED:
+        builder = builder.rate_limiter(OutboundLimiter())
+    app = builder.build()
+
+    app.add_handler(CommandHandler("start", timed(start_handler)))
+    app.add_handler(CommandHandler("search", timed(search_command_handler)))
+    app.add_handler(CommandHandler("listusers", timed(listusers_handler)))
+    app.add_handler(CommandHandler("exportusers", timed(exportusers_handler)))
+    app.add_handler(CommandHandler("topup", timed(topup_command_handler)))
+    app.add_handler(CommandHandler("cprofile", timed(cprofile_handler)))
+    app.add_handler(CallbackQueryHandler(timed(callback_handler)))
+    # inline mode must also be enabled for the bot in @BotFather (/setinline)
+    app.add_handler(InlineQueryHandler(timed(inline_query_handler)))
+    app.add_handler(MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.PHOTO, timed(message_handler)))
+    return app
 
 
 def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+    # httpx logs every Bot API request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
     token = ("7711538246:AAFqtCPa6Po_oCr3UcV94lgd76O2BN0ZNV4")
     if not token:
         print("Set the TELEGRAM_TOKEN environment variable and run this script.")
         return
 
     init_db()
+    app = build_application(token)
 
-    app = ApplicationBuilder().token(token).build()
-
-    asyncio.get_event_loop().run_until_complete(cleanup_expired())
-
-    app.add_handler(CommandHandler("start", start_handler))
-    app.add_handler(CommandHandler("listusers", listusers_handler))
-    app.add_handler(CommandHandler("topup", topup_command_handler))
-    app.add_handler(CallbackQueryHandler(callback_handler))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            print("Set WEBHOOK_URL to the public https URL that forwards to this server.")
+            return
+        print(f"Bot is starting (webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}). Press Ctrl-C to stop.")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+        )
+        return
 
     print("Bot is starting. Press Ctrl-C to stop.")
     app.run_polling()
@@ -0,0 +1,71 @@
+import os
+import sys
+import uuid
+import importlib.util
+
+import pytest
+
+# the bot and its storage live at the top of the repo
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import storage  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def bot():
+    """test.py, the bot script, imported as a module named "bot"."""
+    spec = importlib.util.spec_from_file_location("bot", os.path.join(ROOT, "test.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def bot_db(bot, tmp_path, monkeypatch):
+    """The bot module on a fresh posts.db."""
+    monkeypatch.setattr(storage, "DB_PATH", str(tmp_path / "posts.db"))
+    bot.init_db()
+    yield bot
+    storage.close_db()
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DB_PATH", str(tmp_path / "posts.db"))
+    engine = storage.SqliteStorage()
+    engine.migrate()
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def memory_storage():
+    engine = storage.MemoryStorage()
+    engine.migrate()
+    return engine
+
+
+@pytest.fixture
+def postgres_storage():
+    dsn = os.environ.get("POSTGRES_DSN")
+    if not dsn:
+        pytest.skip("set POSTGRES_DSN to run against PostgreSQL")
+    if storage.psycopg is None:
+        pytest.skip("psycopg is not installed")
+    engine = storage.PostgresStorage(dsn)
+    # a throwaway schema, so existing tables in that database are never touched
+    schema = f"tgpp_test_{uuid.uuid4().hex[:12]}"
+    conn = engine._db()
+    conn.execute(f"CREATE SCHEMA {schema}")
+    conn.execute(f"SET search_path TO {schema}")
+    engine.migrate()
+    yield engine
+    conn.execute(f"DROP SCHEMA {schema} CASCADE")
+    engine.close()
+
+
+@pytest.fixture(params=["sqlite", "memory", "postgres"])
+def engine(request):
+    """Each storage engine in turn; postgres only when POSTGRES_DSN is set."""
+    return request.getfixturevalue(f"{request.param}_storage")
@@ -0,0 +1,12 @@
+import time
+
+
+def test_expiry_stats_count_only_due_entries(bot):
+    scheduler = bot.ExpiryScheduler()
+    now = int(time.time())
+    for i, delta in enumerate([-30, 3600, -5, 7200, 0, 60, -1]):
+        scheduler.schedule(i, now + delta)
+    assert scheduler.due(now) == 4
+    stats = scheduler.stats()
+    assert stats["scheduled"] == 7 and stats["due"] >= 4 and stats["overdue_seconds"] >= 30
+    assert bot.ExpiryScheduler().stats()["due"] == 0
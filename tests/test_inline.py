@@ -0,0 +1,37 @@
+import asyncio
+
+
+def test_inline_pages_are_complete_and_disjoint(bot_db):
+    bot = bot_db
+
+    async def collect(terms):
+        seen, offset, pages = [], "", 0
+        while True:
+            rows, offset = await bot._inline_rows(terms, offset)
+            assert len(rows) <= bot.INLINE_PAGE_SIZE
+            assert all(len(r) == 9 for r in rows)
+            seen += [r[0] for r in rows]
+            pages += 1
+            if not offset:
+                return seen, pages
+
+    async def scenario():
+        nails = [await bot.create_post("nails", f"nail post {i}", 1, "ann") for i in range(45)]
+        other = [await bot.create_post("makeup", f"makeup post {i}", 2) for i in range(5)]
+        everything = nails + other
+
+        seen, pages = await collect("")
+        assert seen == everything[::-1] and pages == 3
+        seen, pages = await collect("Nails")
+        assert seen == nails[::-1] and pages == 3
+        seen, pages = await collect("makeup post")
+        assert sorted(seen) == other and pages == 1
+        seen, pages = await collect("nail")
+        assert sorted(seen) == nails and pages == 3
+        # a deleted post drops out of later pages instead of shifting them
+        first, offset = await bot._inline_rows("", "")
+        await bot.delete_post_db(everything[-bot.INLINE_PAGE_SIZE - 1])
+        rest, _ = await bot._inline_rows("", offset)
+        assert rest[0][0] == everything[-bot.INLINE_PAGE_SIZE - 2]
+
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+import asyncio
+import sqlite3
+
+import storage
+
+
+def test_maintenance_steps_under_constant_traffic(bot_db, monkeypatch):
+    bot = bot_db
+    # an update is always being handled, so the bot is never idle
+    monkeypatch.setattr(bot, "updates_in_flight", lambda: 1)
+    maintenance = bot.DbMaintenance(pause=0.01, max_wait=0.05)
+
+    async def scenario():
+        await asyncio.wait_for(maintenance.run_once(), 5)
+        # one forced prune step and at least one forced vacuum step
+        assert maintenance.runs == 1 and maintenance.forced_steps >= 2
+
+    asyncio.run(scenario())
+
+
+def test_auto_vacuum_conversion_needs_the_flag(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (x)").connection.close()
+    monkeypatch.setattr(storage, "DB_PATH", path)
+    engine = storage.SqliteStorage()
+    # an old file is left alone at startup unless the conversion is asked for
+    engine.migrate()
+    assert storage.get_db().execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    monkeypatch.setattr(storage, "DB_CONVERT_AUTO_VACUUM", True)
+    engine.migrate()
+    assert storage.get_db().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    engine.close()
@@ -0,0 +1,56 @@
+import time
+import asyncio
+
+import pytest
+
+
+def test_listing_photos_come_from_the_cache(bot_db, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "post_cache", bot.PostCache())
+    db_reads = []
+
+    async def counted(post_ids):
+        db_reads.append(post_ids)
+        return await original(post_ids)
+    original = bot._db_get_post_photos
+    monkeypatch.setattr(bot, "_db_get_post_photos", counted)
+
+    async def scenario():
+        a = await bot.create_post("nails", "pic", 1, photo=("file-1", "image-1"))
+        b = await bot.create_post("nails", "no pic", 1)
+        c = await bot.create_post("nails", "same image", 2, photo=("file-2", "image-1"))
+        want = [(a, "file-1"), (c, "file-1")]
+
+        # before the cache is loaded the db answers
+        assert sorted(await bot.get_post_photos((a, b, c))) == want
+        assert len(db_reads) == 1
+
+        bot.post_cache.load(reversed(await bot._db_get_all_posts()))
+        assert sorted(await bot.get_post_photos((a, b, c))) == want
+        has_posts, _ = await bot.render_listing("nails", ("n", None), "en")
+        assert has_posts and len(db_reads) == 1
+        # a post deleted after its page was read is skipped
+        await bot.delete_post_db(a)
+        assert await bot.get_post_photos((a, b, c)) == [(c, "file-1")]
+        assert len(db_reads) == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_delete_keeps_the_post_cached(bot_db, monkeypatch):
+    bot = bot_db
+    monkeypatch.setattr(bot, "post_cache", bot.PostCache())
+
+    async def failing(post_id):
+        raise RuntimeError("disk I/O error")
+
+    async def scenario():
+        pid = await bot.create_post("nails", "still here", 1)
+        bot.post_cache.load(reversed(await bot._db_get_all_posts()))
+        monkeypatch.setattr(bot, "_db_delete_post", failing)
+        with pytest.raises(RuntimeError):
+            await bot.delete_post_db(pid)
+        # the DB still has the post, so the cache must too
+        assert bot.post_cache.get(pid, int(time.time()))[0] == pid
+
+    asyncio.run(scenario())
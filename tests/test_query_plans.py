@@ -0,0 +1,98 @@
+"""Every statement SqliteStorage runs must reach its rows through an index."""
+import time
+
+from storage import Storage, get_db
+
+# methods that read a whole table on purpose, all off the request path
+FULL_READS = {
+    "get_all_posts",  # fills the post cache at startup
+    "get_expiry_schedule",  # rebuilds the expiry heap at startup
+    "pending_notifications",  # the outbox only holds posts still being fanned out
+}
+# the listing pages must come out of the index already in order
+KEYSET = {"get_posts_page", "list_users", "get_subscribers"}
+
+
+def _allowed(line: str) -> bool:
+    if not line.startswith("SCAN"):
+        return True
+    # a plain INSERT ... SELECT, or an FTS5 MATCH (index 0:M)
+    return line == "SCAN CONSTANT ROW" or "VIRTUAL TABLE INDEX 0:M" in line
+
+
+def _exercise(engine, run):
+    now = int(time.time())
+    for i in range(200):
+        engine.insert_post(("nails", "makeup", "massage")[i % 3], f"post number {i}", i % 20, "ann")
+    a = run("insert_post", "nails", "gel manicure", 1, "ann", 7200, ("file-1", "image-1"))
+    b = run("publish_paid_post", "nails", "paid", 1, "ann", 5, 3600, "post:1")[1]
+    key = (a[4], a[0])
+    run("get_posts", "nails")
+    run("get_post", a[0])
+    run("get_posts_by_id", [a[0], b[0]])
+    run("get_all_posts")
+    for category in (None, "nails"):
+        run("get_posts_page", category, None, "n", 10)
+        run("get_posts_page", category, key, "n", 10)
+        run("get_posts_page", category, key, "p", 10)
+    run("get_post_photos", [a[0], b[0]])
+    run("search_posts", "manic")
+    run("get_category_counts", now)
+    run("get_profile", 1, now)
+    run("get_expiry_schedule")
+    run("delete_post", b[0])
+    run("delete_expired", [a[0]])
+    run("prune_archive", now + 10)
+    run("vacuum_step", 1)
+    run("ensure_user", 3)
+    run("get_balance", 1)
+    run("wallet_transaction", 1, 5, "topup", "t1")
+    run("get_ledger", 1)
+    run("compact_ledger", now + 10)
+    run("list_users", None, "n", 2)
+    run("list_users", 2, "n", 2)
+    run("list_users", 3, "p", 2)
+    run("set_subscription", 1, "nails", "en", True)
+    run("set_subscription", 2, "nails", "ru", True)
+    run("get_subscriptions", 1)
+    run("get_subscribers", "nails")
+    run("get_subscribers", "nails", 1)
+    run("pending_notifications")
+    run("advance_notification", 1, 1)
+    run("finish_notification", 1)
+    run("remove_subscriber", 2)
+    run("save_user_states", {1: '{"lang": "en"}', 2: None})
+    run("load_user_state", 1)
+
+
+def test_every_query_uses_an_index(sqlite_storage):
+    db = get_db()
+    statements = []  # (method, sql)
+    current = []
+    db.set_trace_callback(lambda sql: statements.append((current[-1], sql)) if current else None)
+
+    def run(name, *args):
+        current.append(name)
+        try:
+            return getattr(sqlite_storage, name)(*args)
+        finally:
+            current.pop()
+
+    _exercise(sqlite_storage, run)
+    db.set_trace_callback(None)
+    called = {name for name, _ in statements}
+    assert Storage.__abstractmethods__ - {"migrate", "close"} <= called
+
+    failures = []
+    for name, sql in dict.fromkeys(statements):
+        verb = sql.split(None, 1)[0].upper()
+        # FTS5 reads its own shadow tables ('main'.'posts_fts_...') internally
+        if verb not in ("SELECT", "UPDATE", "DELETE", "INSERT") or "'main'." in sql:
+            continue
+        plan = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql)]
+        bad = [line for line in plan if not _allowed(line)]
+        if name in KEYSET:
+            bad += [line for line in plan if line.startswith("USE TEMP B-TREE")]
+        if bad and name not in FULL_READS:
+            failures.append(f"{name}: {' '.join(sql.split())}\n    {bad}")
+    assert not failures, "\n".join(failures)
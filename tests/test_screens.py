@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+        self.next_id = 100
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.next_id += 1
+        self.calls.append(("send", self.next_id))
+        return SimpleNamespace(message_id=self.next_id, chat_id=chat_id)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        self.calls.append(("edit", message_id))
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append(("delete", tuple(message_ids)))
+
+
+def tap(data: str, message_id: int):
+    async def answer(*args, **kwargs):
+        pass
+    message = SimpleNamespace(message_id=message_id, chat_id=1, is_accessible=True, photo=None)
+    query = SimpleNamespace(data=data, message=message, from_user=SimpleNamespace(id=7), answer=answer)
+    return SimpleNamespace(callback_query=query, effective_chat=SimpleNamespace(id=1))
+
+
+def test_button_on_notification_answers_there(bot_db):
+    bot = bot_db
+    context = SimpleNamespace(bot=FakeBot(), user_data={}, application=None)
+
+    async def scenario():
+        pid = await bot.create_post("nails", "hello", 9)
+        await bot.show_screen(context, 1, "categories")
+        screen = context.user_data["screen"]["message_id"]
+        context.bot.calls.clear()
+        # "Open" on a new-post notification that arrived below the screen: the
+        # post replaces the notification and the old screen is cleaned up
+        await bot.callback_handler(tap(f"view:{pid}", 55), context)
+        assert context.bot.calls == [("delete", (screen,)), ("edit", 55)]
+        assert context.user_data["screen"]["message_id"] == 55
+        # Back stays on that message
+        context.bot.calls.clear()
+        await bot.callback_handler(tap(f"cat:{bot.cat_code('nails')}", 55), context)
+        assert context.bot.calls == [("edit", 55)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,150 @@
+"""The Storage contract, run against every engine (see the engine fixture)."""
+import time
+
+from storage import WALLET_START_BALANCE, MemoryStorage
+
+
+def test_posts_and_pages(engine):
+    a = engine.insert_post("nails", "first nails post", 1, "ann")
+    b = engine.insert_post("nails", "second nails post", 2)
+    c = engine.insert_post("makeup", "makeup post", 1)
+    assert a[1:4] == ("nails", "first nails post", 1) and a[6] == "ann" and a[8] is None
+    assert tuple(engine.get_post(a[0])) == a
+    assert engine.get_post(10**9) is None
+    # newest first; posts from the same second are ordered by id
+    assert [r[0] for r in engine.get_all_posts()] == [c[0], b[0], a[0]]
+    assert [r[0] for r in engine.get_posts("nails")] == [b[0], a[0]]
+    assert tuple(engine.get_posts("nails")[0]) == (b[0], b[2], b[3], b[4], b[5], b[7])
+
+    # one page plus one row, then the next and previous pages from a cursor
+    page = engine.get_posts_page(None, None, "n", 2)
+    assert [r[0] for r in page] == [c[0], b[0], a[0]]
+    key = (page[1][4], page[1][0])
+    assert [r[0] for r in engine.get_posts_page(None, key, "n", 2)] == [a[0]]
+    assert [r[0] for r in engine.get_posts_page(None, (a[4], a[0]), "p", 2)] == [b[0], c[0]]
+    assert [r[0] for r in engine.get_posts_page("nails", None, "n", 1)] == [b[0], a[0]]
+
+
+def test_photos_are_deduplicated(engine):
+    a = engine.insert_post("nails", "pic", 1, photo=("file-1", "image-1"))
+    b = engine.insert_post("nails", "same image again", 2, photo=("file-2", "image-1"))
+    c = engine.insert_post("nails", "no pic", 2)
+    assert a[8] == b[8] == "file-1"
+    assert sorted(engine.get_post_photos([a[0], b[0], c[0]])) == [(a[0], "file-1"), (b[0], "file-1")]
+    assert engine.get_post(b[0])[8] == "file-1"
+
+
+def test_delete_expire_and_prune(engine):
+    a = engine.insert_post("nails", "deleted", 1)
+    b = engine.insert_post("nails", "expired", 1, expires_seconds=0)
+    c = engine.insert_post("nails", "kept", 1)
+    assert sorted(r[1] for r in engine.get_expiry_schedule()) == [a[0], b[0], c[0]]
+    engine.delete_post(a[0])
+    assert engine.get_post(a[0]) is None
+    assert engine.delete_expired([b[0]]) == 1
+    assert [r[1] for r in engine.get_expiry_schedule()] == [c[0]]
+    assert dict(engine.get_category_counts(int(time.time()))) == {"nails": 1}
+    if isinstance(engine, MemoryStorage):
+        # removed posts are not kept in memory
+        assert engine.prune_archive(int(time.time()) + 3600) == 0
+        return
+    # both went to the archive; only rows archived before the cutoff are dropped
+    assert engine.prune_archive(int(time.time()) - 3600) == 0
+    assert engine.prune_archive(int(time.time()) + 3600, batch_size=1) == 1
+    assert engine.prune_archive(int(time.time()) + 3600) == 1
+    assert engine.prune_archive(int(time.time()) + 3600) == 0
+
+
+def test_search(engine):
+    a = engine.insert_post("nails", "gel manicure with glitter", 1)
+    engine.insert_post("massage", "deep tissue massage", 1)
+    rows = engine.search_posts("manic")
+    assert [r[0] for r in rows] == [a[0]] and rows[0][1] == "nails"
+    assert engine.search_posts("pedicure") == []
+    assert engine.search_posts("") == []
+
+
+def test_counts_and_profile(engine):
+    now = int(time.time())
+    engine.insert_post("nails", "a", 1)
+    engine.insert_post("nails", "b", 1)
+    c = engine.insert_post("makeup", "c", 2)
+    # expired but not archived yet: no longer counted, as it is no longer listed
+    engine.insert_post("nails", "expired", 2, expires_seconds=0)
+    assert sorted(engine.get_category_counts(now)) == [("makeup", 1), ("nails", 2)]
+    balance, counts, posts = engine.get_profile(1, now)
+    assert balance == WALLET_START_BALANCE
+    assert list(counts) == [("nails", 2)]
+    assert [p[0] for p in posts] == ["nails", "nails"]
+    assert engine.get_profile(3, now) == (WALLET_START_BALANCE, [], [])
+    # a category whose last post is gone drops out of the counts
+    engine.delete_post(c[0])
+    assert sorted(engine.get_category_counts(now)) == [("nails", 2)]
+
+
+def test_wallet(engine):
+    assert engine.wallet_transaction(1, 50, "topup", "t1") == WALLET_START_BALANCE + 50
+    # replaying the key returns the first result without applying it again
+    assert engine.wallet_transaction(1, 50, "topup", "t1") == WALLET_START_BALANCE + 50
+    assert engine.wallet_transaction(1, -1000, "charge") is None
+    assert engine.get_balance(1) == WALLET_START_BALANCE + 50
+
+    pid, row = engine.publish_paid_post("nails", "paid", 1, "ann", 30, 3600, "post:1")
+    assert row[0] == pid and engine.get_balance(1) == WALLET_START_BALANCE + 20
+    assert engine.publish_paid_post("nails", "paid", 1, "ann", 30, 3600, "post:1") == (pid, None)
+    assert engine.publish_paid_post("nails", "too expensive", 1, "ann", 10**6, 3600, "post:2") is None
+    assert len(engine.get_all_posts()) == 1
+    # a free post charges nothing and writes no ledger row
+    free = engine.publish_paid_post("nails", "free", 5, None, 0, 3600, "post:3")
+    assert free[1][0] == free[0] and engine.get_ledger(5) == []
+    engine.delete_post(free[0])
+
+    ledger = engine.get_ledger(1)
+    assert [e[2] for e in ledger] == ["charge", "topup", "opening"]
+    assert ledger[0][3] == pid and ledger[0][4] == WALLET_START_BALANCE + 20
+    # folding everything leaves one checkpoint with the same balance
+    assert engine.compact_ledger(int(time.time()) + 3600) == 2
+    assert [e[4] for e in engine.get_ledger(1)] == [WALLET_START_BALANCE + 20]
+    assert engine.get_balance(1) == WALLET_START_BALANCE + 20
+
+
+def test_list_users(engine):
+    for uid in (5, 1, 3, 2, 4):
+        engine.ensure_user(uid)
+    assert [r[0] for r in engine.list_users(None, "n", 2)] == [1, 2, 3]
+    assert [r[0] for r in engine.list_users(2, "n", 2)] == [3, 4, 5]
+    assert [r[0] for r in engine.list_users(3, "p", 2)] == [2, 1]
+    assert engine.list_users(None, "n", 2)[0][1] == WALLET_START_BALANCE
+
+
+def test_subscriptions_and_outbox(engine):
+    engine.insert_post("nails", "before anyone subscribed", 9)
+    engine.set_subscription(1, "nails", "en", True)
+    engine.set_subscription(2, "nails", "en", True)
+    engine.set_subscription(2, "makeup", "ru", True)
+    assert engine.get_subscriptions(2) == {"nails", "makeup"}
+    # lang follows the user's latest choice on all of their subscriptions
+    assert list(map(tuple, engine.get_subscribers("nails"))) == [(1, "en"), (2, "ru")]
+    assert list(map(tuple, engine.get_subscribers("nails", after=1))) == [(2, "ru")]
+
+    pid = engine.insert_post("nails", "new", 9)[0]
+    engine.insert_post("massage", "nobody listens", 9)
+    assert list(map(tuple, engine.pending_notifications())) == [(pid, "nails", 9, None)]
+    engine.advance_notification(pid, 1)
+    assert list(map(tuple, engine.pending_notifications())) == [(pid, "nails", 9, 1)]
+    engine.finish_notification(pid)
+    assert list(engine.pending_notifications()) == []
+
+    engine.set_subscription(1, "nails", "en", False)
+    engine.remove_subscriber(2)
+    assert engine.get_subscriptions(2) == set()
+    assert list(engine.get_subscribers("nails")) == []
+
+
+def test_user_state(engine):
+    assert engine.load_user_state(1) is None
+    engine.save_user_states({1: '{"lang": "ru"}', 2: '{"lang": "en"}'})
+    assert engine.load_user_state(1) == {"lang": "ru"}
+    engine.save_user_states({1: None, 2: '{"lang": "ru"}'})
+    assert engine.load_user_state(1) is None
+    assert engine.load_user_state(2) == {"lang": "ru"}
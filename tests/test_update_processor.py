@@ -0,0 +1,42 @@
+import time
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+
+def message_update(update_id: int, uid: int) -> Update:
+    chat = Chat(uid, "private")
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=User(uid, "u", False), text="hi"))
+
+
+async def run_updates(processor, users, seconds: float = 0.1):
+    """Process one slow update per entry of users, in order; return finish times by index."""
+    started = time.perf_counter()
+    finished = {}
+
+    async def work(i):
+        await asyncio.sleep(seconds)
+        finished[i] = time.perf_counter() - started
+
+    tasks = []
+    for i, uid in enumerate(users):
+        tasks.append(asyncio.create_task(processor.process_update(message_update(i, uid), work(i))))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return finished
+
+
+def test_backlog_of_one_user_does_not_hold_slots(bot):
+    # four queued updates from user 1 and one from user 2 with four slots: the
+    # queued ones wait on user 1's lock without a slot, so user 2 runs at once
+    finished = asyncio.run(run_updates(bot.PerUserUpdateProcessor(4), [1, 1, 1, 1, 2]))
+    assert finished[4] < 0.15
+    assert sorted(finished[i] for i in range(4))[-1] > 0.35
+
+
+def test_slots_still_limit_different_users(bot):
+    finished = asyncio.run(run_updates(bot.PerUserUpdateProcessor(2), [1, 2, 3, 4]))
+    # two at a time: two finish after one update's time, two after two
+    assert sum(t < 0.15 for t in finished.values()) == 2
+    assert min(finished.values()) > 0.05 and max(finished.values()) > 0.15
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import storage
+from storage import WALLET_START_BALANCE
+
+PRICE = 7
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def paid_bot(request, bot_db, monkeypatch):
+    """The bot module on a fresh engine, with an empty post cache."""
+    if request.param == "memory":
+        engine = storage.MemoryStorage()
+        engine.migrate()
+        monkeypatch.setattr(bot_db, "storage", engine)
+    monkeypatch.setattr(bot_db, "post_cache", bot_db.PostCache())
+    return bot_db
+
+
+def test_concurrent_paid_posts_never_overdraw(paid_bot):
+    bot = paid_bot
+    affordable = WALLET_START_BALANCE // PRICE
+
+    async def scenario():
+        balances = []
+
+        async def watch():
+            while True:
+                balances.append(await bot.get_balance(1))
+                await asyncio.sleep(0)
+
+        watcher = asyncio.create_task(watch())
+        results = await asyncio.gather(*(
+            bot.publish_paid_post("nails", f"paid {i}", 1, "ann", PRICE, 3600, f"post:{i}") for i in range(50)
+        ))
+        watcher.cancel()
+        published = [pid for pid in results if pid is not None]
+        assert len(published) == affordable and len(set(published)) == affordable
+        assert min(balances) >= 0
+        assert await bot.get_balance(1) == WALLET_START_BALANCE - affordable * PRICE
+        assert all(entry[4] >= 0 for entry in await bot.get_ledger(1, 100))
+        assert len(await bot._db_get_all_posts()) == affordable
+
+        # a replayed key returns the post it created and charges nothing
+        i = results.index(published[0])
+        assert await bot.publish_paid_post("nails", f"paid {i}", 1, "ann", PRICE, 3600, f"post:{i}") == published[0]
+        assert await bot.get_balance(1) == WALLET_START_BALANCE - affordable * PRICE
+        # concurrent calls with one key, e.g. a double-tapped button, charge once
+        replays = await asyncio.gather(*(
+            bot.publish_paid_post("nails", "once", 2, "bob", PRICE, 3600, "post:once") for _ in range(10)
+        ))
+        assert len(set(replays)) == 1 and replays[0] is not None
+        assert await bot.get_balance(2) == WALLET_START_BALANCE - PRICE
+        assert len(await bot._db_get_all_posts()) == affordable + 1
+
+    asyncio.run(scenario())